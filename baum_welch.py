@@ -0,0 +1,273 @@
+"""baum_welch.py
+
+Unsupervised training of an HMM from untagged tweets with the Baum-Welch
+(EM) algorithm, starting from a model trained on tagged data.
+
+Each iteration runs the batched, scaled Forward-Backward algorithm of
+hmm_numpy over the corpus (the E-step) and sums the expected numbers of
+starts, transitions, ends and emissions.  Unlike the decoders of hmm.py,
+the E-step includes the transition into <E> in the likelihood and the
+posteriors, since the M-step re-estimates it as well.  The M-step turns
+these expected counts into new probabilities.  Maximum-likelihood
+re-estimation alone would take all the emission mass of a state away from
+the words that do not occur in the untagged corpus, and so wipe out most
+of the lexicon learned from tagged data after one iteration.  Each
+re-estimated emission distribution is therefore mixed with that of the
+initial model, which keeps the weight prior_weight (0.9 by default).
+
+With more than one worker, the batches are spread over a process pool,
+created once for the whole run: as in parallel_tagger, the model arrays
+are put in shared memory, which the workers attach to, and overwritten in
+place with the new model after each M-step.  The workers get word-id
+arrays and send back count tables, which are summed in batch order, so
+the result is the same as that of a serial run.
+
+Sequences that the current model cannot produce (probability 0) are
+skipped.  Words of the corpus that are not in the model's vocabulary are
+added before training, with every state's smallest nonzero emission
+probability, so that tweets containing them are not all skipped.
+
+The log-likelihood of the corpus under the model of each E-step, and the
+time and tokens/second of the iteration, are passed to a log function
+(print by default).
+
+Usage:
+    python baum_welch.py model.json corpus.json output.json
+        [--iterations N] [--workers N] [--batch-size N] [--tolerance T]
+        [--prior-weight W]
+"""
+
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+
+import hmm
+import hmm_numpy
+import parallel_tagger
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_PRIOR_WEIGHT = 0.9
+
+_worker_model = None
+_worker_shm = None
+
+
+class ExpectedCounts:
+    """ expected counts of starts, transitions, ends and emissions """
+
+    def __init__(self, n_words, n_states):
+        self.start = np.zeros(n_states)
+        self.trans = np.zeros((n_states, n_states))
+        self.end = np.zeros(n_states)
+        self.emission = np.zeros((n_words, n_states))
+        self.log_likelihood = 0.0
+        self.n_tokens = 0
+        self.n_skipped = 0
+
+    def add(self, batch):
+        """ add the counts returned by e_step for one batch """
+        start, trans, end, word_ids, emission, log_likelihood, n_tokens, \
+            n_skipped = batch
+        self.start += start
+        self.trans += trans
+        self.end += end
+        self.emission[word_ids] += emission
+        self.log_likelihood += log_likelihood
+        self.n_tokens += n_tokens
+        self.n_skipped += n_skipped
+
+
+def e_step(model, id_sequences):
+    """ expected counts for a batch of word-id arrays under a CompiledHMM.
+        Returns (start, trans, end, word_ids, emission rows of those word
+        ids, log-likelihood, number of tokens, number of skipped
+        sequences). """
+    lengths = np.array([len(ids) for ids in id_sequences], dtype=np.intp)
+    padded = np.full((len(id_sequences), lengths.max(initial=0)),
+                     model.oov_id, dtype=np.intp)
+    for b, ids in enumerate(id_sequences):
+        padded[b, :len(ids)] = ids
+    emissions = model.emission_columns(padded)
+    alphas, betas, totals = hmm_numpy.forward_backward_batch(
+        model, emissions, lengths, with_end=True)
+    valid = (totals > 0).all(axis=1) & (lengths > 0)
+    gamma = alphas * betas
+    gamma[~valid] = 0
+    n_states = len(model.states)
+    start = gamma[:, 0].sum(axis=0) if padded.shape[1] else \
+        np.zeros(n_states)
+    end = gamma[np.flatnonzero(valid), lengths[valid] - 1].sum(axis=0)
+    trans = np.zeros((n_states, n_states))
+    for t in range(padded.shape[1] - 1):
+        inside = valid & (lengths > t + 1)
+        if not inside.any():
+            continue
+        weights = emissions[inside, t + 1] * betas[inside, t + 1]
+        weights /= totals[inside, t + 1, None]
+        trans += np.einsum('bk,bs->ks', alphas[inside, t], weights)
+    trans *= model.trans
+    positions = valid[:, None] & \
+        (np.arange(padded.shape[1]) < lengths[:, None])
+    word_ids, inverse = np.unique(padded[positions], return_inverse=True)
+    emission = np.zeros((len(word_ids), n_states))
+    np.add.at(emission, inverse, gamma[positions])
+    log_likelihood = float(hmm_numpy.safe_log(totals[valid]).sum())
+    return (start, trans, end, word_ids, emission, log_likelihood,
+            int(lengths[valid].sum()), int((~valid).sum()))
+
+
+def m_step(model, counts, prior=None, prior_weight=0.0):
+    """ return a new CompiledHMM with the probabilities re-estimated from
+        counts.  Rows or columns without any expected count keep their old
+        probabilities.  With a prior emission matrix of the same shape,
+        each re-estimated emission distribution is mixed with that of the
+        prior, which gets the weight prior_weight. """
+    start = model.start.copy()
+    if counts.start.sum() > 0:
+        start = counts.start / counts.start.sum()
+    trans = model.trans.copy()
+    end = model.end.copy()
+    row_totals = counts.trans.sum(axis=1) + counts.end
+    rows = row_totals > 0
+    trans[rows] = counts.trans[rows] / row_totals[rows, None]
+    end[rows] = counts.end[rows] / row_totals[rows]
+    emission = model.emission.copy()
+    column_totals = counts.emission.sum(axis=0)
+    columns = column_totals > 0
+    emission[:-1, columns] = counts.emission[:, columns] / \
+        column_totals[columns]
+    if prior is not None and prior_weight > 0:
+        emission[:, columns] = (1 - prior_weight) * emission[:, columns] + \
+            prior_weight * prior[:, columns]
+    return hmm_numpy.CompiledHMM(model.states, model.vocabulary, start,
+                                 trans, end, emission,
+                                 word_ids=model.word_ids)
+
+
+def extend_vocabulary(model, words):
+    """ return a CompiledHMM whose vocabulary also has every word in words
+        that model does not know.  Each new word gets, for every state, the
+        smallest nonzero emission probability of that state, and then every
+        state's emission distribution is renormalized. """
+    new_words = [w for w in dict.fromkeys(words) if w not in model.word_ids]
+    if not new_words:
+        return model
+    known = model.emission[:-1]
+    floor = np.where(known > 0, known, np.inf).min(axis=0)
+    floor[np.isinf(floor)] = 0
+    emission = np.vstack([known, np.tile(floor, (len(new_words), 1)),
+                          np.zeros((1, len(floor)))])
+    column_totals = emission.sum(axis=0)
+    emission[:, column_totals > 0] /= column_totals[column_totals > 0]
+    vocabulary = list(model.vocabulary) + new_words
+    return hmm_numpy.CompiledHMM(model.states, vocabulary, model.start,
+                                 model.trans, model.end, emission)
+
+
+def _init_worker(handle):
+    global _worker_model, _worker_shm
+    _worker_shm, _worker_model = parallel_tagger.attach(handle)
+
+
+def _e_step_task(id_sequences):
+    """ worker task: expected counts for a batch of word-id arrays """
+    return e_step(_worker_model, id_sequences)
+
+
+def train(model, sequences, iterations=10, workers=1,
+          batch_size=DEFAULT_BATCH_SIZE, tolerance=1e-4, log=print,
+          prior_weight=DEFAULT_PRIOR_WEIGHT):
+    """ run Baum-Welch starting from model, an HMM, on sequences of words.
+        Stops after the given number of iterations, or when the
+        log-likelihood per token improves by less than tolerance.
+        prior_weight is the weight of the initial model's emissions in
+        each re-estimated emission distribution.  Returns a new HMM. """
+    compiled = extend_vocabulary(model.compile(),
+                                 (w for seq in sequences for w in seq))
+    prior = compiled.emission
+    id_batches = []
+    order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+    for first in range(0, len(order), batch_size):
+        id_batches.append([compiled.encode(sequences[i])
+                           for i in order[first:first + batch_size]])
+    shared = pool = None
+    if workers > 1:
+        shared = parallel_tagger.SharedModel(compiled)
+        pool = multiprocessing.Pool(workers, _init_worker,
+                                    (shared.handle(),))
+    try:
+        compiled = _iterate(compiled, id_batches, iterations, pool, shared,
+                            prior, prior_weight, tolerance, log)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            shared.close()
+    trained = hmm.HMM(backend=model.backend)
+    trained.set_parameters(compiled.to_parameters(),
+                           word_ids=compiled.word_ids, compiled=compiled)
+    return trained
+
+
+def _iterate(compiled, id_batches, iterations, pool, shared, prior,
+             prior_weight, tolerance, log):
+    """ the EM iterations of train; with a pool, its workers decode the
+        model in shared, which is updated after every M-step """
+    previous = None
+    for iteration in range(1, iterations + 1):
+        start_time = time.perf_counter()
+        counts = ExpectedCounts(len(compiled.vocabulary),
+                                len(compiled.states))
+        if pool is not None:
+            for result in pool.imap(_e_step_task, id_batches):
+                counts.add(result)
+        else:
+            for batch in id_batches:
+                counts.add(e_step(compiled, batch))
+        compiled = m_step(compiled, counts, prior, prior_weight)
+        if shared is not None:
+            shared.update(compiled)
+        elapsed = time.perf_counter() - start_time
+        per_token = counts.log_likelihood / max(counts.n_tokens, 1)
+        log("iteration %d: log-likelihood %.4f (%.4f per token), "
+            "%d tokens, %d sequences skipped, %.2f s, %.0f tokens/s"
+            % (iteration, counts.log_likelihood, per_token,
+               counts.n_tokens, counts.n_skipped, elapsed,
+               counts.n_tokens / elapsed if elapsed > 0 else 0))
+        if previous is not None and per_token - previous < tolerance:
+            break
+        previous = per_token
+    return compiled
+
+
+def read_sequences(filename):
+    """ read the words of every tweet in a JSONL file; tags are ignored """
+    with open(filename, 'r') as f:
+        return [parallel_tagger.tokens_of(json.loads(line)) for line in f]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Train an HMM on untagged tweets with Baum-Welch.')
+    parser.add_argument('model', help='initial (supervised) model file')
+    parser.add_argument('corpus', help='JSONL file of tweets')
+    parser.add_argument('output', help='JSON model file to write')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--tolerance', type=float, default=1e-4,
+                        help='stop when the log-likelihood per token '
+                             'improves by less than this')
+    parser.add_argument('--prior-weight', type=float,
+                        default=DEFAULT_PRIOR_WEIGHT,
+                        help='weight of the initial emission probabilities '
+                             'in the re-estimated ones')
+    args = parser.parse_args()
+    trained = train(hmm.HMM(args.model), read_sequences(args.corpus),
+                    iterations=args.iterations, workers=args.workers,
+                    batch_size=args.batch_size, tolerance=args.tolerance,
+                    prior_weight=args.prior_weight)
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(trained.compile().to_parameters()))
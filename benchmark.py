@@ -0,0 +1,625 @@
+"""benchmark.py
+
+Measures tagging throughput, in tokens per second, of the Forward and
+Viterbi algorithms in hmm.py, both one call per tweet and batched, on a
+JSONL file of tagged tweets such as twt.test.json.
+
+With --modes, it compares the exact Viterbi decoder with beam search and
+k-best decoding (see HMM.decode) for speed and accuracy.  With
+--posterior, it compares the cost and accuracy of posterior (max-marginal)
+decoding with those of viterbi_algorithm, and shows how many tokens and
+tweets fall below a few confidence thresholds.  With --trigram, it compares
+the trigram decoder of trigram_hmm with the first-order one on a trigram
+model file.  With --emission-cache, it times the dict backend with
+and without the emission cache of HMM.emission_column, from an empty cache
+and again once it holds the words of the file, and reports its hit rate
+and evictions.  With --cold-start, it instead measures, for each given model
+file, the time a fresh Python process takes to import hmm, load the model
+and tag one tweet, and that process's peak resident memory.  With
+--cli-cold-start, it times whole runs of the tag_tweets.py command on one
+tweet, without the model cache, on an empty one and with the model in it,
+and exits with status 1 if a run with the model cached takes longer than
+--budget seconds.
+
+With --suite, it runs every measurement that matters for regressions and
+writes them to a JSON file: model load time (in-process and cold start)
+and peak memory; tokens/s, per-tweet latency percentiles and peak traced
+memory of forward_algorithm and viterbi_algorithm on both backends and of
+the batch APIs; the time to train a model with hmm_trainer (the code behind
+the build_twitter_hmm scripts); the cold start of tag_tweets.py.  These run
+on the given tweet files and on synthetic inputs: long sequences of random
+vocabulary words, and a model trained on a random corpus with a large
+vocabulary.  Each result has a stable key, so --compare can check a new run
+against an older results file and report every metric that got worse by
+more than --tolerance.
+
+Usage:
+    python benchmark.py [model.json] [data.json] [--backend dict|numpy]
+                        [--limit N] [--no-prune]
+    python benchmark.py [model.json] [data.json] --modes [--limit N]
+    python benchmark.py [model.json] [data.json] --posterior [--limit N]
+    python benchmark.py trigram.json [data.json] --trigram [--limit N]
+    python benchmark.py [model.json] [data.json] --emission-cache
+                        [--max-bytes N] [--limit N] [--no-prune]
+    python benchmark.py --cold-start model.json model.hmmb ...
+                        [--backend dict|numpy] [--repeat N]
+    python benchmark.py --cli-cold-start model.json ... [--repeat N]
+                        [--budget SECONDS]
+    python benchmark.py [model.json] --suite results.json
+                        [--suite-data twt.dev.json twt.test.json ...]
+                        [--quick] [--compare old.json] [--tolerance T]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import hmm
+import hmm_metrics
+import hmm_trainer
+
+SUITE_VERSION = 1
+CLI_BUDGET = 0.5  # seconds for tag_tweets.py to tag one tweet, model cached
+
+
+def load_tagged(filename, limit=None):
+    """ read (tokens, tags) pairs from a JSONL file of tagged tweets """
+    tweets = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if limit is not None and len(tweets) >= limit:
+                break
+            twt = json.loads(line)
+            tweets.append(([item[0] for item in twt],
+                           [item[1] for item in twt]))
+    return tweets
+
+
+def load_sequences(filename, limit=None):
+    """ read the token sequences (tags dropped) from a JSONL tweet file """
+    return [tokens for tokens, tags in load_tagged(filename, limit)]
+
+
+def time_algorithm(algorithm, seqs):
+    """ run algorithm over every sequence; return (seconds, tokens/second) """
+    n_tokens = sum(len(seq) for seq in seqs)
+    start = time.perf_counter()
+    for seq in seqs:
+        algorithm(seq)
+    elapsed = time.perf_counter() - start
+    return elapsed, n_tokens / elapsed if elapsed > 0 else float('inf')
+
+
+def time_batch(algorithm, seqs):
+    """ run a batch algorithm once over all sequences; same return value
+        as time_algorithm """
+    n_tokens = sum(len(seq) for seq in seqs)
+    start = time.perf_counter()
+    algorithm(seqs)
+    elapsed = time.perf_counter() - start
+    return elapsed, n_tokens / elapsed if elapsed > 0 else float('inf')
+
+
+def run(model_file, data_file, backend='dict', limit=None, prune=True):
+    """ benchmark the per-sequence and batch algorithms and print one line
+        of results for each """
+    start = time.perf_counter()
+    model = hmm.HMM(model_file, backend=backend, prune=prune)
+    print("load_parameters: %.3f s" % (time.perf_counter() - start))
+    seqs = load_sequences(data_file, limit)
+    print("%d tweets, %d tokens, backend=%s, prune=%s"
+          % (len(seqs), sum(len(seq) for seq in seqs), backend, prune))
+    for name in ('forward_algorithm', 'viterbi_algorithm'):
+        elapsed, rate = time_algorithm(getattr(model, name), seqs)
+        print("%-18s %8.3f s %12.0f tokens/s" % (name, elapsed, rate))
+    for name in ('forward_batch', 'viterbi_batch'):
+        elapsed, rate = time_batch(getattr(model, name), seqs)
+        print("%-18s %8.3f s %12.0f tokens/s" % (name, elapsed, rate))
+
+
+def run_modes(model_file, data_file, backend='dict', limit=None,
+              beams=(1, 2, 4, 8), k=5):
+    """ compare the exact Viterbi decoder with beam search at several beam
+        widths and with k-best decoding: tokens/s, accuracy against the
+        gold tags, and agreement with the exact tags """
+    model = hmm.HMM(model_file, backend=backend)
+    model.compile()
+    tweets = load_tagged(data_file, limit)
+    exact = [model.viterbi_algorithm(tokens) for tokens, tags in tweets]
+    configs = [('viterbi', {})]
+    configs += [('beam', {'beam': beam}) for beam in beams]
+    configs += [('kbest', {'k': k})]
+    print("%-12s %12s %9s %9s" % ('mode', 'tokens/s', 'accuracy', 'agree'))
+    for mode, options in configs:
+        elapsed, rate = time_algorithm(
+            lambda tokens: model.decode(tokens, mode, **options),
+            [tokens for tokens, tags in tweets])
+        correct = agree = total = 0
+        for (tokens, tags), reference in zip(tweets, exact):
+            found = model.decode(tokens, mode, **options)
+            if mode == 'kbest':
+                found = found[0][1] if found else reference
+            total += len(tags)
+            correct += sum(a == b for a, b in zip(found, tags))
+            agree += sum(a == b for a, b in zip(found, reference))
+        name = mode + ''.join('=%d' % v for v in options.values())
+        print("%-12s %12.0f %8.2f%% %8.2f%%"
+              % (name, rate, 100 * correct / total, 100 * agree / total))
+
+
+def run_posterior(model_file, data_file, backend='dict', limit=None,
+                  thresholds=(0.5, 0.9, 0.99)):
+    """ compare viterbi_algorithm with posterior_decode, one call per tweet
+        and batched, then print, for each confidence threshold, the share
+        of tokens at or above it and their accuracy, and the share of
+        tweets with some token below it """
+    model = hmm.HMM(model_file, backend=backend)
+    model.compile()
+    tweets = load_tagged(data_file, limit)
+    seqs = [tokens for tokens, tags in tweets]
+    print("%d tweets, %d tokens, backend=%s"
+          % (len(seqs), sum(len(seq) for seq in seqs), backend))
+    print("%-24s %8s %12s %9s" % ('algorithm', 'seconds', 'tokens/s',
+                                 'accuracy'))
+    viterbi = [model.viterbi_algorithm(seq) for seq in seqs]
+    posterior = model.posterior_decode_batch(seqs)
+    runs = [('viterbi_algorithm', time_algorithm, model.viterbi_algorithm,
+             viterbi),
+            ('viterbi_batch', time_batch, model.viterbi_batch, viterbi),
+            ('posterior_decode', time_algorithm, model.posterior_decode,
+             [states for states, confidences in posterior]),
+            ('posterior_decode_batch', time_batch,
+             model.posterior_decode_batch,
+             [states for states, confidences in posterior])]
+    for name, timer, algorithm, paths in runs:
+        elapsed, rate = timer(algorithm, seqs)
+        correct = sum(a == b for (tokens, tags), path in zip(tweets, paths)
+                      for a, b in zip(path, tags))
+        total = sum(len(tags) for tokens, tags in tweets)
+        print("%-24s %8.3f %12.0f %8.2f%%"
+              % (name, elapsed, rate, 100 * correct / total))
+    print("%-10s %10s %10s %12s" % ('threshold', 'tokens', 'accuracy',
+                                    'tweets below'))
+    for threshold in thresholds:
+        kept = correct = tweets_below = 0
+        for (tokens, tags), (states, confidences) in zip(tweets, posterior):
+            if any(c < threshold for c in confidences):
+                tweets_below += 1
+            for state, tag, c in zip(states, tags, confidences):
+                if c >= threshold:
+                    kept += 1
+                    correct += state == tag
+        total = sum(len(tags) for tokens, tags in tweets)
+        print("%-10g %9.2f%% %9.2f%% %11.2f%%"
+              % (threshold, 100 * kept / total,
+                 100 * correct / kept if kept else 0,
+                 100 * tweets_below / len(tweets)))
+
+
+def run_trigram(model_file, data_file, limit=None, beams=(None, 1000, 100)):
+    """ compare the trigram decoder, exhaustive and pruned with several
+        beams, with the first-order Viterbi decoder on a trigram model file:
+        tokens/s, accuracy, and agreement with the exhaustive trigram tags """
+    import trigram_hmm
+    tweets = load_tagged(data_file, limit)
+    seqs = [tokens for tokens, tags in tweets]
+    configs = [('trigram exhaustive',
+                trigram_hmm.TrigramHMM(model_file, prune=False)),
+               ('first-order', hmm.HMM(model_file, backend='numpy'))]
+    configs += [('trigram beam=%s' % beam,
+                 trigram_hmm.TrigramHMM(model_file, beam=beam))
+                for beam in beams]
+    print("%-22s %12s %9s %9s" % ('decoder', 'tokens/s', 'accuracy',
+                                  'agree'))
+    exact = None
+    total = sum(len(tags) for tokens, tags in tweets)
+    for name, model in configs:
+        elapsed, rate = time_algorithm(model.viterbi_algorithm, seqs)
+        paths = [model.viterbi_algorithm(seq) for seq in seqs]
+        if exact is None:
+            exact = paths
+        correct = sum(a == b for (tokens, tags), path in zip(tweets, paths)
+                      for a, b in zip(path, tags))
+        agree = sum(a == b for reference, path in zip(exact, paths)
+                    for a, b in zip(path, reference))
+        print("%-22s %12.0f %8.2f%% %8.2f%%"
+              % (name, rate, 100 * correct / total, 100 * agree / total))
+
+
+def run_emission_cache(model_file, data_file, limit=None, prune=True,
+                       max_bytes=None):
+    """ time forward_algorithm and viterbi_algorithm on the dict backend
+        with no emission cache (a size of 0), then with one of max_bytes
+        (the default size if None), first empty and then warm, and print
+        the hit rate and evictions of each pass """
+    import emission_cache
+    if max_bytes is None:
+        max_bytes = emission_cache.DEFAULT_MAX_BYTES
+    model = hmm.HMM(model_file, prune=prune)
+    seqs = load_sequences(data_file, limit)
+    print("%d tweets, %d tokens, prune=%s, max_bytes=%d"
+          % (len(seqs), sum(len(seq) for seq in seqs), prune, max_bytes))
+    print("%-18s %-9s %8s %12s %8s %9s %9s"
+          % ('algorithm', 'cache', 'seconds', 'tokens/s', 'speedup',
+             'hit rate', 'evictions'))
+    for name in ('forward_algorithm', 'viterbi_algorithm'):
+        algorithm = getattr(model, name)
+        baseline = None
+        for label, size in (('none', 0), ('cold', max_bytes),
+                            ('warm', None)):
+            if size is not None:
+                cache = model.set_emission_cache(size)
+            before = cache.stats()
+            elapsed, rate = time_algorithm(algorithm, seqs)
+            after = cache.stats()
+            hits = after['hits'] - before['hits']
+            lookups = hits + after['misses'] - before['misses']
+            if baseline is None:
+                baseline = elapsed
+            print("%-18s %-9s %8.3f %12.0f %7.2fx %8.2f%% %9d"
+                  % (name, label, elapsed, rate, baseline / elapsed,
+                     100 * hits / lookups if lookups else 0,
+                     after['evictions'] - before['evictions']))
+
+
+COLD_START_SCRIPT = """
+import resource, sys, time
+start = time.perf_counter()
+import hmm
+model = hmm.HMM(sys.argv[1], backend=sys.argv[2])
+model.viterbi_algorithm(['RT', '@user', ':', 'hello'])
+elapsed = time.perf_counter() - start
+# ru_maxrss survives exec on Linux, so it can be the parent's peak; the
+# VmHWM line of /proc/self/status is this process's own.
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                peak = int(line.split()[1])
+except OSError:
+    pass
+print(elapsed, peak)
+"""
+
+
+def cold_start(model_file, backend='dict'):
+    """ load model_file and tag one tweet in a new interpreter; return
+        (seconds, peak RSS in KiB) as measured inside that process """
+    out = subprocess.run(
+        [sys.executable, '-c', COLD_START_SCRIPT,
+         os.path.abspath(model_file), backend],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True, capture_output=True, text=True).stdout.split()
+    return float(out[0]), int(out[1])
+
+
+def run_cold_start(model_files, backend='dict', repeat=3):
+    """ print the best cold-start time and the peak RSS of each model """
+    for model_file in model_files:
+        results = [cold_start(model_file, backend) for i in range(repeat)]
+        print("%-40s %8.3f s %10d KiB peak RSS"
+              % (model_file, min(r[0] for r in results),
+                 max(r[1] for r in results)))
+
+
+def cli_cold_start(model_file, cache_dir=None, cache=True):
+    """ the seconds a new tag_tweets.py process takes to tag one tweet
+        read from standard input, timed from outside, so they include the
+        interpreter's own startup """
+    command = [sys.executable, 'tag_tweets.py', os.path.abspath(model_file)]
+    if not cache:
+        command.append('--no-cache')
+    elif cache_dir is not None:
+        command += ['--cache-dir', cache_dir]
+    start = time.perf_counter()
+    subprocess.run(command, input='RT @user : hello\n',
+                   cwd=os.path.dirname(os.path.abspath(__file__)),
+                   check=True, capture_output=True, text=True)
+    return time.perf_counter() - start
+
+
+def measure_cli_cold_start(model_file, repeat=3):
+    """ the best cold-start time of tag_tweets.py on a model file without
+        the model cache, the time of the first run with an empty cache,
+        and the best time once the model is in it """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        return {'no_cache_seconds': min(
+                    cli_cold_start(model_file, cache=False)
+                    for i in range(repeat)),
+                'first_run_seconds': cli_cold_start(model_file, cache_dir),
+                'seconds': min(cli_cold_start(model_file, cache_dir)
+                               for i in range(repeat))}
+
+
+def run_cli_cold_start(model_files, repeat=3, budget=CLI_BUDGET):
+    """ print the cold-start times of tag_tweets.py on each model; return
+        the models for which the cached time is over budget """
+    over = []
+    print("%-40s %10s %10s %10s" % ('model', 'no cache', 'first run',
+                                    'cached'))
+    for model_file in model_files:
+        metrics = measure_cli_cold_start(model_file, repeat)
+        print("%-40s %8.3f s %8.3f s %8.3f s%s"
+              % (model_file, metrics['no_cache_seconds'],
+                 metrics['first_run_seconds'], metrics['seconds'],
+                 '' if metrics['seconds'] <= budget
+                 else '  over the %.3f s budget' % budget))
+        if metrics['seconds'] > budget:
+            over.append(model_file)
+    return over
+
+
+def peak_memory(function, *args):
+    """ call function and return the peak memory, in KiB, that tracemalloc
+        saw allocated during the call """
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def measure_calls(algorithm, seqs, memory_sample=100):
+    """ run algorithm once per sequence; return tokens, seconds, tokens/s,
+        per-call latency percentiles in ms, and the peak traced memory of a
+        second run over the first memory_sample sequences """
+    latencies = []
+    for seq in seqs:
+        start = time.perf_counter()
+        algorithm(seq)
+        latencies.append(time.perf_counter() - start)
+    n_tokens = sum(len(seq) for seq in seqs)
+    elapsed = sum(latencies)
+    metrics = {'tokens': n_tokens, 'seconds': elapsed,
+               'tokens_per_s': n_tokens / elapsed if elapsed > 0 else 0}
+    for q in hmm_metrics.PERCENTILES:
+        metrics['p%d_ms' % q] = 1000 * hmm_metrics.percentile(latencies, q)
+    metrics['max_ms'] = 1000 * max(latencies, default=0)
+    metrics['peak_kib'] = peak_memory(
+        lambda: [algorithm(seq) for seq in seqs[:memory_sample]])
+    return metrics
+
+
+def measure_batch(algorithm, seqs):
+    """ run a batch algorithm once over all sequences; return tokens,
+        seconds, tokens/s and the peak traced memory of a second run """
+    elapsed, rate = time_batch(algorithm, seqs)
+    return {'tokens': sum(len(seq) for seq in seqs), 'seconds': elapsed,
+            'tokens_per_s': rate, 'peak_kib': peak_memory(algorithm, seqs)}
+
+
+def measure_load(model_file, backend):
+    """ in-process load time of a model file, and the cold-start time and
+        peak RSS of a fresh process (see cold_start) """
+    start = time.perf_counter()
+    hmm.HMM(model_file, backend=backend)
+    seconds = time.perf_counter() - start
+    cold_seconds, peak_rss = cold_start(model_file, backend)
+    return {'seconds': seconds, 'cold_start_seconds': cold_seconds,
+            'peak_rss_kib': peak_rss}
+
+
+def measure_training(filenames, smoothing):
+    """ time HMMTrainer on filenames, from counting to the parameters """
+    def build():
+        return hmm_trainer.train(filenames, smoothing).parameters()
+    start = time.perf_counter()
+    build()
+    seconds = time.perf_counter() - start
+    n_tokens = 0
+    for filename in filenames:
+        n_tokens += sum(len(tokens) for tokens, tags in load_tagged(filename))
+    return {'tokens': n_tokens, 'seconds': seconds,
+            'tokens_per_s': n_tokens / seconds if seconds > 0 else 0,
+            'peak_kib': peak_memory(build)}
+
+
+def synthetic_sequences(vocabulary, n_seqs, length, seed=0):
+    """ n_seqs sequences of length random words from vocabulary """
+    rng = random.Random(seed)
+    vocabulary = list(vocabulary)
+    return [[rng.choice(vocabulary) for i in range(length)]
+            for j in range(n_seqs)]
+
+
+def synthetic_corpus(filename, vocabulary_size, n_tweets, length=15,
+                     seed=0):
+    """ write a JSONL file of n_tweets random tagged tweets whose words are
+        drawn, roughly by Zipf's law, from vocabulary_size words; every
+        word is used at least once """
+    rng = random.Random(seed)
+    tags = [s for s in hmm_trainer.TWITTER_S if s not in ('<S>', '<E>')]
+    words = ['w%d' % i for i in range(vocabulary_size)]
+    unused = list(words)
+    rng.shuffle(unused)
+    with open(filename, 'w') as f:
+        for i in range(n_tweets):
+            tweet = []
+            for j in range(length):
+                if unused:
+                    word = unused.pop()
+                else:
+                    word = words[min(int(rng.paretovariate(1)) - 1,
+                                     vocabulary_size - 1)]
+                tweet.append([word, rng.choice(tags)])
+            f.write(json.dumps(tweet) + '\n')
+
+
+def run_suite(model_file, data_files, output, backends=hmm.BACKENDS,
+              quick=False):
+    """ run the benchmark suite and write the results to output as JSON.
+        quick shrinks the inputs, for a fast smoke run. """
+    limit = 500 if quick else None
+    results = {}
+
+    def record(key, metrics):
+        results[key] = metrics
+        print("%-50s %s" % (key, ' '.join(
+            '%s=%.4g' % item for item in sorted(metrics.items()))))
+
+    for backend in backends:
+        record('load/%s/%s' % (os.path.basename(model_file), backend),
+               measure_load(model_file, backend))
+    record('cold_start/tag_tweets/%s' % os.path.basename(model_file),
+           measure_cli_cold_start(model_file))
+    models = {backend: hmm.HMM(model_file, backend=backend)
+              for backend in backends}
+    inputs = [(os.path.basename(name), load_sequences(name, limit))
+              for name in data_files]
+    vocabulary = models[backends[0]].O
+    inputs.append(('synthetic-long', synthetic_sequences(
+        vocabulary, 5 if quick else 20, 500 if quick else 2000)))
+    for name, seqs in inputs:
+        for backend, model in models.items():
+            for algorithm in ('forward_algorithm', 'viterbi_algorithm'):
+                record('%s/%s/%s' % (algorithm, backend, name),
+                       measure_calls(getattr(model, algorithm), seqs))
+        model = models[backends[-1]]
+        for algorithm in ('forward_batch', 'viterbi_batch'):
+            record('%s/%s' % (algorithm, name),
+                   measure_batch(getattr(model, algorithm), seqs))
+    smoothings = (('none', hmm_trainer.MaximumLikelihood()),
+                  ('add-alpha', hmm_trainer.AddAlpha()))
+    for name in data_files:
+        for smoothing_name, smoothing in smoothings:
+            record('train/%s/%s' % (smoothing_name, os.path.basename(name)),
+                   measure_training([name], smoothing))
+    vocabulary_size = 20000 if quick else 200000
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = os.path.join(directory, 'synthetic.json')
+        synthetic_model = os.path.join(directory, 'synthetic_model.json')
+        synthetic_corpus(corpus, vocabulary_size, vocabulary_size // 10)
+        record('train/none/synthetic-vocab',
+               measure_training([corpus], hmm_trainer.MaximumLikelihood()))
+        hmm_trainer.train([corpus]).write_model(synthetic_model)
+        seqs = synthetic_sequences(['w%d' % i for i in range(vocabulary_size)],
+                                   200 if quick else 2000, 15, seed=1)
+        for backend in backends:
+            record('load/synthetic-vocab/%s' % backend,
+                   measure_load(synthetic_model, backend))
+            model = hmm.HMM(synthetic_model, backend=backend)
+            for algorithm in ('forward_algorithm', 'viterbi_algorithm'):
+                record('%s/%s/synthetic-vocab' % (algorithm, backend),
+                       measure_calls(getattr(model, algorithm), seqs))
+    with open(output, 'w') as f:
+        json.dump({'version': SUITE_VERSION, 'meta': suite_meta(quick),
+                   'results': results}, f, indent=1, sort_keys=True)
+    return results
+
+
+def suite_meta(quick):
+    """ where and on what code a suite run happened """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=directory, check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(), 'quick': quick}
+
+
+def compare(baseline_file, results, tolerance=0.2):
+    """ print every metric of results that is worse than in the results
+        file baseline_file by more than the fraction tolerance; tokens/s
+        should go up, everything else down.  Returns the list of
+        (key, metric, old, new) regressions. """
+    with open(baseline_file, 'r') as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        for metric, new in sorted(metrics.items()):
+            old = baseline.get(key, {}).get(metric)
+            if not old or metric == 'tokens':
+                continue
+            if metric.endswith('_per_s'):
+                worse = new < old * (1 - tolerance)
+            else:
+                worse = new > old * (1 + tolerance)
+            if worse:
+                regressions.append((key, metric, old, new))
+                print("REGRESSION %-50s %-18s %12.4g -> %12.4g"
+                      % (key, metric, old, new))
+    if not regressions:
+        print("no regressions beyond %d%%" % (100 * tolerance))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('model', nargs='?',
+                        default='twitter_pos_hmm_laplace.json')
+    parser.add_argument('data', nargs='?', default='twt.test.json')
+    parser.add_argument('--backend', default='dict', choices=hmm.BACKENDS)
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only use the first LIMIT tweets')
+    parser.add_argument('--no-prune', dest='prune', action='store_false',
+                        help='expand every state at every position')
+    parser.add_argument('--modes', action='store_true',
+                        help='compare the decoding modes of HMM.decode')
+    parser.add_argument('--posterior', action='store_true',
+                        help='compare posterior decoding with Viterbi')
+    parser.add_argument('--trigram', action='store_true',
+                        help='compare the trigram and first-order decoders')
+    parser.add_argument('--emission-cache', action='store_true',
+                        help='measure the emission cache of the dict backend')
+    parser.add_argument('--max-bytes', type=int, default=None,
+                        help='size of the emission cache, in bytes')
+    parser.add_argument('--cold-start', nargs='+', metavar='MODEL',
+                        help='measure process cold start for these models')
+    parser.add_argument('--cli-cold-start', nargs='+', metavar='MODEL',
+                        help='measure tag_tweets.py cold start on these '
+                             'models')
+    parser.add_argument('--budget', type=float, default=CLI_BUDGET,
+                        help='seconds allowed for a cached tag_tweets.py run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='cold-start runs per model (best time kept)')
+    parser.add_argument('--suite', metavar='RESULTS',
+                        help='run the benchmark suite, writing JSON here')
+    parser.add_argument('--suite-data', nargs='+',
+                        default=['twt.dev.json', 'twt.test.json'],
+                        help='tweet files for the suite')
+    parser.add_argument('--quick', action='store_true',
+                        help='run the suite on smaller inputs')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='check the suite results against this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='fraction by which a metric may get worse')
+    args = parser.parse_args()
+    if args.suite:
+        results = run_suite(args.model, args.suite_data, args.suite,
+                            quick=args.quick)
+        if args.compare and compare(args.compare, results, args.tolerance):
+            sys.exit(1)
+    elif args.modes:
+        run_modes(args.model, args.data, backend=args.backend,
+                  limit=args.limit)
+    elif args.posterior:
+        run_posterior(args.model, args.data, backend=args.backend,
+                      limit=args.limit)
+    elif args.trigram:
+        run_trigram(args.model, args.data, limit=args.limit)
+    elif args.emission_cache:
+        run_emission_cache(args.model, args.data, limit=args.limit,
+                           prune=args.prune, max_bytes=args.max_bytes)
+    elif args.cli_cold_start:
+        if run_cli_cold_start(args.cli_cold_start, repeat=args.repeat,
+                              budget=args.budget):
+            sys.exit(1)
+    elif args.cold_start:
+        run_cold_start(args.cold_start, backend=args.backend,
+                       repeat=args.repeat)
+    else:
+        run(args.model, args.data, backend=args.backend, limit=args.limit,
+            prune=args.prune)
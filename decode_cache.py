@@ -0,0 +1,228 @@
+"""decode_cache.py
+
+Caches for the decoding results of an HMM, for traffic that repeats itself:
+retweets and spam repeat whole token sequences, and many tweets start
+with the same few tokens ("RT @user :").
+
+DecodeCache is a bounded LRU cache of whole results, with an optional time
+to live.  Keys are a hash of the model version (HMM.model_version), the
+algorithm and the token sequence, so one cache can be shared by several
+models.  It counts hits, misses, evictions and expirations.
+
+PrefixCache keeps a trie of the first tokens of the sequences it has seen.
+Each node holds what the Forward and Viterbi algorithms computed at that
+position: the belief vector, and the Viterbi scores and back pointers,
+each filled in the first time that algorithm reaches the node.  A new
+sequence resumes from the node of its longest known prefix, so only the
+rest of it is computed.  It runs on the array
+form of the model (see hmm_numpy), with the same arithmetic as
+CompiledHMM.forward and CompiledHMM.viterbi, so the results are identical
+to theirs.
+
+HMM.enable_cache puts both in front of forward_algorithm and
+viterbi_algorithm.
+"""
+
+import collections
+import hashlib
+import json
+import time
+
+import numpy as np
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_PREFIX_DEPTH = 8
+DEFAULT_PREFIX_NODES = 100000
+
+
+class DecodeCache:
+    """ bounded LRU cache of decoding results, with optional expiry """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=None):
+        """ maxsize is the number of results kept; ttl, if not None, the
+            number of seconds after which a result is dropped """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(version, algorithm, obs_sequence):
+        """ the cache key of running algorithm on obs_sequence with the
+            model of the given version """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([version, algorithm, list(obs_sequence)],
+                                 ensure_ascii=False).encode('utf-8'))
+        return digest.digest()
+
+    def get(self, key):
+        """ the result stored under key, or None """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires = entry
+        if expires is not None and time.monotonic() >= expires:
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """ store value under key, evicting the least recently used result
+            if the cache is full """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self.entries[key] = (value, expires)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """ drop every result; the statistics are kept """
+        self.entries.clear()
+
+    def stats(self):
+        """ hits, misses, hit rate, evictions, expirations and size """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'expirations': self.expirations,
+                'size': len(self.entries)}
+
+
+class _Node:
+    """ the Forward and Viterbi columns of one position of a prefix, each
+        computed the first time it is needed """
+
+    __slots__ = ('children', 'parent', 'belief', 'scores', 'back_ptrs')
+
+    def __init__(self, parent):
+        self.children = {}
+        self.parent = parent
+        self.belief = None
+        self.scores = None
+        self.back_ptrs = None
+
+
+class PrefixCache:
+    """ trie of the Forward and Viterbi columns of sequence prefixes for one
+        CompiledHMM """
+
+    def __init__(self, model, max_depth=DEFAULT_PREFIX_DEPTH,
+                 max_nodes=DEFAULT_PREFIX_NODES):
+        """ the first max_depth tokens of each sequence are kept, in at most
+            max_nodes nodes; when they are all used the trie is emptied """
+        self.model = model
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.root = {}
+        self.n_nodes = 0
+        self.reused = 0
+        self.computed = 0
+        self.resets = 0
+
+    def _prefix(self, obs_sequence, emissions, algorithm):
+        """ the nodes of the first positions of obs_sequence, up to
+            max_depth, with the columns of algorithm ('forward' or
+            'viterbi') filled in, creating the nodes not yet in the trie """
+        model = self.model
+        nodes = []
+        children = self.root
+        parent = None
+        for t, obs in enumerate(obs_sequence[:self.max_depth]):
+            node = children.get(obs)
+            if node is None:
+                if self.n_nodes >= self.max_nodes:
+                    self.root = {}
+                    self.n_nodes = 0
+                    self.resets += 1
+                    return nodes
+                node = _Node(parent)
+                children[obs] = node
+                self.n_nodes += 1
+            e = emissions[t]
+            if algorithm == 'forward' and node.belief is None:
+                if parent is None:
+                    belief = model.start * e
+                else:
+                    belief = np.einsum('k,ks->s', parent.belief,
+                                       model.trans) * e
+                total = belief.sum()
+                if total > 0:
+                    belief /= total
+                node.belief = belief
+                self.computed += 1
+            elif algorithm == 'viterbi' and node.scores is None:
+                if parent is None:
+                    node.scores = model.start * e
+                else:
+                    candidates = parent.scores[:, None] * model.trans * e
+                    node.back_ptrs = candidates.argmax(axis=0)
+                    node.scores = candidates.max(axis=0)
+                self.computed += 1
+            else:
+                self.reused += 1
+            nodes.append(node)
+            parent = node
+            children = node.children
+        return nodes
+
+    def forward(self, obs_sequence):
+        """ the belief vectors of obs_sequence, as CompiledHMM.forward """
+        model = self.model
+        emissions = model.emissions(obs_sequence)
+        nodes = self._prefix(obs_sequence, emissions, 'forward')
+        beliefs = [node.belief for node in nodes]
+        prev = beliefs[-1] if beliefs else None
+        for e in emissions[len(nodes):]:
+            if prev is None:
+                dist = model.start * e
+            else:
+                dist = np.einsum('k,ks->s', prev, model.trans) * e
+            total = dist.sum()
+            if total > 0:
+                dist /= total
+            beliefs.append(dist)
+            prev = dist
+        return beliefs
+
+    def viterbi(self, obs_sequence):
+        """ the most probable state sequence, as CompiledHMM.viterbi """
+        model = self.model
+        if len(obs_sequence) == 0:
+            return []
+        emissions = model.emissions(obs_sequence)
+        nodes = self._prefix(obs_sequence, emissions, 'viterbi')
+        back_ptrs = []
+        if nodes:
+            v = nodes[-1].scores
+            rest = emissions[len(nodes):]
+        else:
+            v = model.start * emissions[0]
+            rest = emissions[1:]
+        for e in rest:
+            scores = v[:, None] * model.trans * e
+            back_ptrs.append(scores.argmax(axis=0))
+            v = scores.max(axis=0)
+        path = [int(v.argmax())]
+        for row in reversed(back_ptrs):
+            path.append(int(row[path[-1]]))
+        node = nodes[-1] if nodes else None
+        while node is not None and node.back_ptrs is not None:
+            path.append(int(node.back_ptrs[path[-1]]))
+            node = node.parent
+        path.reverse()
+        return [model.states[i] for i in path]
+
+    def stats(self):
+        """ positions reused from and added to the trie, its size, and the
+            number of times it was emptied """
+        return {'reused': self.reused, 'computed': self.computed,
+                'nodes': self.n_nodes, 'resets': self.resets}
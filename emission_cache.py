@@ -0,0 +1,79 @@
+"""emission_cache.py
+
+A memo of the emission column of each word, for the dict backend of hmm.py.
+
+At every position the dict algorithms need P(obs | s) for each state s,
+which is a probe of P_emission[s] per state, or a call to the OOV model
+(see oov_model.py) for words outside O.  The column depends only on the
+word, and tweets share many words ("RT", ":", "I"), so EmissionCache
+computes it once per distinct word and keeps it, as a dict {s: P(obs | s)}
+of the states, in the order of S, whose probability is above 0.  Its keys
+are also the states that the pruned algorithms expand (see
+HMM.allowed_states).
+
+The cache is bounded by the memory its entries hold, estimated with
+sys.getsizeof (the probabilities themselves are shared with P_emission),
+and drops the least recently used words beyond max_bytes.  It counts
+hits, misses and evictions.
+
+The numpy backend and the batch APIs do not need it: hmm_numpy already
+holds every in-vocabulary column in its dense emission matrix, and the OOV
+model memoizes the columns of unknown words.
+"""
+
+import collections
+import sys
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+
+class EmissionCache:
+    """ bounded LRU cache of emission columns, sized in bytes """
+
+    def __init__(self, compute, max_bytes=DEFAULT_MAX_BYTES):
+        """ compute(obs) returns the column of a word.  max_bytes bounds
+            the estimated size of the cached entries. """
+        self.compute = compute
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def size(obs, column):
+        """ the estimated bytes held by the entry of a word """
+        return sys.getsizeof(obs) + sys.getsizeof(column)
+
+    def get(self, obs):
+        """ the column of a word, computed on a miss """
+        entry = self.entries.get(obs)
+        if entry is not None:
+            self.entries.move_to_end(obs)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = self.compute(obs)
+        size = self.size(obs, value)
+        if size <= self.max_bytes:
+            self.entries[obs] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, dropped) = self.entries.popitem(last=False)
+                self.bytes -= dropped
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        """ drop every column; the statistics are kept """
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """ hits, misses, hit rate, evictions, size and bytes held """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'size': len(self.entries),
+                'bytes': self.bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,324 @@
+"""evaluate.py
+
+Evaluates an HMM tagger on a JSONL file of tagged tweets, such as
+twt.test.json.  The file is read in chunks and each chunk is decoded with
+the batch APIs of hmm.HMM, so memory use does not grow with its size.
+
+Only the passes asked for are run:
+
+viterbi -- tags from HMM.viterbi_batch.
+posterior -- tags from HMM.posterior_decode_batch (max-marginal decoding),
+   with the mean confidence of right and of wrong tags.
+forward -- HMM.forward_batch, only timed, with the number of tweets to
+   which the model gives probability 0.
+
+For each tagging pass, an Evaluation accumulates, in numpy and array.array
+counters, a confusion matrix of gold against predicted tags, the accuracy
+on words in and out of the vocabulary, and the number of tokens, errors
+and seconds of every tweet.  The time of a batch is shared among its
+tweets by their numbers of tokens; with --chunk-size 1 every tweet is
+timed on its own.  The results, with per-tag precision, recall and F1,
+can be written to a JSON file and compared with those of another model
+or an earlier run.
+
+Usage:
+    python evaluate.py [model.json] [corpus.json]
+                       [--passes viterbi posterior forward]
+                       [--chunk-size N] [--limit N] [--oov oov.json]
+                       [--output results.json] [--compare old.json]
+"""
+
+import argparse
+import array
+import json
+import time
+
+import numpy as np
+
+import hmm
+import hmm_metrics
+import parallel_tagger
+
+PASSES = ('viterbi', 'posterior', 'forward')
+DEFAULT_CHUNK_SIZE = 256
+TOP_CONFUSIONS = 10
+
+
+class TagStats:
+    """ counts of one tagging pass """
+
+    def __init__(self, tags):
+        self.tags = list(tags)
+        self.tag_ids = {tag: i for i, tag in enumerate(self.tags)}
+        # Rows are gold tags, columns predicted tags.
+        self.confusion = np.zeros((len(self.tags), len(self.tags)),
+                                  dtype=np.int64)
+        # Rows in vocabulary, out of vocabulary; columns tokens, correct.
+        self.vocabulary = np.zeros((2, 2), dtype=np.int64)
+        self.confidence = np.zeros(2)  # summed over wrong, right tags
+        self.tweet_tokens = array.array('I')
+        self.tweet_errors = array.array('I')
+        self.tweet_seconds = array.array('d')
+        self.seconds = 0.0
+
+    def ids(self, tags):
+        """ the ids of tags, adding the ones not seen before """
+        ids = []
+        for tag in tags:
+            if tag not in self.tag_ids:
+                self.tag_ids[tag] = len(self.tags)
+                self.tags.append(tag)
+            ids.append(self.tag_ids[tag])
+        n = len(self.tags)
+        if n > len(self.confusion):
+            self.confusion = np.pad(self.confusion,
+                                    ((0, n - len(self.confusion)),) * 2)
+        return ids
+
+    def add(self, gold, predicted, oov, seconds, confidences=None):
+        """ count a batch: gold and predicted tags and oov flags, one list
+            per tweet, decoded in seconds """
+        lengths = np.array([len(tags) for tags in gold], dtype=np.intp)
+        g = np.array(self.ids(tag for tags in gold for tag in tags),
+                     dtype=np.intp)
+        p = np.array(self.ids(tag for tags in predicted for tag in tags),
+                     dtype=np.intp)
+        np.add.at(self.confusion, (g, p), 1)
+        right = g == p
+        unknown = np.fromiter((flag for flags in oov for flag in flags),
+                              dtype=bool, count=len(g))
+        for row, mask in enumerate((~unknown, unknown)):
+            self.vocabulary[row] += mask.sum(), (right & mask).sum()
+        if confidences is not None:
+            c = np.fromiter((x for values in confidences for x in values),
+                            dtype=float, count=len(g))
+            self.confidence += c[~right].sum(), c[right].sum()
+        ends = np.cumsum(lengths)
+        wrong = np.concatenate(([0], np.cumsum(~right)))
+        self.tweet_tokens.extend(lengths.tolist())
+        self.tweet_errors.extend((wrong[ends] - wrong[ends - lengths]).tolist())
+        total = max(int(lengths.sum()), 1)
+        self.tweet_seconds.extend((seconds * lengths / total).tolist())
+        self.seconds += seconds
+
+    def per_tag(self):
+        """ {tag: {'precision', 'recall', 'f1', 'support'}} for every tag
+            that occurs as gold or predicted """
+        hits = np.diag(self.confusion)
+        gold = self.confusion.sum(axis=1)
+        predicted = self.confusion.sum(axis=0)
+        metrics = {}
+        for i, tag in enumerate(self.tags):
+            if not gold[i] and not predicted[i]:
+                continue
+            precision = hits[i] / predicted[i] if predicted[i] else 0.0
+            recall = hits[i] / gold[i] if gold[i] else 0.0
+            f1 = (2 * precision * recall / (precision + recall)
+                  if precision + recall else 0.0)
+            metrics[tag] = {'precision': float(precision),
+                            'recall': float(recall), 'f1': float(f1),
+                            'support': int(gold[i])}
+        return metrics
+
+    def top_confusions(self, n=TOP_CONFUSIONS):
+        """ the n most frequent (gold, predicted, count) errors """
+        errors = self.confusion.copy()
+        np.fill_diagonal(errors, 0)
+        order = np.argsort(errors, axis=None)[::-1][:n]
+        return [(self.tags[i], self.tags[j], int(errors[i, j]))
+                for i, j in zip(*np.unravel_index(order, errors.shape))
+                if errors[i, j]]
+
+    def results(self):
+        """ the counts and metrics as a dict for JSON """
+        tokens, correct = self.vocabulary.sum(axis=0).tolist()
+        results = {'tokens': tokens, 'correct': correct,
+                   'accuracy': correct / tokens if tokens else 0.0,
+                   'seconds': self.seconds,
+                   'tokens_per_second': tokens / self.seconds
+                   if self.seconds else 0.0,
+                   'tweets': len(self.tweet_tokens),
+                   'tweets_correct': self.tweet_errors.tolist().count(0)}
+        for name, (n, right) in zip(('in_vocabulary', 'oov'),
+                                    self.vocabulary.tolist()):
+            results[name] = {'tokens': n, 'correct': right,
+                             'accuracy': right / n if n else 0.0}
+        if self.confidence.any():
+            results['mean_confidence'] = {
+                'wrong': self.confidence[0] / max(tokens - correct, 1),
+                'right': self.confidence[1] / max(correct, 1)}
+        ms = [1000 * s for s in self.tweet_seconds]
+        results['tweet_ms'] = {'p%d' % q: hmm_metrics.percentile(ms, q)
+                               for q in hmm_metrics.PERCENTILES}
+        results['tweet_ms']['max'] = max(ms, default=0.0)
+        results['per_tag'] = self.per_tag()
+        results['confusion'] = {'tags': self.tags,
+                                'matrix': self.confusion.tolist()}
+        return results
+
+
+class ForwardStats:
+    """ timing of the Forward pass """
+
+    def __init__(self):
+        self.tweets = 0
+        self.tokens = 0
+        self.zero_probability = 0
+        self.seconds = 0.0
+
+    def add(self, beliefs, seconds):
+        for b in beliefs:
+            self.tweets += 1
+            self.tokens += len(b)
+            if len(b) and not any(b[-1]):
+                self.zero_probability += 1
+        self.seconds += seconds
+
+    def results(self):
+        return {'tweets': self.tweets, 'tokens': self.tokens,
+                'zero_probability_tweets': self.zero_probability,
+                'seconds': self.seconds,
+                'tokens_per_second': self.tokens / self.seconds
+                if self.seconds else 0.0}
+
+
+class Evaluation:
+    """ the requested passes of an evaluation, fed chunk by chunk """
+
+    def __init__(self, model, passes=('viterbi',)):
+        for name in passes:
+            if name not in PASSES:
+                raise ValueError("Unknown pass %r, expected one of %s"
+                                 % (name, ', '.join(PASSES)))
+        self.model = model
+        self.passes = list(passes)
+        states = model.compile().states
+        self.stats = {name: ForwardStats() if name == 'forward'
+                      else TagStats(states) for name in self.passes}
+
+    def add_chunk(self, tweets):
+        """ decode and count a list of tweets given as [word, tag] pairs """
+        tokens = [[item[0] for item in twt] for twt in tweets]
+        gold = [[item[1] for item in twt] for twt in tweets]
+        word_ids = self.model.word_ids
+        oov = [[obs not in word_ids for obs in seq] for seq in tokens]
+        for name in self.passes:
+            start = time.perf_counter()
+            if name == 'viterbi':
+                predicted = self.model.viterbi_batch(tokens)
+                self.stats[name].add(gold, predicted, oov,
+                                     time.perf_counter() - start)
+            elif name == 'posterior':
+                decoded = self.model.posterior_decode_batch(tokens)
+                self.stats[name].add(gold, [tags for tags, c in decoded], oov,
+                                     time.perf_counter() - start,
+                                     [c for tags, c in decoded])
+            else:
+                beliefs = self.model.forward_batch(tokens)
+                self.stats[name].add(beliefs, time.perf_counter() - start)
+
+    def results(self):
+        """ the results of every pass, as a dict for JSON """
+        return {name: stats.results() for name, stats in self.stats.items()}
+
+
+def evaluate(model, filename, passes=('viterbi',),
+             chunk_size=DEFAULT_CHUNK_SIZE, limit=None):
+    """ run an Evaluation over the first limit tweets of a JSONL file """
+    evaluation = Evaluation(model, passes)
+    n_tweets = 0
+    for chunk in parallel_tagger.read_chunks(filename, chunk_size):
+        if limit is not None:
+            chunk = chunk[:limit - n_tweets]
+        evaluation.add_chunk(chunk)
+        n_tweets += len(chunk)
+        if limit is not None and n_tweets >= limit:
+            break
+    return evaluation
+
+
+def compare(baseline, results):
+    """ print the change of every accuracy and per-tag F1 from a baseline
+        results dict to results """
+    for name, new in results['passes'].items():
+        old = baseline['passes'].get(name)
+        if old is None or 'accuracy' not in new:
+            continue
+        print("%s: accuracy %.2f%% -> %.2f%% (%+.2f)"
+              % (name, 100 * old['accuracy'], 100 * new['accuracy'],
+                 100 * (new['accuracy'] - old['accuracy'])))
+        for tag, metrics in sorted(new['per_tag'].items()):
+            before = old['per_tag'].get(tag, {}).get('f1', 0.0)
+            if abs(metrics['f1'] - before) >= 0.005:
+                print("  %-4s F1 %.3f -> %.3f" % (tag, before, metrics['f1']))
+
+
+def report(results):
+    """ print the results of every pass """
+    for name, r in results['passes'].items():
+        if name == 'forward':
+            print("forward: %d tweets, %d with probability 0, %.0f tokens/s"
+                  % (r['tweets'], r['zero_probability_tweets'],
+                     r['tokens_per_second']))
+            continue
+        print("%s: %d/%d correct, accuracy %.2f%%, %d/%d tweets all "
+              "correct, %.0f tokens/s"
+              % (name, r['correct'], r['tokens'], 100 * r['accuracy'],
+                 r['tweets_correct'], r['tweets'], r['tokens_per_second']))
+        for part in ('in_vocabulary', 'oov'):
+            print("  %-14s %6d tokens, accuracy %.2f%%"
+                  % (part, r[part]['tokens'], 100 * r[part]['accuracy']))
+        if 'mean_confidence' in r:
+            print("  mean confidence: right %.3f, wrong %.3f"
+                  % (r['mean_confidence']['right'],
+                     r['mean_confidence']['wrong']))
+        print("  tweet ms: " + ", ".join('%s %.2f' % item
+                                         for item in r['tweet_ms'].items()))
+        print("  %-4s %9s %9s %9s %7s"
+              % ('tag', 'precision', 'recall', 'f1', 'support'))
+        for tag, m in sorted(r['per_tag'].items()):
+            print("  %-4s %9.3f %9.3f %9.3f %7d"
+                  % (tag, m['precision'], m['recall'], m['f1'],
+                     m['support']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Evaluate an HMM tagger on tagged tweets.')
+    parser.add_argument('model', nargs='?',
+                        default='twitter_pos_hmm_laplace.json')
+    parser.add_argument('corpus', nargs='?', default='twt.test.json')
+    parser.add_argument('--passes', nargs='+', default=['viterbi'],
+                        choices=PASSES)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='tweets decoded per batch')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only evaluate the first N tweets')
+    parser.add_argument('--oov', default=None,
+                        help='oov_model.py file for unknown words')
+    parser.add_argument('--output', default=None,
+                        help='write the results to this JSON file')
+    parser.add_argument('--compare', metavar='BASELINE', default=None,
+                        help='results file of an earlier run to compare with')
+    args = parser.parse_args()
+    model = hmm.HMM(args.model, backend='numpy')
+    if args.oov is not None:
+        import oov_model
+        model.set_oov_model(oov_model.OOVModel.load(args.oov))
+    evaluation = evaluate(model, args.corpus, args.passes, args.chunk_size,
+                          args.limit)
+    results = {'model': args.model, 'model_version': model.model_version(),
+               'corpus': args.corpus, 'passes': evaluation.results()}
+    report(results)
+    tagging = [p for p in evaluation.passes if p != 'forward']
+    if tagging:
+        print("most frequent errors (gold -> predicted):")
+        for gold, predicted, count in \
+                evaluation.stats[tagging[0]].top_confusions():
+            print("  %-4s -> %-4s %d" % (gold, predicted, count))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(json.load(f), results)
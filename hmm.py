@@ -21,40 +21,349 @@ should display this probability next to each of the nodes, and it should
 highlight the (or a) most probable path.
 """
 
+import functools
+import hashlib
 import json
+import math
 
-import hmm_vis as hv
+import emission_cache
+
+BACKENDS = ('dict', 'numpy')
+BINARY_MAGIC = b'HMMB'  # first bytes of a binary model file, see hmm_binary
+DECODE_MODES = ('viterbi', 'beam', 'kbest', 'posterior')
+DEFAULT_BEAM = 4
+
+
+def log_prob(p):
+    """ natural log of a probability, with log(0) = -inf """
+    return math.log(p) if p > 0 else -math.inf
+
+
+def instrumented(kind):
+    """ decorator for the HMM methods that report to an Instrumentation
+        (see hmm_metrics) when one is enabled.  kind says what the first
+        argument is: 'sequence', 'batch' (a list of sequences) or 'load'.
+        With instrumentation disabled the method is called directly. """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            instrumentation = self.instrumentation
+            if instrumentation is None or instrumentation.depth:
+                return method(self, *args, **kwargs)
+            return instrumentation.call(self, method, kind, args, kwargs)
+        return wrapper
+    return decorate
+
+
+def cached(algorithm):
+    """ decorator for forward_algorithm and viterbi_algorithm that looks
+        results up in the decode cache (see enable_cache) when one is
+        enabled, and on a miss computes them through the prefix cache, if
+        any.  Calls with show set always run the algorithm. """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, obs_sequence, show=False):
+            if self.cache is None or show:
+                return method(self, obs_sequence, show)
+            key = self.cache.key(self.model_version(), algorithm,
+                                 obs_sequence)
+            result = self.cache.get(key)
+            if result is None:
+                if self.prefix_cache is not None:
+                    result = getattr(self.prefix_cache, algorithm)(
+                        obs_sequence)
+                    if algorithm == 'forward':
+                        result = [b.tolist() for b in result]
+                else:
+                    result = method(self, obs_sequence)
+                if algorithm == 'forward':
+                    result = tuple(tuple(b) for b in result)
+                else:
+                    result = tuple(result)
+                self.cache.put(key, result)
+            if algorithm == 'forward':
+                return [list(b) for b in result]
+            return list(result)
+        return wrapper
+    return decorate
 
 
 class HMM:
     """ class that represents an HMM model with functions for the Forward and
         Viterbi algorithms """
 
-    def __init__(self, filename=None):
-        """ initialize parameters and other helper variables """
+    def __init__(self, filename=None, backend='dict', prune=True,
+                 instrumentation=None, model_cache=None):
+        """ initialize parameters and other helper variables.
+            backend selects the implementation used by forward_algorithm
+            and viterbi_algorithm: 'dict' walks the parameter dicts directly,
+            'numpy' runs on the dense arrays built by hmm_numpy.  With prune
+            set, the dict backend only expands, at each position, the states
+            that can emit the word there (see allowed_states).  The dict
+            backend reads emission probabilities from a column memoized
+            per word (see emission_column).
+            instrumentation is an hmm_metrics.Instrumentation to report
+            calls to, from loading the parameters on.  model_cache is
+            passed to load_parameters. """
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend %r, expected one of %s"
+                             % (backend, ', '.join(BACKENDS)))
         self.S = None
         self.O = None
         self.P_trans = None
         self.P_emission = None
+        self.word_ids = None
+        self.oov_id = None
+        self.log_trans = None
+        self.tag_index = None
+        self.emission_cache = None
+        self.backend = backend
+        self.prune = prune
+        self.compiled = None
+        self.oov_model = None
+        self.instrumentation = instrumentation
+        self.version = None
+        self.cache = None
+        self.prefix_depth = 0
+        self.prefix_cache = None
+        self.display = {}
+        self.trellis = None
         if filename is not None:
-            self.load_parameters(filename)
+            self.load_parameters(filename, model_cache)
         # Add other instance variables you might need below.
 
-    def load_parameters(self, filename):
-        """ load HMM model parameters from JSON file """
-        with open(filename, 'r') as f:
-            parameters = json.load(f)
+    @instrumented('load')
+    def load_parameters(self, filename, model_cache=None):
+        """ load HMM model parameters from JSON file, or from a binary model
+            file written by hmm_binary.  With model_cache, a directory or
+            True for the default one (see hmm_binary.cache_path), a JSON
+            file is loaded from its binary form there, which is written on
+            first use (see hmm_binary.cached). """
+        with open(filename, 'rb') as f:
+            is_binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+        if model_cache and not is_binary:
+            import hmm_binary
+            filename = hmm_binary.cached(
+                filename, None if model_cache is True else model_cache)
+            is_binary = True
+        if is_binary:
+            import hmm_binary
+            binary = hmm_binary.load(filename)
+            self.set_parameters(binary.parameters(), word_ids=binary.word_ids,
+                                compiled=binary.compile())
+        else:
+            with open(filename, 'r') as f:
+                self.set_parameters(json.load(f))
+
+    def set_parameters(self, parameters, word_ids=None, compiled=None):
+        """ use a dict with keys 'S', 'O', 'P_trans' and 'P_emission', in the
+            layout of the JSON model files, as the parameters of this HMM.
+            word_ids and compiled may pass in an index of O and the array
+            form of the model if they were already built. """
         self.S = parameters['S']
         self.O = parameters['O']
         self.P_trans = parameters['P_trans']
         self.P_emission = parameters['P_emission']
+        # Hashed vocabulary index: word -> integer id, with oov_id marking
+        # words outside O.  Used instead of scanning the list O.
+        if word_ids is None:
+            word_ids = {word: i for i, word in enumerate(self.O)}
+        self.word_ids = word_ids
+        self.oov_id = len(self.O)
+        self.compiled = compiled
+        if compiled is not None:
+            compiled.oov_model = self.oov_model
+        self.log_trans = None
+        self.tag_index = None
+        self.version = None
+        if self.emission_cache is not None:
+            self.emission_cache.clear()
+        self._reset_prefix_cache()
+
+    def word_id(self, obs):
+        """ return the vocabulary id of obs, or oov_id if it is not in O """
+        return self.word_ids.get(obs, self.oov_id)
+
+    def enable_instrumentation(self, instrumentation=None):
+        """ report the calls of the decoding methods to instrumentation, a
+            new hmm_metrics.Instrumentation if None, and return it """
+        if instrumentation is None:
+            import hmm_metrics
+            instrumentation = hmm_metrics.Instrumentation()
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        """ stop reporting calls """
+        self.instrumentation = None
+
+    def model_version(self):
+        """ a hash of the parameters, computed from the array form of the
+            model and the parameters of the OOV model, if any, on first use
+            after either was set.  Models that only differ in their OOV
+            model have different versions, so they can share a
+            DecodeCache. """
+        if self.version is None:
+            compiled = self.compile()
+            digest = hashlib.sha1()
+            for strings in (compiled.states, compiled.vocabulary):
+                digest.update('\0'.join(strings).encode('utf-8'))
+                digest.update(b'\1')
+            for array in (compiled.start, compiled.trans, compiled.end) + \
+                    tuple(compiled.sparse_emission()):
+                digest.update(array.tobytes())
+            if self.oov_model is not None:
+                digest.update(b'\2' + self.oov_model.digest().encode('ascii'))
+            self.version = digest.hexdigest()
+        return self.version
+
+    def enable_cache(self, cache=None, prefix_depth=0):
+        """ look the results of forward_algorithm and viterbi_algorithm up
+            in cache, a decode_cache.DecodeCache (a new one if None), before
+            computing them, and return the cache.  With prefix_depth above
+            0, results that are not in it are computed through a
+            decode_cache.PrefixCache of that depth, on the array form of
+            the model. """
+        import decode_cache
+        if cache is None:
+            cache = decode_cache.DecodeCache()
+        self.cache = cache
+        self.prefix_depth = prefix_depth
+        self._reset_prefix_cache()
+        return cache
+
+    def disable_cache(self):
+        """ stop using the decode and prefix caches """
+        self.cache = None
+        self.prefix_cache = None
+
+    def _reset_prefix_cache(self):
+        if self.cache is not None and self.prefix_depth:
+            import decode_cache
+            self.prefix_cache = decode_cache.PrefixCache(
+                self.compile(), self.prefix_depth)
+        else:
+            self.prefix_cache = None
+
+    def set_display(self, edges='all', top_k=None, **options):
+        """ how to draw the trellis when show is set.  edges='nonzero'
+            draws only the transitions of nonzero probability, and top_k
+            only the top_k most probable ones out of each state.  Other
+            options (lazy, column_width, backend, width, height) are passed
+            to hmm_vis.show_entire_trellis.  The last trellis drawn is kept
+            in self.trellis, an hmm_vis.Trellis, e.g. to save it. """
+        import hmm_vis as hv
+        self.display = dict(options)
+        if edges == 'nonzero' or top_k is not None:
+            self.display['edge_filter'] = hv.select_edges(self.P_trans, top_k)
+
+    def set_oov_model(self, oov_model):
+        """ score words outside O with an oov_model.OOVModel over the same
+            states, or with probability 0 again if oov_model is None """
+        self.oov_model = oov_model
+        self.version = None
+        if self.compiled is not None:
+            self.compiled.oov_model = oov_model
+        if self.cache is not None:
+            self.cache.clear()
+        if self.emission_cache is not None:
+            self.emission_cache.clear()
+        self._reset_prefix_cache()
+
+    def oov_emission(self, obs):
+        """ return {s: P(obs | s)} from the OOV model if obs is not in O and
+            an OOV model is set, or None """
+        if self.oov_model is None or obs in self.word_ids:
+            return None
+        return self.oov_model.emission_probs(obs)
+
+    def allowed_states(self, obs):
+        """ return the states, in the order of S, that emit obs with nonzero
+            probability, or None if no state does.  The word -> states index
+            is built from P_emission on first use. """
+        if self.tag_index is None:
+            tag_index = {}
+            for s in self.S:
+                if s != '<S>' and s != '<E>':
+                    for word, p in self.P_emission[s].items():
+                        if p > 0:
+                            tag_index.setdefault(word, []).append(s)
+            self.tag_index = tag_index
+        return self.tag_index.get(obs)
 
+    def set_emission_cache(self, max_bytes=emission_cache.DEFAULT_MAX_BYTES):
+        """ memoize the emission columns of at most about max_bytes of
+            words, in a new emission_cache.EmissionCache, and return it """
+        self.emission_cache = emission_cache.EmissionCache(
+            self._emission_column, max_bytes)
+        return self.emission_cache
+
+    def emission_column(self, obs):
+        """ return {s: P(obs | s)} for the states s, in the order of S,
+            that emit obs with nonzero probability; the others emit it with
+            probability 0.  Unknown words are scored by the OOV model if
+            one is set.  The column is memoized in the emission cache,
+            which is created with the default size on first use. """
+        if self.emission_cache is None:
+            self.set_emission_cache()
+        return self.emission_cache.get(obs)
+
+    def _emission_column(self, obs):
+        oov = self.oov_emission(obs)
+        if oov is None:
+            return {s: self.P_emission[s][obs]
+                    for s in self.allowed_states(obs) or ()}
+        return {s: oov[s] for s in self.S
+                if s != '<S>' and s != '<E>' and oov[s] > 0}
+
+    def compile(self):
+        """ return the array form of the model (see hmm_numpy), building it
+            on first use after the parameters were loaded """
+        if self.compiled is None:
+            import hmm_numpy
+            self.compiled = hmm_numpy.compile_model(
+                self.S, self.O, self.P_trans, self.P_emission,
+                word_ids=self.word_ids)
+            self.compiled.oov_model = self.oov_model
+        return self.compiled
+
+    @instrumented('sequence')
+    @cached('forward')
     def forward_algorithm(self, obs_sequence, show=False):
+        if self.backend == 'numpy' and not show:
+            return [b.tolist() for b in self.compile().forward(obs_sequence)]
+        if self.prune and not show:
+            return self._forward_pruned(obs_sequence)[0]
+        return self._forward(obs_sequence, show)[0]
+
+    @instrumented('sequence')
+    def scaled_forward_algorithm(self, obs_sequence):
+        """ run the Forward algorithm, keeping the scaling constants.
+            Returns (beliefs, log_normalizers, log_likelihood), where
+            log_normalizers[t] is the log of the sum that normalized B_t,
+            and log_likelihood = log P(e_1, ..., e_T) is their total.  A
+            sequence that the model cannot produce has log_likelihood -inf.
+            """
+        if self.backend == 'numpy':
+            beliefs, log_norms = self.compile().scaled_forward(obs_sequence)
+            return ([b.tolist() for b in beliefs], log_norms.tolist(),
+                    float(log_norms.sum()))
+        if self.prune:
+            beliefs, totals = self._forward_pruned(obs_sequence)
+        else:
+            beliefs, totals = self._forward(obs_sequence)
+        log_normalizers = [log_prob(total) for total in totals]
+        return beliefs, log_normalizers, sum(log_normalizers)
+
+    def _forward(self, obs_sequence, show=False):
+        """ the dict implementation of the Forward algorithm.  Returns the
+            belief vectors and the normalizing sum used at each step. """
         if show:
-            hv.show_entire_trellis(self.S, obs_sequence,
-                                   has_initial_state=True)
+            import hmm_vis as hv
+            self.trellis = hv.show_entire_trellis(
+                self.S, obs_sequence, has_initial_state=True, **self.display)
             # Demo of node highlighting.
-            hv.highlight_node(0, '<S>', highlight=True)
+            self.trellis.highlight_node(0, '<S>', highlight=True)
             # highlight/unhighlight other nodes as appropriate
             # to show progress.
 
@@ -62,22 +371,20 @@ class HMM:
         # debugging, use calls to highlight_node and show_node_label to 
         # illustrate the progress of your algorithm.
         beliefs = []
+        totals = []
         prev_dist = {'<S>': 1}
         layer = 1
         for obs in obs_sequence:
+            column = self.emission_column(obs)
             dist_map = {}
             dist = []
             total = 0
             for s in self.S:
                 if s != '<S>' and s != '<E>':
                     p_s = 0
-                    if obs in self.P_emission[s]:
-                        e = self.P_emission[s][obs]
-                    else:
-                        e = 0
                     for s_prime in prev_dist:
                         p_s += prev_dist[s_prime] * self.P_trans[s_prime][s]
-                    p_s *= e if obs in self.O else 0
+                    p_s *= column.get(s, 0)
                     dist_map[s] = p_s
                     dist.append(p_s)
                     total += p_s
@@ -86,21 +393,32 @@ class HMM:
                 if total > 0:
                     dist_map[s] /= total
                 if show:
-                    hv.show_label_at_node(layer, s, str(dist_map[s]), dy=30)
+                    self.trellis.show_label_at_node(layer, s, str(dist_map[s]),
+                                                    dy=30)
             if total > 0:
                 for i in range(len(dist)):
                     dist[i] /= total
             beliefs.append(dist)
+            totals.append(total)
             prev_dist = dist_map
             layer += 1
-        return beliefs
+        return beliefs, totals
 
+    @instrumented('sequence')
+    @cached('viterbi')
     def viterbi_algorithm(self, obs_sequence, show=False):
+        if self.backend == 'numpy' and not show:
+            return self.compile().viterbi(obs_sequence)
+        if self.prune and not show:
+            state_seq = self._viterbi_pruned(obs_sequence)
+            if state_seq is not None:
+                return state_seq
         if show:
-            hv.show_entire_trellis(self.S, obs_sequence,
-                                   has_initial_state=True)
-            hv.highlight_node(0, '<S>')         # Demo of node highlighting.
-            # hv.highlight_edge(0, '<S>', 'M')    # Demo of edge highlighting.
+            import hmm_vis as hv
+            self.trellis = hv.show_entire_trellis(
+                self.S, obs_sequence, has_initial_state=True, **self.display)
+            self.trellis.highlight_node(0, '<S>')  # Demo of node highlighting.
+            # self.trellis.highlight_edge(0, '<S>', 'M')  # Demo of edge highlighting.
             # highlight other nodes and edges as appropriate
             # to show progress and results.
 
@@ -111,21 +429,20 @@ class HMM:
         viterbi = [{}]
         back_ptrs = [{}]
         states = [s for s in self.S if s != '<S>' and s != '<E>']
+        column = self.emission_column(obs_sequence[0])
         for s in states:
-            viterbi[0][s] = self.P_trans['<S>'][s] *\
-                            (self.P_emission[s][obs_sequence[0]] if obs_sequence[0]
-                             in self.P_emission[s] else 0)
+            viterbi[0][s] = self.P_trans['<S>'][s] * column.get(s, 0)
             back_ptrs[0][s] = '<S>'
         for t in range(1, len(obs_sequence)):
             viterbi_dict = {}
             back_ptrs_dict = {}
+            column = self.emission_column(obs_sequence[t])
             for s in states:
+                e = column.get(s, 0)
                 argmax = None
                 mx = None
                 for k in states:
-                    value = viterbi[t - 1][k] * self.P_trans[k][s] *\
-                            (self.P_emission[s][obs_sequence[t]] if obs_sequence[t]
-                             in self.P_emission[s] else 0)
+                    value = viterbi[t - 1][k] * self.P_trans[k][s] * e
                     if mx is None or value > mx:
                         mx = value
                         argmax = k
@@ -143,16 +460,226 @@ class HMM:
         if show:
             prev_state = '<S>'
             for t in range(len(obs_sequence)):
-                hv.show_label_at_node(t + 1, state_seq[t], str(viterbi[t][state_seq[t]]), dy=30)
-                hv.highlight_node(t + 1, state_seq[t])
-                hv.highlight_edge(t, prev_state, state_seq[t])
+                self.trellis.show_label_at_node(t + 1, state_seq[t], str(viterbi[t][state_seq[t]]), dy=30)
+                self.trellis.highlight_node(t + 1, state_seq[t])
+                self.trellis.highlight_edge(t, prev_state, state_seq[t])
                 prev_state = state_seq[t]
-            hv.highlight_node(len(obs_sequence), '<E>')
-            hv.highlight_edge(len(obs_sequence), prev_state, '<E>')
+            self.trellis.highlight_node(len(obs_sequence), '<E>')
+            self.trellis.highlight_edge(len(obs_sequence), prev_state, '<E>')
         return state_seq
 
+    def _forward_pruned(self, obs_sequence):
+        """ the Forward algorithm of _forward, computing only the states
+            allowed for each word, from the predecessors with nonzero belief.
+            The skipped terms are all exactly 0, so the beliefs and totals
+            are identical to those of _forward. """
+        states = [s for s in self.S if s != '<S>' and s != '<E>']
+        beliefs = []
+        totals = []
+        prev_dist = {'<S>': 1}
+        for obs in obs_sequence:
+            column = self.emission_column(obs)
+            dist_map = {}
+            total = 0
+            for s in column:
+                p_s = 0
+                for s_prime in prev_dist:
+                    p_s += prev_dist[s_prime] * self.P_trans[s_prime][s]
+                p_s *= column[s]
+                dist_map[s] = p_s
+                total += p_s
+            if total > 0:
+                for s in dist_map:
+                    dist_map[s] /= total
+            beliefs.append([dist_map.get(s, 0.0) for s in states])
+            totals.append(total)
+            prev_dist = {s: p for s, p in dist_map.items() if p != 0}
+        return beliefs, totals
+
+    @instrumented('sequence')
+    def backward_algorithm(self, obs_sequence):
+        """ run the Backward algorithm, scaled by the normalizers of the
+            Forward algorithm (see scaled_forward_algorithm).  Returns one
+            vector per token, whose entry for s is P(e_t+1, ..., e_T | S_t=s)
+            divided by the product of the normalizers after t. """
+        return self.compile().backward(obs_sequence).tolist()
+
+    @instrumented('sequence')
+    def forward_backward(self, obs_sequence):
+        """ return the posterior distributions P(S_t = s | e_1, ..., e_T),
+            one vector per token, and the log-likelihood of the sequence """
+        posteriors, log_likelihood = \
+            self.compile().forward_backward(obs_sequence)
+        return posteriors.tolist(), log_likelihood
+
+    @instrumented('sequence')
+    def posterior_decode(self, obs_sequence):
+        """ max-marginal decoding: return the list of the most probable
+            state at each position given the whole sequence, and the list
+            of their posterior probabilities, which serve as per-token
+            confidences.  Unlike viterbi_algorithm, the states need not
+            form the most probable path.  If the model cannot produce the
+            sequence, every confidence is 0. """
+        return self.compile().posterior_decode(obs_sequence)
+
+    @instrumented('batch')
+    def posterior_decode_batch(self, obs_sequences):
+        """ run posterior_decode on many sequences at once, in padded
+            batches as for forward_batch.  Returns one (states,
+            confidences) pair per sequence. """
+        return self.compile().posterior_decode_batch(obs_sequences)
+
+    @instrumented('batch')
+    def forward_batch(self, obs_sequences):
+        """ run the Forward algorithm on many sequences at once.  The
+            sequences are packed into padded batches and advanced together
+            on the array form of the model, whatever the backend.  Returns
+            one list of belief vectors per sequence, as forward_algorithm. """
+        return [beliefs.tolist()
+                for beliefs in self.compile().forward_batch(obs_sequences)]
+
+    @instrumented('batch')
+    def viterbi_batch(self, obs_sequences):
+        """ run the Viterbi algorithm on many sequences at once, in padded
+            batches as for forward_batch.  Returns one state sequence per
+            input sequence, identical to what viterbi_algorithm returns. """
+        return self.compile().viterbi_batch(obs_sequences)
+
+    def _viterbi_pruned(self, obs_sequence):
+        """ the Viterbi algorithm of viterbi_algorithm, expanding at each
+            position only the states allowed for its word (all states for
+            unknown words), and only those predecessors.  Every state left
+            out scores exactly 0, so whenever the best final score is above
+            0 the path is the exhaustive one.  Otherwise returns None and the
+            caller falls back to the exhaustive algorithm, which decides
+            between all-zero paths in its own way.  Since scores never rise
+            back above 0, this is detected at the first all-zero column. """
+        if len(obs_sequence) == 0:
+            return None
+        states = [s for s in self.S if s != '<S>' and s != '<E>']
+        column = self.emission_column(obs_sequence[0])
+        viterbi = {}
+        for s in column or states:
+            viterbi[s] = self.P_trans['<S>'][s] * column.get(s, 0)
+        if not max(viterbi.values()) > 0:
+            return None
+        back_ptrs = []
+        for obs in obs_sequence[1:]:
+            viterbi_dict = {}
+            back_ptrs_dict = {}
+            column = self.emission_column(obs)
+            for s in column or states:
+                e = column.get(s, 0)
+                argmax = None
+                mx = None
+                for k in viterbi:
+                    value = viterbi[k] * self.P_trans[k][s] * e
+                    if mx is None or value > mx:
+                        mx = value
+                        argmax = k
+                viterbi_dict[s] = mx
+                back_ptrs_dict[s] = argmax
+            if not max(viterbi_dict.values()) > 0:
+                return None
+            viterbi = viterbi_dict
+            back_ptrs.append(back_ptrs_dict)
+        mx = None
+        state_seq = [None] * len(obs_sequence)
+        for s in viterbi:
+            if mx is None or viterbi[s] > mx:
+                mx = viterbi[s]
+                state_seq[-1] = s
+        for t in reversed(range(1, len(obs_sequence))):
+            state_seq[t - 1] = back_ptrs[t - 1][state_seq[t]]
+        return state_seq
+
+    @instrumented('sequence')
+    def log_viterbi_algorithm(self, obs_sequence):
+        """ Viterbi algorithm on sums of log probabilities instead of
+            products of probabilities, so that scores on long sequences
+            cannot underflow to 0.  Impossible paths score -inf.  Returns the
+            most probable state sequence, like viterbi_algorithm. """
+        if self.backend == 'numpy':
+            return self.compile().log_viterbi(obs_sequence)
+        if len(obs_sequence) == 0:
+            return []
+        log_trans = self.log_P_trans()
+        states = [s for s in self.S if s != '<S>' and s != '<E>']
+        viterbi = {}
+        back_ptrs = []
+        column = self.emission_column(obs_sequence[0])
+        for s in states:
+            viterbi[s] = log_trans['<S>'][s] + log_prob(column.get(s, 0))
+        for obs in obs_sequence[1:]:
+            viterbi_dict = {}
+            back_ptrs_dict = {}
+            column = self.emission_column(obs)
+            for s in states:
+                log_e = log_prob(column.get(s, 0))
+                argmax = None
+                mx = None
+                for k in states:
+                    value = viterbi[k] + log_trans[k][s] + log_e
+                    if mx is None or value > mx:
+                        mx = value
+                        argmax = k
+                viterbi_dict[s] = mx
+                back_ptrs_dict[s] = argmax
+            viterbi = viterbi_dict
+            back_ptrs.append(back_ptrs_dict)
+        state_seq = [None] * len(obs_sequence)
+        mx = None
+        for s in states:
+            if mx is None or viterbi[s] > mx:
+                mx = viterbi[s]
+                state_seq[-1] = s
+        for t in reversed(range(1, len(obs_sequence))):
+            state_seq[t - 1] = back_ptrs[t - 1][state_seq[t]]
+        return state_seq
+
+    @instrumented('sequence')
+    def decode(self, obs_sequence, mode='viterbi', beam=DEFAULT_BEAM, k=1):
+        """ decode a sequence with the algorithm chosen by mode:
+            'viterbi' -- exact, as viterbi_algorithm.
+            'beam' -- beam search keeping the beam best states per position.
+            'kbest' -- the k best paths, as a list of (log probability,
+               state sequence) pairs, best first.
+            'posterior' -- the state of highest posterior probability at
+               each position, as posterior_decode.
+            'beam', 'kbest' and 'posterior' run on the array form of the
+            model.  beam and k must be at least 1. """
+        if mode == 'viterbi':
+            return self.viterbi_algorithm(obs_sequence)
+        if mode == 'beam':
+            if beam < 1:
+                raise ValueError("beam must be at least 1, got %r" % (beam,))
+            return self.compile().beam_search(obs_sequence, beam)
+        if mode == 'kbest':
+            return self.k_best_viterbi(obs_sequence, k)
+        if mode == 'posterior':
+            return self.posterior_decode(obs_sequence)[0]
+        raise ValueError("Unknown decoding mode %r, expected one of %s"
+                         % (mode, ', '.join(DECODE_MODES)))
+
+    @instrumented('sequence')
+    def k_best_viterbi(self, obs_sequence, k):
+        """ return the k most probable state sequences as (log probability,
+            state sequence) pairs, best first, leaving out impossible ones """
+        if k < 1:
+            raise ValueError("k must be at least 1, got %r" % (k,))
+        return self.compile().k_best(obs_sequence, k)
+
+    def log_P_trans(self):
+        """ return P_trans with every probability replaced by its log,
+            computing it on first use after the parameters were loaded """
+        if self.log_trans is None:
+            self.log_trans = {prev: {s: log_prob(p) for s, p in row.items()}
+                              for prev, row in self.P_trans.items()}
+        return self.log_trans
+
 
 if __name__ == '__main__':
+    import hmm_vis as hv
     sample_obs_seq = ['Jane', 'Will', 'Spot', 'Will']
     model = HMM('toy_pos_tagger.json')
     beliefs = model.forward_algorithm(sample_obs_seq, show=True)
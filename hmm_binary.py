@@ -0,0 +1,266 @@
+"""hmm_binary.py
+
+A compact binary file format for HMM models, loaded with mmap.
+
+A JSON model such as twitter_pos_hmm_laplace.json has to be parsed in full,
+and turned into millions of dict entries, every time a process starts.  A
+binary model file holds the same parameters as flat arrays, which NumPy can
+use directly from the memory-mapped file:
+
+header -- BINARY_MAGIC, a format version, the number of states and words,
+   the number of stored emission probabilities, and the byte offset and
+   length of each of the sections below.
+string tables -- the state names (S, including <S> and <E>) and the
+   vocabulary (O), each as a blob of NUL-terminated UTF-8 strings and the
+   array of byte offsets at which they start.
+start, trans, end -- the dense float64 arrays of hmm_numpy.CompiledHMM.
+emissions -- a CSR sparse matrix with one row per word: indptr, state
+   indices and probabilities.  Only nonzero probabilities are stored.
+
+Every section is 8-byte aligned.  HMM.load_parameters recognizes the magic
+number and loads these files transparently.  The 'numpy' backend is the
+one to use with them: the 'dict' backend works too, but it reads
+P_emission through read-only views of the CSR arrays, which is slow.
+
+cached() keeps the binary forms of JSON model files in a cache directory,
+named by the hash of the JSON file's contents and the format version, so
+a short-lived process only parses a JSON model the first time it is used
+(see the model_cache argument of HMM).  Entries are never overwritten: an
+edited model file hashes to a new name.  The directory is $HMM_CACHE_DIR,
+or DEFAULT_CACHE_DIR if it is not set.
+
+Usage:
+    python hmm_binary.py model.json model.hmmb
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+import hmm
+import hmm_numpy
+
+VERSION = 1
+SECTIONS = ('state_offsets', 'state_blob', 'word_offsets', 'word_blob',
+            'start', 'trans', 'end', 'indptr', 'indices', 'data')
+HEADER = struct.Struct('<4sIIIQ' + 'QQ' * len(SECTIONS))
+ALIGNMENT = 8
+DEFAULT_CACHE_DIR = os.path.join('~', '.cache', 'twitterhmm')
+
+
+class StringTable(Sequence):
+    """ read-only list of the strings in a blob of NUL-terminated UTF-8 """
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('string table index out of range')
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1] - 1], 'utf-8')
+
+    def __iter__(self):
+        return iter(str(self.blob, 'utf-8').split('\0')[:-1])
+
+
+class EmissionRow(Mapping):
+    """ P_emission[s] for one state, read from the CSR emission arrays """
+
+    def __init__(self, model, state):
+        self.model = model
+        self.state = state
+
+    def __getitem__(self, word):
+        i = self.model.word_ids.get(word)
+        if i is None:
+            raise KeyError(word)
+        first, last = self.model.indptr[i], self.model.indptr[i + 1]
+        hits = np.flatnonzero(self.model.indices[first:last] == self.state)
+        if len(hits) == 0:
+            raise KeyError(word)
+        return float(self.model.data[first + hits[0]])
+
+    def __iter__(self):
+        model = self.model
+        rows = np.repeat(np.arange(len(model.vocabulary)),
+                         np.diff(model.indptr))
+        for i in rows[model.indices == self.state]:
+            yield model.vocabulary[i]
+
+    def __len__(self):
+        return int((self.model.indices == self.state).sum())
+
+
+class BinaryModel:
+    """ the parameters of an HMM, mapped from a binary model file """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.buffer)
+        magic, version, n_states, n_words, nnz = fields[:5]
+        if magic != hmm.BINARY_MAGIC:
+            raise ValueError("%s is not a binary HMM model file" % filename)
+        if version != VERSION:
+            raise ValueError("%s has format version %d, expected %d"
+                             % (filename, version, VERSION))
+        spans = dict(zip(SECTIONS, zip(fields[5::2], fields[6::2])))
+        n = n_states - 2
+        self.S = StringTable(self._array(spans, 'state_offsets', np.int64),
+                             self._bytes(spans, 'state_blob'))
+        self.vocabulary = StringTable(
+            self._array(spans, 'word_offsets', np.int64),
+            self._bytes(spans, 'word_blob'))
+        self.start = self._array(spans, 'start', np.float64)
+        self.trans = self._array(spans, 'trans', np.float64).reshape(n, n)
+        self.end = self._array(spans, 'end', np.float64)
+        self.indptr = self._array(spans, 'indptr', np.int64)
+        self.indices = self._array(spans, 'indices', np.int32)
+        self.data = self._array(spans, 'data', np.float64)
+        self.word_ids = dict(zip(self.vocabulary, range(n_words)))
+        if len(self.vocabulary) != n_words or len(self.data) != nnz:
+            raise ValueError("%s is truncated or corrupt" % filename)
+
+    def _bytes(self, spans, name):
+        offset, length = spans[name]
+        return memoryview(self.buffer)[offset:offset + length]
+
+    def _array(self, spans, name, dtype):
+        offset, length = spans[name]
+        return np.frombuffer(self.buffer, dtype=dtype,
+                             count=length // np.dtype(dtype).itemsize,
+                             offset=offset)
+
+    def states(self):
+        """ the real states, without <S> and <E> """
+        return [s for s in self.S if s not in hmm_numpy.SPECIAL_STATES]
+
+    def parameters(self):
+        """ return S, O, P_trans and P_emission as HMM.load_parameters
+            expects them.  O is the string table itself, and P_emission
+            reads from the CSR arrays instead of copying them into dicts. """
+        states = self.states()
+        P_trans = {'<S>': dict(zip(states, self.start.tolist()))}
+        P_trans['<S>']['<E>'] = 0
+        for k, s in enumerate(states):
+            P_trans[s] = dict(zip(states, self.trans[k].tolist()))
+            P_trans[s]['<E>'] = float(self.end[k])
+        P_emission = {s: EmissionRow(self, j) for j, s in enumerate(states)}
+        return {'S': list(self.S), 'O': self.vocabulary, 'P_trans': P_trans,
+                'P_emission': P_emission}
+
+    def compile(self, word_ids=None):
+        """ build the CompiledHMM, which reads the emissions from the
+            mapped CSR arrays without copying them """
+        return hmm_numpy.CompiledHMM(
+            self.states(), self.vocabulary, self.start, self.trans,
+            self.end, None,
+            word_ids=self.word_ids if word_ids is None else word_ids,
+            sparse=(self.indptr, self.indices, self.data))
+
+
+def load(filename):
+    """ memory-map a binary model file """
+    return BinaryModel(filename)
+
+
+def write(model, filename):
+    """ write an HMM to filename in the binary model format """
+    compiled = model.compile()
+    n_words = len(compiled.vocabulary)
+    indptr, indices, data = compiled.sparse_emission()
+    state_offsets, state_blob = _string_table(model.S)
+    word_offsets, word_blob = _string_table(compiled.vocabulary)
+    sections = [state_offsets, state_blob, word_offsets, word_blob,
+                np.ascontiguousarray(compiled.start, dtype=np.float64),
+                np.ascontiguousarray(compiled.trans, dtype=np.float64),
+                np.ascontiguousarray(compiled.end, dtype=np.float64),
+                indptr, indices.astype(np.int32), data.astype(np.float64)]
+    spans = []
+    offset = _align(HEADER.size)
+    for section in sections:
+        length = len(section) if isinstance(section, bytes) \
+            else section.nbytes
+        spans += [offset, length]
+        offset = _align(offset + length)
+    header = HEADER.pack(hmm.BINARY_MAGIC, VERSION, len(model.S), n_words,
+                         len(data), *spans)
+    with open(filename, 'wb') as f:
+        f.write(header)
+        for section, start in zip(sections, spans[::2]):
+            f.write(b'\0' * (start - f.tell()))
+            f.write(section if isinstance(section, bytes)
+                    else section.tobytes())
+
+
+def convert(json_filename, binary_filename):
+    """ convert a JSON model file to a binary model file """
+    write(hmm.HMM(json_filename), binary_filename)
+
+
+def cache_path(json_filename, cache_dir=None):
+    """ the file of cache_dir that holds the binary form of a JSON model
+        file.  If cache_dir is None it is $HMM_CACHE_DIR, as set when this
+        is called, or DEFAULT_CACHE_DIR. """
+    if cache_dir is None:
+        cache_dir = os.path.expanduser(
+            os.environ.get('HMM_CACHE_DIR') or DEFAULT_CACHE_DIR)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(json_filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return os.path.join(cache_dir,
+                        '%s.v%d.hmmb' % (digest.hexdigest(), VERSION))
+
+
+def cached(json_filename, cache_dir=None):
+    """ return the path of the binary form of a JSON model file in
+        cache_dir, converting it first if it is not there.  The file is
+        written under a temporary name and renamed, so concurrent
+        processes never read a partial one. """
+    path = cache_path(json_filename, cache_dir)
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        os.close(fd)
+        try:
+            convert(json_filename, temporary)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    return path
+
+
+def _string_table(strings):
+    if any('\0' in s for s in strings):
+        raise ValueError("strings in a binary model cannot contain NUL")
+    encoded = [s.encode('utf-8') + b'\0' for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, b''.join(encoded)
+
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.split('Usage:\n')[1])
+    convert(sys.argv[1], sys.argv[2])
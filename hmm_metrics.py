@@ -0,0 +1,183 @@
+"""hmm_metrics.py
+
+Opt-in instrumentation for the HMM class in hmm.py.
+
+An HMM with an Instrumentation object (HMM.enable_instrumentation) reports
+every call of its decoding methods, and of load_parameters: the time it
+took, the number of tokens, the number of out-of-vocabulary tokens, and,
+with check_collapse=True, whether the model gives the sequence probability
+0 (a zero-probability collapse), with the first position at which that
+happens.  Per-method timers and counters are kept in the Instrumentation,
+and every call is also passed as an event dict to each sink, a callable,
+so that the numbers can be forwarded to any metrics system.  The slowest
+calls, and every collapse, are kept together with their token sequences,
+to find pathological tweets.
+
+Finding collapses costs one extra scaled Forward pass per sequence, more
+than most decoding calls themselves, so it is off by default.  Without an
+Instrumentation, each instrumented method costs one attribute test more
+than before.
+
+Calls made from inside an instrumented call, such as decode calling
+viterbi_algorithm, are not reported again.
+
+percentile and PERCENTILES are the latency percentiles reported by
+benchmark.py, evaluate.py, tagging_server.py and tagging_load.py.
+"""
+
+import heapq
+import itertools
+import json
+import math
+import time
+
+DEFAULT_SLOWEST = 20
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, q):
+    """ the q-th percentile (0 to 100) of values, interpolating linearly
+        between the closest ranks """
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+class Instrumentation:
+    """ timers, counters and sinks for the calls of one or more HMMs """
+
+    def __init__(self, sinks=(), check_collapse=False, slow_threshold=None,
+                 n_slowest=DEFAULT_SLOWEST):
+        """ sinks are callables that get one event dict per call.
+            check_collapse runs a scaled Forward pass on every instrumented
+            sequence to find zero-probability collapses.  slow_threshold,
+            in seconds, counts the calls that took at least that long as
+            slow.  The n_slowest slowest sequence calls are kept in
+            slowest. """
+        self.sinks = list(sinks)
+        self.check_collapse = check_collapse
+        self.slow_threshold = slow_threshold
+        self.n_slowest = n_slowest
+        self.depth = 0
+        self.reset()
+
+    def reset(self):
+        """ clear the timers, counters and kept calls """
+        self.timers = {}
+        self.counters = {'calls': 0, 'sequences': 0, 'tokens': 0,
+                         'oov_tokens': 0, 'zero_collapses': 0,
+                         'slow_calls': 0}
+        self.collapses = []
+        self._slowest = []
+        self._order = itertools.count()
+
+    def add_sink(self, sink):
+        """ pass every later event to sink as well """
+        self.sinks.append(sink)
+
+    def call(self, model, method, kind, args, kwargs):
+        """ run method(model, *args, **kwargs), timing and reporting it.
+            kind is 'sequence' when args[0] is one token sequence, 'batch'
+            when it is a list of them, and 'load' otherwise. """
+        self.depth += 1
+        try:
+            start = time.perf_counter()
+            result = method(model, *args, **kwargs)
+            seconds = time.perf_counter() - start
+            if kind == 'sequence':
+                sequences = [args[0]]
+            elif kind == 'batch':
+                sequences = list(args[0])
+            else:
+                sequences = []
+            event = {'method': method.__name__, 'seconds': seconds,
+                     'sequences': len(sequences),
+                     'tokens': sum(len(seq) for seq in sequences),
+                     'oov_tokens': sum(obs not in model.word_ids
+                                       for seq in sequences for obs in seq),
+                     'collapses': []}
+            if self.check_collapse:
+                for i, seq in enumerate(sequences):
+                    position = collapse_position(model, seq)
+                    if position is not None:
+                        event['collapses'].append((i, position))
+                        self.collapses.append(
+                            (method.__name__, seq, position))
+        finally:
+            self.depth -= 1
+        if kind == 'sequence':
+            event['sequence'] = sequences[0]
+        self._record(event)
+        return result
+
+    def _record(self, event):
+        name = event['method']
+        timer = self.timers.setdefault(name, {'calls': 0, 'seconds': 0.0,
+                                              'max_seconds': 0.0})
+        timer['calls'] += 1
+        timer['seconds'] += event['seconds']
+        timer['max_seconds'] = max(timer['max_seconds'], event['seconds'])
+        counters = self.counters
+        counters['calls'] += 1
+        counters['sequences'] += event['sequences']
+        counters['tokens'] += event['tokens']
+        counters['oov_tokens'] += event['oov_tokens']
+        counters['zero_collapses'] += len(event['collapses'])
+        if self.slow_threshold is not None and \
+                event['seconds'] >= self.slow_threshold:
+            counters['slow_calls'] += 1
+        if 'sequence' in event and self.n_slowest:
+            item = (event['seconds'], next(self._order), event)
+            if len(self._slowest) < self.n_slowest:
+                heapq.heappush(self._slowest, item)
+            else:
+                heapq.heappushpop(self._slowest, item)
+        for sink in self.sinks:
+            sink(event)
+
+    def slowest(self):
+        """ the kept slowest sequence calls, as events, slowest first """
+        return [event for seconds, order, event
+                in sorted(self._slowest, key=lambda item: -item[0])]
+
+    def snapshot(self):
+        """ the counters and timers as a flat dict of numbers, such as
+            'tokens' or 'viterbi_algorithm.seconds', for export """
+        metrics = dict(self.counters)
+        for name, timer in self.timers.items():
+            for key, value in timer.items():
+                metrics['%s.%s' % (name, key)] = value
+            metrics['%s.mean_ms' % name] = \
+                1000 * timer['seconds'] / timer['calls']
+        return metrics
+
+
+def collapse_position(model, obs_sequence):
+    """ the first position at which an HMM gives obs_sequence probability
+        0, or None if it never does """
+    log_normalizers = model.scaled_forward_algorithm(obs_sequence)[1]
+    for t, log_c in enumerate(log_normalizers):
+        if log_c == -math.inf:
+            return t
+    return None
+
+
+class JSONLinesSink:
+    """ sink that appends every event to a file, one JSON object per line
+        (without the token sequence, unless with_sequence is set) """
+
+    def __init__(self, filename, with_sequence=False):
+        self.file = open(filename, 'a')
+        self.with_sequence = with_sequence
+
+    def __call__(self, event):
+        if not self.with_sequence:
+            event = {k: v for k, v in event.items() if k != 'sequence'}
+        self.file.write(json.dumps(event) + '\n')
+
+    def close(self):
+        self.file.close()
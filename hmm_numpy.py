@@ -0,0 +1,584 @@
+"""hmm_numpy.py
+
+Array-backed decoding engine for the HMM class in hmm.py.
+
+The dict-based parameters of an HMM (S, O, P_trans and P_emission) are
+compiled once into dense NumPy arrays:
+
+start -- vector of P(s | <S>) for every real state s.
+trans -- matrix with trans[k, s] = P(s | k).
+end -- vector of P(<E> | s).
+emission -- matrix with one row per vocabulary word, indexed by integer
+   word ids, so that emission[id, s] = P(word | s).  The extra last row
+   belongs to the out-of-vocabulary id and is all zeros, which matches the
+   behavior of the dict implementation for unknown words.  If the HMM has
+   an OOV model (see oov_model.py), emission_columns fills the positions of
+   unknown words from it instead.
+
+A model compiled from a binary model file (see hmm_binary) keeps its
+emissions sparse instead, as the memory-mapped CSR arrays of the file:
+emission_columns gathers the columns it needs from them, so processes
+that map the same file share those pages.  The dense matrix is only built
+if something asks for the emission attribute itself.
+
+The Forward and Viterbi algorithms then run as one vector-matrix step per
+token instead of |S| x |S| dictionary lookups.  The arithmetic is done in
+the same order as in hmm.py, so the Viterbi algorithm here returns exactly
+the same tag sequences as HMM.viterbi_algorithm.
+
+scaled_forward and log_viterbi are the underflow-safe variants: the first
+keeps the log of every normalizing constant, whose total is the sequence
+log-likelihood, and the second scores paths with sums of log probabilities.
+beam_search and k_best_viterbi are approximate and n-best decoders, also in
+log space.  forward_backward and posterior_batch give the posterior
+marginals P(S_t = s | e_1, ..., e_T) of whole sequences, from which
+posterior_decode picks the most probable state of each position.
+"""
+
+import numpy as np
+
+
+SPECIAL_STATES = ('<S>', '<E>')
+DEFAULT_BATCH_SIZE = 256
+
+
+class CompiledHMM:
+    """ dense array form of an HMM, with Forward and Viterbi algorithms """
+
+    def __init__(self, states, vocabulary, start, trans, end, emission,
+                 word_ids=None, sparse=None):
+        """ emission is the dense emission matrix, or None if sparse
+            gives it as the CSR arrays (indptr, indices, data) of its rows
+            without the OOV row, as sparse_emission returns them """
+        self.states = states
+        self.vocabulary = vocabulary
+        if word_ids is None:
+            word_ids = {word: i for i, word in enumerate(vocabulary)}
+        self.word_ids = word_ids
+        self.oov_id = len(emission) - 1 if sparse is None \
+            else len(sparse[0]) - 1
+        self.start = start
+        self.trans = trans
+        self.end = end
+        self._emission = emission
+        self.sparse = sparse
+        self.log_start = None
+        self.log_trans = None
+        self.oov_model = None
+
+    def encode(self, obs_sequence):
+        """ map a sequence of words to an array of integer word ids """
+        get = self.word_ids.get
+        oov = self.oov_id
+        return np.fromiter((get(obs, oov) for obs in obs_sequence),
+                           dtype=np.intp, count=len(obs_sequence))
+
+    @property
+    def emission(self):
+        """ the dense emission matrix, built from the CSR arrays on first
+            use if the model was compiled from them """
+        if self._emission is None:
+            indptr, indices, data = self.sparse
+            n_words = len(indptr) - 1
+            emission = np.zeros((n_words + 1, len(self.states)))
+            rows = np.repeat(np.arange(n_words), np.diff(indptr))
+            emission[rows, indices] = data
+            self._emission = emission
+        return self._emission
+
+    def sparse_emission(self):
+        """ the emission matrix without its OOV row as CSR arrays
+            (indptr, indices, data), holding the nonzero probabilities in
+            row-major order """
+        if self.sparse is not None:
+            return self.sparse
+        n_words = len(self._emission) - 1
+        rows, cols = np.nonzero(self._emission[:n_words])
+        indptr = np.zeros(n_words + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_words), out=indptr[1:])
+        return indptr, cols.astype(np.int32), self._emission[rows, cols]
+
+    def arrays(self):
+        """ the parameter arrays the model holds: start, trans, end, and
+            the dense emission matrix or the CSR arrays """
+        if self._emission is None:
+            return (self.start, self.trans, self.end) + tuple(self.sparse)
+        return self.start, self.trans, self.end, self._emission
+
+    def _gather(self, ids):
+        """ the emission rows of an array of ids, from the CSR arrays """
+        indptr, indices, data = self.sparse
+        flat = ids.reshape(-1)
+        columns = np.zeros((len(flat), len(self.states)))
+        known = np.flatnonzero(flat != self.oov_id)
+        first = indptr[flat[known]]
+        lengths = indptr[flat[known] + 1] - first
+        entries = np.arange(lengths.sum()) - np.repeat(
+            np.cumsum(lengths) - lengths - first, lengths)
+        columns[np.repeat(known, lengths), indices[entries]] = data[entries]
+        return columns.reshape(ids.shape + (len(self.states),))
+
+    def emission_columns(self, ids, obs=None):
+        """ return the (T, |S|) matrix of emission probabilities for ids,
+            or the (B, T, |S|) array for a padded (B, T) matrix of ids.
+            If an oov_model (see oov_model.py) is set and the words are
+            passed in obs, a sequence of words or a list of them, the
+            out-of-vocabulary positions are scored by it. """
+        if self._emission is None:
+            columns = self._gather(ids)
+        else:
+            columns = self._emission[ids]
+        if self.oov_model is not None and obs is not None:
+            for index in np.argwhere(ids == self.oov_id):
+                word = obs[index[0]]
+                if len(index) == 2:
+                    if index[1] >= len(word):
+                        continue
+                    word = word[index[1]]
+                columns[tuple(index)] = self.oov_model.emission_vector(word)
+        return columns
+
+    def emissions(self, obs_sequence):
+        """ return the (T, |S|) emission matrix of a sequence of words """
+        return self.emission_columns(self.encode(obs_sequence), obs_sequence)
+
+    def forward(self, obs_sequence):
+        """ return the list of belief vectors B_t, one array per token """
+        return forward(self, self.emissions(obs_sequence))
+
+    def viterbi(self, obs_sequence):
+        """ return the most probable state sequence as a list of states """
+        path = viterbi(self, self.emissions(obs_sequence))
+        return [self.states[i] for i in path]
+
+    def scaled_forward(self, obs_sequence):
+        """ return the belief vectors and the array of log normalizers """
+        return scaled_forward(self, self.emissions(obs_sequence))
+
+    def log_viterbi(self, obs_sequence):
+        """ return the most probable state sequence, scored in log space """
+        path = log_viterbi(self, self.emissions(obs_sequence))
+        return [self.states[i] for i in path]
+
+    def beam_search(self, obs_sequence, beam):
+        """ return the state sequence found by a beam search of width beam """
+        path = beam_search(self, self.emissions(obs_sequence), beam)
+        return [self.states[i] for i in path]
+
+    def k_best(self, obs_sequence, k):
+        """ return the k best (log probability, state sequence) pairs """
+        results = k_best_viterbi(self, self.emissions(obs_sequence), k)
+        return [(score, [self.states[i] for i in path])
+                for score, path in results]
+
+    def pack(self, obs_sequences):
+        """ pack sequences of words into a padded (B, T) matrix of word ids
+            plus the array of their lengths.  Padding uses oov_id. """
+        lengths = np.array([len(seq) for seq in obs_sequences], dtype=np.intp)
+        ids = np.full((len(obs_sequences), lengths.max(initial=0)),
+                      self.oov_id, dtype=np.intp)
+        for b, seq in enumerate(obs_sequences):
+            ids[b, :len(seq)] = self.encode(seq)
+        return ids, lengths
+
+    def forward_batch(self, obs_sequences, batch_size=DEFAULT_BATCH_SIZE):
+        """ return, for each sequence, its (T, |S|) array of beliefs """
+        return self._batched(forward_batch, obs_sequences, batch_size)
+
+    def viterbi_batch(self, obs_sequences, batch_size=DEFAULT_BATCH_SIZE):
+        """ return the most probable state sequence for each sequence """
+        paths = self._batched(viterbi_batch, obs_sequences, batch_size)
+        states = self.states
+        return [[states[i] for i in path] for path in paths]
+
+    def _batched(self, algorithm, obs_sequences, batch_size):
+        """ run a batch algorithm over groups of similar-length sequences,
+            returning the results in the original order """
+        order = sorted(range(len(obs_sequences)),
+                       key=lambda i: len(obs_sequences[i]))
+        results = [None] * len(obs_sequences)
+        for first in range(0, len(order), batch_size):
+            group = order[first:first + batch_size]
+            sequences = [obs_sequences[i] for i in group]
+            ids, lengths = self.pack(sequences)
+            outputs = algorithm(self, self.emission_columns(ids, sequences),
+                                lengths)
+            for i, output in zip(group, outputs):
+                results[i] = output
+        return results
+
+    def backward(self, obs_sequence):
+        """ return the (T, |S|) array of scaled backward vectors """
+        emissions = self.emissions(obs_sequence)
+        return scaled_backward(self, emissions,
+                               _forward_pass(self, emissions)[1])
+
+    def forward_backward(self, obs_sequence):
+        """ return the (T, |S|) posteriors and the log-likelihood """
+        return forward_backward(self, self.emissions(obs_sequence))
+
+    def posterior_decode(self, obs_sequence):
+        """ return the state of highest posterior probability at every
+            position, and that probability, as two lists """
+        posteriors = forward_backward(self, self.emissions(obs_sequence))[0]
+        return self._max_marginal(posteriors)
+
+    def posterior_batch(self, obs_sequences, batch_size=DEFAULT_BATCH_SIZE):
+        """ return, for each sequence, its (T, |S|) array of posteriors """
+        return self._batched(posterior_batch, obs_sequences, batch_size)
+
+    def posterior_decode_batch(self, obs_sequences,
+                               batch_size=DEFAULT_BATCH_SIZE):
+        """ posterior_decode for each sequence, in batches """
+        return [self._max_marginal(posteriors) for posteriors
+                in self.posterior_batch(obs_sequences, batch_size)]
+
+    def _max_marginal(self, posteriors):
+        best = posteriors.argmax(axis=1)
+        states = self.states
+        return ([states[i] for i in best],
+                posteriors[np.arange(len(best)), best].tolist())
+
+    def to_parameters(self):
+        """ return the model as a dict with keys 'S', 'O', 'P_trans' and
+            'P_emission', the layout of the JSON model files.  Only nonzero
+            emission probabilities are listed. """
+        states = self.states
+        P_trans = {'<S>': dict(zip(states, self.start.tolist()))}
+        P_trans['<S>']['<E>'] = 0
+        for k, s in enumerate(states):
+            P_trans[s] = dict(zip(states, self.trans[k].tolist()))
+            P_trans[s]['<E>'] = float(self.end[k])
+        P_emission = {}
+        indptr, indices, data = self.sparse_emission()
+        words = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        for j, s in enumerate(states):
+            entries = indices == j
+            P_emission[s] = dict(zip(
+                (self.vocabulary[i] for i in words[entries]),
+                data[entries].tolist()))
+        return {'S': ['<S>'] + list(states) + ['<E>'],
+                'O': list(self.vocabulary), 'P_trans': P_trans,
+                'P_emission': P_emission}
+
+    def log_params(self):
+        """ return (log start, log trans), computed on first use """
+        if self.log_start is None:
+            self.log_start = safe_log(self.start)
+            self.log_trans = safe_log(self.trans)
+        return self.log_start, self.log_trans
+
+
+def compile_model(S, O, P_trans, P_emission, word_ids=None):
+    """ build a CompiledHMM from the dict-based HMM parameters.  word_ids
+        may pass in an existing word -> id index of O to share it. """
+    states = [s for s in S if s not in SPECIAL_STATES]
+    vocabulary = list(O)
+    n = len(states)
+    start = np.array([P_trans['<S>'].get(s, 0) for s in states],
+                     dtype=np.float64)
+    trans = np.array([[P_trans[k].get(s, 0) for s in states] for k in states],
+                     dtype=np.float64).reshape(n, n)
+    end = np.array([P_trans[k].get('<E>', 0) for k in states],
+                   dtype=np.float64)
+    if word_ids is None:
+        word_ids = {word: i for i, word in enumerate(vocabulary)}
+    emission = np.zeros((len(vocabulary) + 1, n), dtype=np.float64)
+    for j, s in enumerate(states):
+        for word, p in P_emission[s].items():
+            i = word_ids.get(word)
+            if i is not None:
+                emission[i, j] = p
+    return CompiledHMM(states, vocabulary, start, trans, end, emission,
+                       word_ids=word_ids)
+
+
+def safe_log(a):
+    """ elementwise natural log of an array, with log(0) = -inf """
+    with np.errstate(divide='ignore'):
+        return np.log(a)
+
+
+def forward(model, emissions):
+    """ Forward algorithm over a (T, |S|) matrix of emission columns.
+        Each belief vector is normalized to sum to 1 unless every state has
+        probability 0, in which case it is left as all zeros. """
+    return scaled_forward(model, emissions)[0]
+
+
+def scaled_forward(model, emissions):
+    """ Forward algorithm that also returns the log of the normalizing sum
+        at each step.  Their total is log P(e_1, ..., e_T), or -inf once the
+        model cannot produce the observations. """
+    beliefs, totals = _forward_pass(model, emissions)
+    return beliefs, safe_log(totals)
+
+
+def _forward_pass(model, emissions):
+    """ return the belief vectors and the array of normalizing sums """
+    beliefs = []
+    totals = np.zeros(len(emissions))
+    prev = None
+    for t, e in enumerate(emissions):
+        if prev is None:
+            dist = model.start * e
+        else:
+            dist = np.einsum('k,ks->s', prev, model.trans) * e
+        total = dist.sum()
+        if total > 0:
+            dist /= total
+        beliefs.append(dist)
+        totals[t] = total
+        prev = dist
+    return beliefs, totals
+
+
+def scaled_backward(model, emissions, totals):
+    """ Backward algorithm, scaled by the normalizing sums c_t of the
+        Forward algorithm: row t holds P(e_t+1, ..., e_T | S_t = s) divided
+        by c_t+1 * ... * c_T.  As in forward, the transition into <E> is not
+        part of the sequence probability, so the last row is all ones.  Rows
+        before a step with c_t = 0 are all zeros. """
+    n_steps = len(emissions)
+    betas = np.ones((n_steps, len(model.states)))
+    for t in range(n_steps - 2, -1, -1):
+        if totals[t + 1] > 0:
+            betas[t] = np.einsum('sk,k->s', model.trans,
+                                 emissions[t + 1] * betas[t + 1])
+            betas[t] /= totals[t + 1]
+        else:
+            betas[t] = 0
+    return betas
+
+
+def forward_backward(model, emissions):
+    """ return (posteriors, log_likelihood), where posteriors is the
+        (T, |S|) array of P(S_t = s | e_1, ..., e_T).  If the model cannot
+        produce the sequence, the posteriors are all zeros. """
+    beliefs, totals = _forward_pass(model, emissions)
+    betas = scaled_backward(model, emissions, totals)
+    alphas = np.array(beliefs).reshape(betas.shape)
+    return alphas * betas, float(safe_log(totals).sum())
+
+
+def viterbi(model, emissions):
+    """ Viterbi algorithm over a (T, |S|) matrix of emission columns.
+        Returns the most probable path as a list of state indices.  Ties
+        are broken in favor of the earliest state, as in hmm.py. """
+    n_steps = len(emissions)
+    if n_steps == 0:
+        return []
+    back_ptrs = np.zeros((n_steps, len(model.states)), dtype=np.intp)
+    v = model.start * emissions[0]
+    for t in range(1, n_steps):
+        scores = v[:, None] * model.trans * emissions[t]
+        back_ptrs[t] = scores.argmax(axis=0)
+        v = scores.max(axis=0)
+    path = [int(v.argmax())]
+    for t in range(n_steps - 1, 0, -1):
+        path.append(int(back_ptrs[t, path[-1]]))
+    path.reverse()
+    return path
+
+
+def log_viterbi(model, emissions):
+    """ Viterbi algorithm on sums of log probabilities, which cannot
+        underflow on long sequences.  Returns a list of state indices. """
+    n_steps = len(emissions)
+    if n_steps == 0:
+        return []
+    log_start, log_trans = model.log_params()
+    log_e = safe_log(emissions)
+    back_ptrs = np.zeros((n_steps, len(model.states)), dtype=np.intp)
+    v = log_start + log_e[0]
+    for t in range(1, n_steps):
+        scores = v[:, None] + log_trans + log_e[t]
+        back_ptrs[t] = scores.argmax(axis=0)
+        v = scores.max(axis=0)
+    path = [int(v.argmax())]
+    for t in range(n_steps - 1, 0, -1):
+        path.append(int(back_ptrs[t, path[-1]]))
+    path.reverse()
+    return path
+
+
+def forward_batch(model, emissions, lengths):
+    """ Forward algorithm over a padded (B, T, |S|) array of emission
+        columns, advancing all B sequences together one time step at a
+        time.  Returns a list with the (lengths[b], |S|) belief array of each
+        sequence; values past a sequence's length are never used.  The sums
+        use np.einsum rather than BLAS, as in scaled_forward, so that each
+        row is bit-for-bit what the single-sequence version computes. """
+    n_seqs, n_steps = emissions.shape[:2]
+    beliefs = np.zeros(emissions.shape)
+    prev = None
+    for t in range(n_steps):
+        if prev is None:
+            dist = model.start * emissions[:, 0]
+        else:
+            dist = np.einsum('bk,ks->bs', prev, model.trans)
+            dist *= emissions[:, t]
+        totals = dist.sum(axis=1)
+        positive = totals > 0
+        dist[positive] /= totals[positive, None]
+        beliefs[:, t] = dist
+        prev = dist
+    return [beliefs[b, :lengths[b]] for b in range(n_seqs)]
+
+
+def forward_backward_batch(model, emissions, lengths, with_end=False):
+    """ scaled Forward and Backward algorithms over a padded (B, T, |S|)
+        array of emission columns.  Returns (alphas, betas, totals): the
+        (B, T, |S|) belief and scaled backward vectors, as in scaled_forward
+        and scaled_backward, and the (B, T) normalizing sums.  Positions
+        past a sequence's length have alpha 0, beta 1 and total 1, so
+        alphas * betas are the posteriors, and summing the logs of totals
+        along axis 1 gives each sequence's log-likelihood.
+
+        With with_end set, the transition into <E> is part of the
+        likelihood, as Baum-Welch needs: the last beta of each sequence is
+        model.end, scaled, and totals is (B, T + 1), the total at
+        lengths[b] being P(<E> | e_1, ..., e_T). """
+    n_seqs, n_steps, n_states = emissions.shape
+    alphas = np.zeros(emissions.shape)
+    totals = np.ones((n_seqs, n_steps))
+    prev = None
+    for t in range(n_steps):
+        if prev is None:
+            dist = model.start * emissions[:, 0]
+        else:
+            dist = np.einsum('bk,ks->bs', prev, model.trans)
+            dist *= emissions[:, t]
+        step_totals = dist.sum(axis=1)
+        positive = step_totals > 0
+        dist[positive] /= step_totals[positive, None]
+        inside = lengths > t
+        alphas[inside, t] = dist[inside]
+        totals[inside, t] = step_totals[inside]
+        prev = dist
+    betas = np.ones(emissions.shape)
+    if with_end:
+        totals = np.hstack([totals, np.ones((n_seqs, 1))])
+        rows = np.flatnonzero(lengths > 0)
+        last = lengths[rows] - 1
+        end_totals = alphas[rows, last] @ model.end
+        totals[rows, lengths[rows]] = end_totals
+        betas[rows, last] = model.end / np.where(end_totals > 0, end_totals,
+                                                 1)[:, None]
+    for t in range(n_steps - 2, -1, -1):
+        inside = lengths > t + 1
+        step_totals = totals[:, t + 1]
+        beta = np.einsum('sk,bk->bs', model.trans,
+                         emissions[:, t + 1] * betas[:, t + 1])
+        beta /= np.where(step_totals > 0, step_totals, 1)[:, None]
+        beta[step_totals == 0] = 0
+        betas[inside, t] = beta[inside]
+    return alphas, betas, totals
+
+
+def posterior_batch(model, emissions, lengths):
+    """ posterior marginals over a padded (B, T, |S|) array of emission
+        columns.  Returns a list with the (lengths[b], |S|) array of
+        P(S_t = s | e_1, ..., e_T) of each sequence, all zeros for a
+        sequence that the model cannot produce. """
+    alphas, betas, totals = forward_backward_batch(model, emissions, lengths)
+    posteriors = alphas * betas
+    return [posteriors[b, :lengths[b]] for b in range(len(lengths))]
+
+
+def viterbi_batch(model, emissions, lengths):
+    """ Viterbi algorithm over a padded (B, T, |S|) array of emission
+        columns.  A sequence stops updating its scores once t reaches its
+        length, so every path equals the one viterbi would return for that
+        sequence alone.  Returns a list of lists of state indices. """
+    n_seqs, n_steps = emissions.shape[:2]
+    if n_steps == 0:
+        return [[] for b in range(n_seqs)]
+    rows = np.arange(n_seqs)
+    back_ptrs = np.zeros((n_seqs, n_steps, len(model.states)), dtype=np.intp)
+    v = model.start * emissions[:, 0]
+    for t in range(1, n_steps):
+        active = np.flatnonzero(lengths > t)
+        scores = v[active, :, None] * model.trans * emissions[active, t, None, :]
+        best = scores.argmax(axis=1)
+        back_ptrs[active, t] = best
+        v[active] = np.take_along_axis(scores, best[:, None, :], axis=1)[:, 0]
+    paths = np.zeros((n_seqs, n_steps), dtype=np.intp)
+    current = v.argmax(axis=1)
+    for t in range(n_steps - 1, -1, -1):
+        inside = lengths > t
+        paths[inside, t] = current[inside]
+        if t > 0:
+            current = np.where(inside, back_ptrs[rows, t, current], current)
+    return [paths[b, :lengths[b]].tolist() for b in range(n_seqs)]
+
+
+def beam_search(model, emissions, beam):
+    """ Viterbi search in log space that keeps only the beam best states of
+        each column.  Faster than log_viterbi for small beams, but it may
+        miss the best path.  Returns a list of state indices. """
+    n_steps = len(emissions)
+    if n_steps == 0:
+        return []
+    log_start, log_trans = model.log_params()
+    log_e = safe_log(emissions)
+    n_states = len(model.states)
+    beam = min(beam, n_states)
+    scores = log_start + log_e[0]
+    kept = _top(scores, beam)
+    back_ptrs = []
+    for t in range(1, n_steps):
+        candidates = scores[kept, None] + log_trans[kept] + log_e[t]
+        best = candidates.argmax(axis=0)
+        scores = candidates[best, np.arange(n_states)]
+        back_ptrs.append(kept[best])
+        kept = _top(scores, beam)
+    path = [int(kept[scores[kept].argmax()])]
+    for t in range(n_steps - 2, -1, -1):
+        path.append(int(back_ptrs[t][path[-1]]))
+    path.reverse()
+    return path
+
+
+def k_best_viterbi(model, emissions, k):
+    """ list Viterbi algorithm in log space: keeps the k best partial paths
+        into every state, and returns up to k (log probability, path) pairs
+        for the best complete paths, best first.  Paths are lists of state
+        indices; paths of probability 0 are left out.  The first path is
+        the one log_viterbi returns. """
+    n_steps = len(emissions)
+    if n_steps == 0:
+        return []
+    log_start, log_trans = model.log_params()
+    log_e = safe_log(emissions)
+    n_states = len(model.states)
+    # scores[s, r] is the log probability of the r-th best path into s.
+    scores = np.full((n_states, k), -np.inf)
+    scores[:, 0] = log_start + log_e[0]
+    back_ptrs = []
+    for t in range(1, n_steps):
+        candidates = scores[:, :, None] + log_trans[:, None, :] + log_e[t]
+        candidates = candidates.reshape(n_states * k, n_states)
+        order = np.argsort(-candidates, axis=0, kind='stable')[:k]
+        scores = np.take_along_axis(candidates, order, axis=0).T
+        back_ptrs.append(order.T)
+    flat = scores.reshape(-1)
+    results = []
+    for i in np.argsort(-flat, kind='stable')[:k]:
+        if flat[i] == -np.inf:
+            break
+        state, rank = divmod(int(i), k)
+        path = [state]
+        for t in range(n_steps - 2, -1, -1):
+            state, rank = divmod(int(back_ptrs[t][state, rank]), k)
+            path.append(state)
+        path.reverse()
+        results.append((float(flat[i]), path))
+    return results
+
+
+def _top(scores, n):
+    """ indices of the n highest scores, in state order """
+    if n >= len(scores):
+        return np.arange(len(scores))
+    return np.sort(np.argpartition(-scores, n - 1)[:n])
@@ -0,0 +1,389 @@
+"""hmm_trainer.py
+
+Builds HMM parameters from JSONL files of tagged tweets, such as
+twt.train.json, where each line is a list of [word, tag] pairs.
+
+HMMTrainer reads the files one line at a time and only keeps counts:
+transition counts between tags, emission counts per tag, and the
+vocabulary, as dicts and Counters.  Training is linear in the size of the
+corpus, and memory grows with the number of distinct words and
+(tag, word) pairs rather than with the number of tweets.
+
+Transition probabilities are maximum-likelihood estimates.  Emission
+probabilities come from a pluggable smoothing method:
+
+MaximumLikelihood -- count(s, w) / count(s); no smoothing.
+AddAlpha -- (count(s, w) + alpha) / (count(s) + alpha * |V|).  With
+   alpha = 1 this is the Laplace smoothing of build_twitter_hmm_laplace.py.
+WittenBell -- interpolates with a uniform distribution over the
+   vocabulary, weighted by the number of distinct words seen with s.
+KneserNey -- absolute discounting, backing off to the "continuation"
+   distribution of a word: the fraction of distinct (tag, word) pairs that
+   have that word, add-one smoothed so that every word has some.
+
+MaximumLikelihood and AddAlpha store emission probabilities for the
+(tag, word) pairs seen in training, plus any pairs added with
+register_pairs, as in the original builders.  WittenBell and KneserNey
+give every word of the vocabulary a probability under every state, so
+that each state's emission distribution sums to 1.  The result of
+parameters() can be written with write_model and loaded by hmm.HMM, or
+used directly with HMM.set_parameters.
+
+A corpus split into many shards, such as a directory of JSONL files, can
+be counted by count_shards in parallel: each shard is counted by a worker
+process, and the count tables are summed with HMMTrainer.merge.  Counts
+are only normalized into probabilities at the end, so the result is the
+same as counting the shards one after the other.  The counts themselves
+can be saved with save_counts and loaded again with load_counts, so that
+a new shard can be folded in without recounting the old ones
+(count_new_shards).  The shards already counted are recorded by the SHA-1
+hash of their contents, so two different shards with the same file name
+are both counted, and a shard that was moved or renamed is not counted
+twice.
+
+Usage:
+    python hmm_trainer.py model.json corpus.json|shard_dir ...
+        [--smoothing none|add-alpha|witten-bell|kneser-ney] [--alpha A]
+        [--discount D] [--workers N] [--counts counts.json]
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+from collections import Counter
+
+# The tag set of Gimpel et al., with the special start and end states.
+TWITTER_S = ['<S>', 'N', 'O', 'S', '^', 'Z', 'L', 'M', 'V', 'A', 'R', '!',
+             'D', 'P', '&', 'T', 'X', 'Y', '#', '@', '~', 'U', 'E', '$', ',',
+             'G', '<E>']
+
+
+class MaximumLikelihood:
+    """ unsmoothed emission probabilities """
+
+    def emission_probs(self, counts, trainer):
+        total = sum(counts.values())
+        if total == 0:
+            return dict(counts)
+        return {o: c / total for o, c in counts.items()}
+
+
+class AddAlpha:
+    """ add-alpha (Lidstone) smoothing; alpha = 1 is Laplace smoothing """
+
+    def __init__(self, alpha=1):
+        self.alpha = alpha
+
+    def emission_probs(self, counts, trainer):
+        total = sum(counts.values())
+        denominator = total + self.alpha * len(trainer.vocabulary)
+        return {o: (c + self.alpha) / denominator for o, c in counts.items()}
+
+
+class WittenBell:
+    """ Witten-Bell smoothing, interpolating with a uniform distribution """
+
+    def emission_probs(self, counts, trainer):
+        vocabulary = trainer.vocabulary
+        if not vocabulary:
+            return {}
+        total = sum(counts.values())
+        types = sum(1 for c in counts.values() if c > 0)
+        uniform = 1 / len(vocabulary)
+        if total == 0:
+            return {o: uniform for o in vocabulary}
+        return {o: (counts.get(o, 0) + types * uniform) / (total + types)
+                for o in vocabulary}
+
+
+class KneserNey:
+    """ Kneser-Ney-style absolute discounting for emissions """
+
+    def __init__(self, discount=0.75):
+        self.discount = discount
+
+    def emission_probs(self, counts, trainer):
+        vocabulary = trainer.vocabulary
+        continuation = trainer.continuation_counts()
+        denominator = sum(continuation.values()) + len(vocabulary)
+        total = sum(counts.values())
+        if total == 0:
+            return {o: (continuation[o] + 1) / denominator
+                    for o in vocabulary}
+        # The mass taken off the seen words, min(c, discount) each.
+        backoff = sum(min(c, self.discount) for c in counts.values()) / total
+        return {o: max(counts.get(o, 0) - self.discount, 0) / total
+                + backoff * (continuation[o] + 1) / denominator
+                for o in vocabulary}
+
+
+SMOOTHING = {
+    'none': MaximumLikelihood,
+    'add-alpha': AddAlpha,
+    'witten-bell': WittenBell,
+    'kneser-ney': KneserNey,
+}
+
+
+class HMMTrainer:
+    """ accumulates counts from tagged tweets and turns them into HMM
+        parameters """
+
+    def __init__(self, S=TWITTER_S, smoothing=None):
+        """ S lists the states, starting with '<S>' and ending with '<E>'.
+            smoothing is one of the emission smoothing objects above; the
+            default is MaximumLikelihood. """
+        self.S = list(S)
+        self.smoothing = smoothing if smoothing is not None \
+            else MaximumLikelihood()
+        self.vocabulary = {}
+        self.transitions = {s: Counter() for s in self.S if s != '<E>'}
+        self.emissions = {s: Counter() for s in self.states()}
+        self.sources = []
+        self._continuation = None
+
+    def states(self):
+        """ the real states, without <S> and <E> """
+        return [s for s in self.S if s != '<S>' and s != '<E>']
+
+    def count_tweet(self, twt):
+        """ add the counts of one tweet, a list of [word, tag] pairs """
+        vocabulary = self.vocabulary
+        transitions = self.transitions
+        emissions = self.emissions
+        prev = '<S>'
+        for o, s in twt:
+            if o not in vocabulary:
+                vocabulary[o] = None
+            transitions[prev][s] += 1
+            emissions[s][o] += 1
+            prev = s
+        transitions[prev]['<E>'] += 1
+        self._continuation = None
+
+    def count_file(self, filename):
+        """ add the counts of every tweet in a JSONL file, and record the
+            file_digest of the file in sources """
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for line in f:
+                digest.update(line)
+                self.count_tweet(json.loads(line))
+        self.sources.append(digest.hexdigest())
+
+    def merge(self, other):
+        """ add the counts of another trainer with the same states.  Words
+            new to this trainer are appended to the vocabulary in the order
+            of the other one, so merging the trainers of consecutive shards
+            gives the same vocabulary order as counting them serially. """
+        if other.S != self.S:
+            raise ValueError("Cannot merge counts over different states")
+        for o in other.vocabulary:
+            if o not in self.vocabulary:
+                self.vocabulary[o] = None
+        for prev, counts in other.transitions.items():
+            self.transitions[prev].update(counts)
+        for s, counts in other.emissions.items():
+            self.emissions[s].update(counts)
+        self.sources += other.sources
+        self._continuation = None
+        return self
+
+    def save_counts(self, filename):
+        """ write the raw counts, not the probabilities, to a JSON file """
+        with open(filename, 'w') as f:
+            json.dump(self.get_counts(), f)
+
+    @classmethod
+    def load_counts(cls, filename, smoothing=None):
+        """ make a trainer from a file written by save_counts """
+        with open(filename, 'r') as f:
+            saved = json.load(f)
+        trainer = cls(saved['S'], smoothing)
+        trainer.set_counts(saved)
+        return trainer
+
+    def get_counts(self):
+        """ the raw counts as a dict that can be written as JSON """
+        return {'S': self.S, 'O': list(self.vocabulary),
+                'transitions': self.transitions,
+                'emissions': self.emissions, 'sources': self.sources}
+
+    def set_counts(self, saved):
+        """ replace the counts with those of a dict from get_counts """
+        self.vocabulary = dict.fromkeys(saved['O'])
+        for prev, counts in saved['transitions'].items():
+            self.transitions[prev] = Counter(counts)
+        for s, counts in saved['emissions'].items():
+            self.emissions[s] = Counter(counts)
+        if any(not _is_digest(source) for source in saved['sources']):
+            raise ValueError("The saved counts record their shards by file "
+                             "name, not by contents; count them again")
+        self.sources = saved['sources']
+        self._continuation = None
+
+    def register_pairs(self, filename):
+        """ add the words and (tag, word) pairs of a JSONL file without
+            counting them, so that smoothing gives them probability mass.
+            build_twitter_hmm_laplace.py does this with twt.test.json. """
+        vocabulary = self.vocabulary
+        emissions = self.emissions
+        with open(filename, 'r') as f:
+            for line in f:
+                for o, s in json.loads(line):
+                    if o not in vocabulary:
+                        vocabulary[o] = None
+                    if o not in emissions[s]:
+                        emissions[s][o] = 0
+        self._continuation = None
+
+    def continuation_counts(self):
+        """ for every word, the number of states it was seen with """
+        if self._continuation is None:
+            continuation = Counter()
+            for counts in self.emissions.values():
+                for o, c in counts.items():
+                    if c > 0:
+                        continuation[o] += 1
+            self._continuation = continuation
+        return self._continuation
+
+    def transition_probs(self):
+        """ maximum-likelihood transition probabilities, with every state of
+            S as a key of every row, as in the original builders """
+        P_trans = {}
+        for prev, counts in self.transitions.items():
+            targets = [s for s in self.S if s != '<S>'] if prev == '<S>' \
+                else self.S
+            total = sum(counts.values())
+            P_trans[prev] = {s: counts[s] / total if total else 0
+                             for s in targets}
+        return P_trans
+
+    def parameters(self):
+        """ return the model as a dict with keys 'S', 'O', 'P_trans' and
+            'P_emission', the layout of the JSON model files """
+        P_emission = {s: self.smoothing.emission_probs(self.emissions[s], self)
+                      for s in self.states()}
+        return {'S': list(self.S), 'O': list(self.vocabulary),
+                'P_trans': self.transition_probs(), 'P_emission': P_emission}
+
+    def write_model(self, filename, indent=None):
+        """ write the model to a JSON file that hmm.HMM can load """
+        with open(filename, 'w') as f:
+            f.write(json.dumps(self.parameters(), indent=indent))
+
+
+def train(filenames, smoothing=None, S=TWITTER_S):
+    """ count every JSONL file in filenames and return the trainer """
+    trainer = HMMTrainer(S, smoothing)
+    for filename in filenames:
+        trainer.count_file(filename)
+    return trainer
+
+
+def _count_shard(args):
+    filename, trainer_class, S = args
+    trainer = trainer_class(S)
+    trainer.count_file(filename)
+    return trainer
+
+
+def count_shards(filenames, workers=None, smoothing=None, S=TWITTER_S,
+                 trainer=None):
+    """ count each JSONL shard in a separate worker process and merge the
+        counts, in the order of filenames, into trainer (a new HMMTrainer
+        if None).  The shards are counted by trainers of the same class as
+        trainer, such as trigram_hmm.TrigramTrainer.  Returns the
+        trainer. """
+    if trainer is None:
+        trainer = HMMTrainer(S, smoothing)
+    jobs = [(filename, type(trainer), trainer.S) for filename in filenames]
+    with multiprocessing.Pool(workers) as pool:
+        for shard in pool.imap(_count_shard, jobs):
+            trainer.merge(shard)
+    return trainer
+
+
+def file_digest(filename):
+    """ the SHA-1 hash of a file's contents, in hexadecimal, by which
+        HMMTrainer.sources records the files counted """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _is_digest(source):
+    return len(source) == 40 and all(c in '0123456789abcdef' for c in source)
+
+
+def count_new_shards(trainer, paths, workers=1):
+    """ count the JSONL shards in paths (files or directories of them)
+        whose contents trainer has not counted yet, in parallel with more
+        than one worker.  Returns the list of shards counted. """
+    counted = set(trainer.sources)
+    shards = []
+    for path in shard_paths(paths):
+        digest = file_digest(path)
+        if digest not in counted:
+            counted.add(digest)
+            shards.append(path)
+    if workers > 1:
+        count_shards(shards, workers, trainer=trainer)
+    else:
+        for shard in shards:
+            trainer.count_file(shard)
+    return shards
+
+
+def shard_paths(paths):
+    """ expand directories in paths into their JSON/JSONL files, sorted """
+    shards = []
+    for path in paths:
+        if os.path.isdir(path):
+            shards += sorted(os.path.join(path, name)
+                             for name in os.listdir(path)
+                             if name.endswith(('.json', '.jsonl')))
+        else:
+            shards.append(path)
+    return shards
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Train an HMM POS tagger from JSONL files of tagged '
+                    'tweets.')
+    parser.add_argument('output', help='JSON model file to write')
+    parser.add_argument('corpus', nargs='+',
+                        help='JSONL training files or directories of shards')
+    parser.add_argument('--smoothing', default='none',
+                        choices=sorted(SMOOTHING))
+    parser.add_argument('--alpha', type=float, default=1,
+                        help='alpha for add-alpha smoothing')
+    parser.add_argument('--discount', type=float, default=0.75,
+                        help='discount for Kneser-Ney smoothing')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='count shards in this many processes')
+    parser.add_argument('--counts', default=None,
+                        help='JSON file of saved counts: shards not yet in '
+                             'it are counted and folded in, then it is '
+                             'saved again')
+    args = parser.parse_args()
+    if args.smoothing == 'add-alpha':
+        smoothing = AddAlpha(args.alpha)
+    elif args.smoothing == 'kneser-ney':
+        smoothing = KneserNey(args.discount)
+    else:
+        smoothing = SMOOTHING[args.smoothing]()
+    if args.counts is not None and os.path.exists(args.counts):
+        trainer = HMMTrainer.load_counts(args.counts, smoothing)
+    else:
+        trainer = HMMTrainer(TWITTER_S, smoothing)
+    count_new_shards(trainer, args.corpus, args.workers)
+    if args.counts is not None:
+        trainer.save_counts(args.counts)
+    trainer.write_model(args.output)
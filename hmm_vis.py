@@ -42,6 +42,36 @@ show_observation -- draws a textual label above a column of states.
 
 hold -- pause the program so that the Tkinter window does not automatically close
 
+For the 25-tag Twitter model and long tweets, drawing all |S|^2 edges of
+every column as Tkinter items takes seconds.  Some options of
+start_HMM_display (and show_entire_trellis) keep the drawing small:
+
+edge_filter -- a function (state1, state2) -> bool; only the edges for which
+   it is true are drawn.  select_edges makes one that keeps the edges of
+   nonzero transition probability, or only the top_k most probable edges
+   out of each state.  highlight_edge still draws an edge that was left out.
+
+lazy -- columns are laid out at once, but their nodes and edges are only
+   drawn when the algorithm first labels or highlights something in them.
+   Labels and highlights for columns that are not drawn yet are kept and
+   applied when they are.
+
+column_width -- columns are this many pixels apart, instead of being
+   squeezed into the window, and the canvas scrolls horizontally.  Only the
+   columns that have been scrolled into view are drawn.
+
+backend -- 'tk' (the default) opens a window; 'svg' draws without a display
+   onto an SVGCanvas, which save() writes to an .svg file, or to a .png file
+   if Pillow is installed.
+
+The drawing state of a diagram (its canvas, layout and canvas items) is
+kept in a Trellis object, with a method for each of the functions above,
+plus render (show_entire_trellis), reset and dispose.  Several trellises
+can be drawn at once, each in its own window (all sharing one Tk
+instance) or on its own SVGCanvas.  The functions above act on the
+Trellis made by the last start_HMM_display or show_entire_trellis call,
+which both return it.
+
 At the end of this file there is a bunch of example calls to several of these
 methods to show how they are used.  Running this file as a main program
 demonstrates the capabilities.
@@ -49,229 +79,544 @@ demonstrates the capabilities.
 S. Tanimoto, May 20, 2020.
 """
 
-import tkinter as tk
-DIAGRAM = None # global var. for the tkinter Canvas object
+import html
+
+try:
+    import tkinter as tk
+except ImportError: # Servers without Tk can still use the 'svg' backend.
+    tk = None
+
 RAD = 10 # Radius of node circles on the screen, in pixels. Also used elsewhere,
  # as a unit for default spacing of some other things like margins.
 Y_OBSERVATIONS = RAD
 
-STATES_DX = None # horizontal spacing for nodes, computed automatically.
-STATES_DY = None # Vertical spacing for nodes, computed automatically.
-NEXT_STATE_X = None # Where horizontally to put the next column of states.
-FIRST_STATE_X = None # Horizontal coordinate of the first column of states.
-FIRST_STATE_Y = None # Vertical coordinate of the first state.
-LAST_STATE_X = None # Horizontal coordinate of the last column of states.
-LAST_STATE_Y = None # Vertical coordinate of the last state.
-NODE_COORDS_CACHE = {}
-LAYER_NO = None # Counts the time steps drawn so far.
-X_VALUES = [] # Somewhat redundant with NODE_COORDS_CACHE, but holds x coords only
-NODE_ITEMS = {} # Stores the circle canvas objects for poss. highlighting.
-EDGE_ITEMS = {} # Stores the line objects for poss. highlighting.
-
-def show_edge(x1,y1,x2,y2,starting_level,state1_string,state2_string,label='',dx=0,dy=0,color='black',rad=10):
-    # Adds a graph edge to the canvas. Called by start_HMM_display,
-    # show_initial_state, and show_next_time_step.
-    line = DIAGRAM.create_line(x1,y1,x2,y2,fill=color)
-    if label != '':
-        x = int(0.5*(x1+x2)+dx)
-        y = int(0.5*(y1+y2)+dy)
-        DIAGRAM.create_text(x,y,text=label,fill=color)
-    try:
-        EDGE_ITEMS[(starting_level, state1_string, state2_string)]=line # Save canvas object for later access.
-    except:
-        print("Could not save line canvas item in show_edge.")
-    return line # Return value only needed if an app will need to
-    # later modify or delete the edge.
-
-def show_node(x1,y1,rad,label='',dx=0,dy=0,color='light gray', outline='dark red'):
-    node = DIAGRAM.create_oval(x1-rad,y1-rad,x1+rad,y1+rad,fill=color,outline=outline)
-    if label != '':
-        x=x1+dx
-        y=y1+dy
-        DIAGRAM.create_text(x,y,text=label,fill='black')
-    try:
-        NODE_ITEMS[(LAYER_NO, label)]=node # Save canvas object for later access.
-    except:
-        print("Could not save oval canvas item in show_node.")
-    return node # This return value should not normally be needed, but is
-    # returned for consistency with other methods here.
-
-def start_HMM_display(S, expected_N, width=5000, height=5000,
-                      has_initial_state=True):
-    '''Call this before calling show_next_time_step.
-    S is the full set of states, including <S> and <E> special states,
-    which must be at the beginning of S and end of S, respectively.
-    However, these special states are not required.
-    If not using them, set has_initial_state to False.
-    expected_N is the number of columns to lay out.
-    '''
-    global DIAGRAM, STATES_DX, STATES_DY, NEXT_STATE_X
-    global FIRST_STATE_X, LAST_STATE_X, FIRST_STATE_Y, LAST_STATE_Y
-    global LAYER_NO
-
-    # Set up a Tkinter window and canvas.
-    window = tk.Tk()
-    window.title("A Trellis Diagram from hmm_vis.py")
-    DIAGRAM = tk.Canvas(width=width, height=height)
-    DIAGRAM.pack()
-
-    # Compute some layout parameters, and initialize data structures.
-    LAYER_NO = 0
-    FIRST_STATE_X=3*RAD
-    LAST_STATE_X = width-3*RAD
-    FIRST_STATE_Y=5*RAD # Leave enough space for some labels.
-    LAST_STATE_Y=height-3*RAD
-    if has_initial_state:
-        Sprime = S[1:-1]
-        expected_N += 1
-    else:
-        Sprime = S
-    STATES_DX = int((LAST_STATE_X - FIRST_STATE_X)/expected_N)
-    STATES_DY = int((LAST_STATE_Y - FIRST_STATE_Y)/(len(Sprime)-1))
-    NEXT_STATE_X = FIRST_STATE_X
-    if has_initial_state:
-        # draw node half-way down 1st column
-        show_initial_state(Sprime, S[0])
-
-def show_initial_state(Sprime, s0):
-    '''Assumes there is a single starting state, and that it is
-     the first element of list S.'''
-    global FIRST_STATE_X, FIRST_STATE_Y, LAST_STATE_Y, STATES_DX, STATES_DY
-    global NEXT_STATE_X, RAD, X_VALUES, LAYER_NO
-    x1 = FIRST_STATE_X
-    y1 = int((FIRST_STATE_Y + LAST_STATE_Y)/2)
-    # draw outgoing edges
-    x2 = x1 + STATES_DX
-    y2 = FIRST_STATE_Y
-    for i in range(len(Sprime)):
-        show_edge(x1, y1, x2, y2, LAYER_NO, s0, Sprime[i])
-        y2 += STATES_DY
-    show_node(x1, y1, RAD, label=s0)
-    cache_coords((0, s0), x1, y1) # Save coordinates to facilitate later
-    # displays of textual labels, etc.
-    NEXT_STATE_X += STATES_DX
-    LAYER_NO += 1
-    X_VALUES = [FIRST_STATE_X, NEXT_STATE_X]
-
-def cache_coords(node_key, x, y):
-    '''Save coordinates of each node on the screen, for easy
-    repainting, or adding text labels, as an algorithm runs.'''
-    NODE_COORDS_CACHE[node_key] = (x,y)
-
-def get_coords(layer_no, state_string):
-    try:
-        (x,y) = NODE_COORDS_CACHE[(layer_no, state_string)]
-    except:
-        print("No coordinates stored for layer no ", layer_no, " and state string ",state_string)
-        return (30,30) # Allows execution to continue, but graphics might pile up here.
-    return (x,y)
-
 
-def show_next_time_step(S, first=False, last=False, has_end_state=False):
-    '''Draw a column of states and the edges leading out from them.
-     But if last is True, don't draw outgoing edges, except
-     if has_end_state is also True, and then draw special outgoing
-     edges to a single end state.
-     If first is True, currently also skips drawing the edges,
-     but this may be a redundant option.
-     '''
-    global NEXT_STATE_X, LAYER_NO
-    y = FIRST_STATE_Y
-    x1 = NEXT_STATE_X
-    x2 = x1 + STATES_DX
-    if has_end_state:
-        Sprime = S[1:-1]
-    else:
-        Sprime = S
-    if not first and not last:
-        y1 = y
+class SVGCanvas:
+    '''A headless stand-in for tk.Canvas, with the few methods used here.
+    Items are kept as (kind, coords, options) and written out by save.'''
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.items = []
+
+    def _add(self, kind, coords, options):
+        self.items.append((kind, coords, options))
+        return len(self.items) - 1
+
+    def create_line(self, x1, y1, x2, y2, fill='black', width=1):
+        return self._add('line', (x1, y1, x2, y2), {'fill': fill, 'width': width})
+
+    def create_oval(self, x1, y1, x2, y2, fill='', outline='black', width=1):
+        return self._add('oval', (x1, y1, x2, y2),
+                         {'fill': fill, 'outline': outline, 'width': width})
+
+    def create_text(self, x, y, text='', fill='black'):
+        return self._add('text', (x, y), {'text': str(text), 'fill': fill})
+
+    def itemconfig(self, item, **options):
+        self.items[item][2].update(options)
+
+    def to_svg(self):
+        '''Return the drawing as the text of an SVG document.'''
+        lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">'
+                 % (self.width, self.height),
+                 '<rect width="100%" height="100%" fill="white"/>']
+        for kind, coords, options in self.items:
+            if kind == 'line':
+                lines.append('<line x1="%g" y1="%g" x2="%g" y2="%g" stroke="%s" '
+                             'stroke-width="%g"/>' % (coords + (svg_color(options['fill']),
+                                                               options['width'])))
+            elif kind == 'oval':
+                x1, y1, x2, y2 = coords
+                lines.append('<ellipse cx="%g" cy="%g" rx="%g" ry="%g" fill="%s" '
+                             'stroke="%s" stroke-width="%g"/>'
+                             % ((x1+x2)/2, (y1+y2)/2, (x2-x1)/2, (y2-y1)/2,
+                                svg_color(options['fill']) or 'none',
+                                svg_color(options['outline']), options['width']))
+            else:
+                lines.append('<text x="%g" y="%g" fill="%s" font-family="sans-serif" '
+                             'font-size="10" text-anchor="middle" '
+                             'dominant-baseline="central">%s</text>'
+                             % (coords + (svg_color(options['fill']),
+                                          html.escape(options['text']))))
+        lines.append('</svg>')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename):
+        '''Write the drawing to an .svg file, or to a .png file with Pillow.'''
+        if not filename.lower().endswith('.png'):
+            with open(filename, 'w') as f:
+                f.write(self.to_svg())
+            return
+        try:
+            from PIL import Image, ImageDraw
+        except ImportError:
+            raise ImportError("Writing PNG files needs Pillow; "
+                              "save to an .svg file instead.")
+        image = Image.new('RGB', (self.width, self.height), 'white')
+        draw = ImageDraw.Draw(image)
+        for kind, coords, options in self.items:
+            if kind == 'line':
+                draw.line(coords, fill=svg_color(options['fill']),
+                          width=int(options['width']))
+            elif kind == 'oval':
+                draw.ellipse(coords, fill=svg_color(options['fill']) or None,
+                             outline=svg_color(options['outline']),
+                             width=int(options['width']))
+            else:
+                draw.text(coords, options['text'], fill=svg_color(options['fill']),
+                          anchor='mm')
+        image.save(filename)
+
+
+def svg_color(color):
+    # Tk color names such as 'light gray' are SVG names without the spaces.
+    return color.replace(' ', '')
+
+
+def select_edges(P_trans, top_k=None):
+    '''Return an edge filter for start_HMM_display that keeps the edges of
+    nonzero probability in P_trans (a dict of dicts, as in hmm.HMM), or, if
+    top_k is given, only the top_k most probable of those out of each state.'''
+    kept = set()
+    for s1, row in P_trans.items():
+        successors = [s2 for s2 in sorted(row, key=row.get, reverse=True)
+                      if row[s2] > 0]
+        if top_k is not None:
+            successors = successors[:top_k]
+        for s2 in successors:
+            kept.add((s1, s2))
+    return lambda s1, s2: (s1, s2) in kept
+
+
+
+class Trellis:
+    '''One trellis diagram, with its own canvas, layout and canvas items.
+    Any number of them can be drawn in one process; the module functions
+    below act on the one made by the last start_HMM_display call.'''
+
+    def __init__(self):
+        self.window = None # The Tk Toplevel window, if any.
+        self.diagram = None # The tkinter Canvas object (or SVGCanvas).
+        self.scrollbar = None # The horizontal scrollbar of a scrolling Tk canvas.
+        self.reset()
+
+    def reset(self):
+        '''Remove the drawing and forget its layout.  A Tk window stays open,
+        so that start can draw a new diagram in it.'''
+        if self.diagram is not None and not isinstance(self.diagram, SVGCanvas):
+            self.diagram.destroy()
+            if self.scrollbar is not None:
+                self.scrollbar.destroy()
+        self.diagram = None
+        self.scrollbar = None
+        self.states_dx = None # horizontal spacing for nodes, computed automatically.
+        self.states_dy = None # Vertical spacing for nodes, computed automatically.
+        self.next_state_x = None # Where horizontally to put the next column of states.
+        self.first_state_x = None # Horizontal coordinate of the first column of states.
+        self.first_state_y = None # Vertical coordinate of the first state.
+        self.last_state_x = None # Horizontal coordinate of the last column of states.
+        self.last_state_y = None # Vertical coordinate of the last state.
+        self.node_coords = {}
+        self.layer_no = None # Counts the time steps drawn so far.
+        self.x_values = [] # Somewhat redundant with node_coords, but holds x coords only
+        self.node_items = {} # Stores the circle canvas objects for poss. highlighting.
+        self.edge_items = {} # Stores the line objects for poss. highlighting.
+        self.edge_filter = None # If not None, only edges (s1, s2) for which it is true are drawn.
+        self.lazy = False # Whether columns wait for the algorithm to reach them.
+        self.reached = -1 # In lazy mode, the last layer that the algorithm has reached.
+        self.viewport = None # (x_min, x_max) of the visible part of a scrolling canvas.
+        self.pending = {} # Drawing calls waiting for their layer to be drawn, by layer.
+
+    def dispose(self):
+        '''Remove the drawing and close its window, if any.'''
+        self.reset()
+        if self.window is not None:
+            self.window.destroy()
+            _WINDOWS.discard(self)
+            self.window = None
+            if not _WINDOWS:
+                _TK_ROOT.quit() # Let hold return once every window is closed.
+
+    def start(self, S, expected_N, width=5000, height=5000,
+              has_initial_state=True, edge_filter=None, lazy=False,
+              column_width=None, backend='tk'):
+        '''Call this before calling show_next_time_step.
+        S is the full set of states, including <S> and <E> special states,
+        which must be at the beginning of S and end of S, respectively.
+        However, these special states are not required.
+        If not using them, set has_initial_state to False.
+        expected_N is the number of columns to lay out.
+        edge_filter, lazy, column_width and backend are described at the top
+        of this file.
+        '''
+        self.reset()
+        self.edge_filter = edge_filter
+        self.lazy = lazy
+        full_width = width
+        if column_width is not None:
+            full_width = 6*RAD + column_width*(expected_N + (1 if has_initial_state else 0))
+        if backend == 'svg':
+            self.diagram = SVGCanvas(full_width, height)
+        else:
+            # Set up a Tkinter window and canvas.
+            if self.window is None:
+                self.window = tk.Toplevel(tk_root())
+                self.window.title("A Trellis Diagram from hmm_vis.py")
+                self.window.protocol('WM_DELETE_WINDOW', self.dispose)
+                _WINDOWS.add(self)
+            self.diagram = tk.Canvas(self.window, width=width, height=height)
+            if full_width > width:
+                # Scroll horizontally, drawing columns as they come into view.
+                self.scrollbar = tk.Scrollbar(self.window, orient=tk.HORIZONTAL,
+                                              command=self.diagram.xview)
+                self.diagram.configure(scrollregion=(0, 0, full_width, height),
+                                       xscrollcommand=self.update_viewport)
+                self.scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+                self.viewport = (0, width)
+            self.diagram.pack()
+
+        # Compute some layout parameters, and initialize data structures.
+        self.layer_no = 0
+        self.first_state_x = 3*RAD
+        self.last_state_x = full_width-3*RAD
+        self.first_state_y = 5*RAD # Leave enough space for some labels.
+        self.last_state_y = height-3*RAD
+        if has_initial_state:
+            Sprime = S[1:-1]
+            expected_N += 1
+        else:
+            Sprime = S
+        self.states_dx = int((self.last_state_x - self.first_state_x)/expected_N)
+        self.states_dy = int((self.last_state_y - self.first_state_y)/(len(Sprime)-1))
+        self.next_state_x = self.first_state_x
+        self.x_values = [self.first_state_x]
+        if has_initial_state:
+            # draw node half-way down 1st column
+            self.show_initial_state(Sprime, S[0])
+        return self
+
+    def render(self, S, observation_sequence, width=1800, height=1000, **options):
+        # Display all basic elements of a trellis diagram for a given HMM.
+        # This includes nodes, edges, node labels (with state names), and an observation sequence.
+        # The number of time steps shown depends on the observation sequence length.
+        # The other options are passed on to start.
+        n_expected = len(observation_sequence)
+        options['has_initial_state'] = True
+        self.start(S, n_expected, width=width, height=height, **options)
+        for level in range(n_expected-1):
+            self.show_next_time_step(S, has_end_state=True)
+        self.show_next_time_step(S, last=True, has_end_state=True)
+        for i in range(1, n_expected+1):
+            self.show_observation(i, observation_sequence[i-1])
+        return self
+
+    def show_edge(self,x1,y1,x2,y2,starting_level,state1_string,state2_string,label='',dx=0,dy=0,color='black',rad=10):
+        # Adds a graph edge to the canvas. Called by show_initial_state,
+        # show_next_time_step and highlight_edge.
+        line = self.diagram.create_line(x1,y1,x2,y2,fill=color)
+        if label != '':
+            x = int(0.5*(x1+x2)+dx)
+            y = int(0.5*(y1+y2)+dy)
+            self.diagram.create_text(x,y,text=label,fill=color)
+        self.edge_items[(starting_level, state1_string, state2_string)]=line # Save canvas object for later access.
+        return line # Return value only needed if an app will need to
+        # later modify or delete the edge.
+
+    def show_node(self,x1,y1,rad,label='',dx=0,dy=0,color='light gray', outline='dark red',
+                  layer_no=None):
+        node = self.diagram.create_oval(x1-rad,y1-rad,x1+rad,y1+rad,fill=color,outline=outline)
+        if label != '':
+            x=x1+dx
+            y=y1+dy
+            self.diagram.create_text(x,y,text=label,fill='black')
+        if layer_no is None:
+            layer_no = self.layer_no
+        self.node_items[(layer_no, label)]=node # Save canvas object for later access.
+        return node # This return value should not normally be needed, but is
+        # returned for consistency with other methods here.
+
+    def edge_shown(self, state1_string, state2_string):
+        return self.edge_filter is None or self.edge_filter(state1_string, state2_string)
+
+    def layer_visible(self, layer_no):
+        '''Whether any part of the column, or of the edges leaving it, is in view.'''
+        if self.viewport is None:
+            return True
+        x = self.x_values[layer_no] if layer_no < len(self.x_values) else self.next_state_x
+        return x - self.states_dx <= self.viewport[1] and x + self.states_dx >= self.viewport[0]
+
+    def layer_ready(self, layer_no, reach=False):
+        '''Whether drawing in this layer can be done now.  With reach set, the
+        algorithm has got to this layer, which in lazy mode lets it be drawn.'''
+        if reach and layer_no > self.reached:
+            self.reached = layer_no
+            self.flush_pending()
+        return (not self.lazy or layer_no <= self.reached) and self.layer_visible(layer_no)
+
+    def when_ready(self, layer_no, function, *args, reach=False):
+        '''Call function(*args) now if layer_no is ready to be drawn, else once
+        it is.  Returns what function returns, or None if it was put off.'''
+        if self.layer_ready(layer_no, reach) and layer_no not in self.pending:
+            return function(*args)
+        self.pending.setdefault(layer_no, []).append((function, args))
+        return None
+
+    def flush_pending(self):
+        '''Draw everything that was waiting for a layer that is now ready.'''
+        for layer_no in sorted(self.pending):
+            if layer_no in self.pending and self.layer_ready(layer_no):
+                for function, args in self.pending.pop(layer_no):
+                    function(*args)
+
+    def update_viewport(self, *args):
+        # Called by Tk whenever the canvas scrolls: moves the scrollbar and
+        # draws the columns that came into view.
+        self.scrollbar.set(*args)
+        self.viewport = (self.diagram.canvasx(0),
+                         self.diagram.canvasx(int(self.diagram['width'])))
+        self.flush_pending()
+
+    def show_initial_state(self, Sprime, s0):
+        '''Assumes there is a single starting state, and that it is
+         the first element of list S.'''
+        x1 = self.first_state_x
+        y1 = int((self.first_state_y + self.last_state_y)/2)
+        self.cache_coords((0, s0), x1, y1) # Save coordinates to facilitate later
+        # displays of textual labels, etc.
+        self.x_values = [self.first_state_x, self.next_state_x + self.states_dx]
+        self.when_ready(self.layer_no, self.draw_initial_state, Sprime, s0, x1, y1)
+        self.next_state_x += self.states_dx
+        self.layer_no += 1
+
+    def draw_initial_state(self, Sprime, s0, x1, y1):
+        # draw outgoing edges
+        x2 = x1 + self.states_dx
+        y2 = self.first_state_y
         for i in range(len(Sprime)):
-            y2 = y
-            for j in range(len(Sprime)):
-                show_edge(x1, y1, x2, y2, LAYER_NO, Sprime[i], Sprime[j])
-                y2 += STATES_DY
-            y1 += STATES_DY
-    if last:
+            if self.edge_shown(s0, Sprime[i]):
+                self.show_edge(x1, y1, x2, y2, 0, s0, Sprime[i])
+            y2 += self.states_dy
+        self.show_node(x1, y1, RAD, label=s0, layer_no=0)
+
+    def cache_coords(self, node_key, x, y):
+        '''Save coordinates of each node on the screen, for easy
+        repainting, or adding text labels, as an algorithm runs.'''
+        self.node_coords[node_key] = (x,y)
+
+    def get_coords(self, layer_no, state_string):
+        try:
+            (x,y) = self.node_coords[(layer_no, state_string)]
+        except KeyError:
+            print("No coordinates stored for layer no ", layer_no, " and state string ",state_string)
+            return (30,30) # Allows execution to continue, but graphics might pile up here.
+        return (x,y)
+
+    def show_next_time_step(self, S, first=False, last=False, has_end_state=False):
+        '''Draw a column of states and the edges leading out from them.
+         But if last is True, don't draw outgoing edges, except
+         if has_end_state is also True, and then draw special outgoing
+         edges to a single end state.
+         If first is True, currently also skips drawing the edges,
+         but this may be a redundant option.
+         '''
+        y = self.first_state_y
+        x1 = self.next_state_x
+        x2 = x1 + self.states_dx
         if has_end_state:
+            Sprime = S[1:-1]
+        else:
+            Sprime = S
+        # Coordinates are saved now; the drawing itself may wait (see when_ready).
+        self.when_ready(self.layer_no, self.draw_time_step, S, Sprime, self.layer_no,
+                        x1, first, last, has_end_state)
+        if last and has_end_state:
+            self.cache_coords((self.layer_no+1, S[-1]), x2,
+                              int((self.first_state_y + self.last_state_y)/2))
+        for i in range(len(Sprime)):
+            self.cache_coords((self.layer_no, Sprime[i]), x1, y)# Save coordinates to
+            #  facilitate later displays of textual labels, etc.
+            y += self.states_dy
+        self.next_state_x += self.states_dx
+        self.x_values.append(self.next_state_x)
+        self.layer_no += 1
+
+    def draw_time_step(self, S, Sprime, layer_no, x1, first, last, has_end_state):
+        # Draws the column laid out by show_next_time_step.
+        y = self.first_state_y
+        x2 = x1 + self.states_dx
+        if not first and not last:
             y1 = y
-            y2 = int((FIRST_STATE_Y + LAST_STATE_Y)/2)
             for i in range(len(Sprime)):
-                show_edge(x1, y1, x2, y2, LAYER_NO, Sprime[i], S[-1])
-                y1 += STATES_DY
-            show_node(x2,y2, RAD, label=S[-1])
-            cache_coords((LAYER_NO+1, S[-1]), x2, y2)
-
-    for i in range(len(Sprime)):
-        show_node(x1, y, RAD, label=Sprime[i])
-        cache_coords((LAYER_NO, Sprime[i]), x1, y)# Save coordinates to
-        #  facilitate later displays of textual labels, etc.
-        y += STATES_DY
-    NEXT_STATE_X += STATES_DX
-    X_VALUES.append(NEXT_STATE_X)
-    LAYER_NO += 1
+                y2 = y
+                for j in range(len(Sprime)):
+                    if self.edge_shown(Sprime[i], Sprime[j]):
+                        self.show_edge(x1, y1, x2, y2, layer_no, Sprime[i], Sprime[j])
+                    y2 += self.states_dy
+                y1 += self.states_dy
+        if last:
+            if has_end_state:
+                y1 = y
+                y2 = int((self.first_state_y + self.last_state_y)/2)
+                for i in range(len(Sprime)):
+                    if self.edge_shown(Sprime[i], S[-1]):
+                        self.show_edge(x1, y1, x2, y2, layer_no, Sprime[i], S[-1])
+                    y1 += self.states_dy
+                self.show_node(x2,y2, RAD, label=S[-1], layer_no=layer_no)
+
+        for i in range(len(Sprime)):
+            self.show_node(x1, y, RAD, label=Sprime[i], layer_no=layer_no)
+            y += self.states_dy
+
+    def show_observation(self, layer_no, text):
+        # Add a textual label above a column of states.  Returns None if the
+        # column is not drawn yet; the label is then added when it is.
+        if not self.layer_ready(layer_no) or layer_no in self.pending:
+            return self.when_ready(layer_no, self.show_observation, layer_no, text)
+        x = self.x_values[layer_no]
+        y = Y_OBSERVATIONS
+        label = self.diagram.create_text(x, y, text=text)
+        return label # Returned in case an application needs a handle to
+           # delete or modify this canvas object later.
+
+    def show_label_at_node(self, layer_no, state_string, text, dx=0, dy=0, color='black'):
+        # Add a textual label at or near a node.
+        if not self.layer_ready(layer_no, reach=True) or layer_no in self.pending:
+            return self.when_ready(layer_no, self.show_label_at_node, layer_no,
+                                   state_string, text, dx, dy, color)
+        (x,y) = self.get_coords(layer_no, state_string)
+        label = self.diagram.create_text(x+dx, y+dy, text=text, fill=color)
+        return label # Returned in case an application needs a handle to
+           # delete or modify this canvas object later.
+
+    def show_label_at_edge(self, layer_no, tail_state_string, head_state_string, text, dx=0, dy=0, color='black'):
+        # Add a textual label at or near the midpoint of an edge.
+        if not self.layer_ready(layer_no, reach=True) or layer_no in self.pending:
+            return self.when_ready(layer_no, self.show_label_at_edge, layer_no,
+                                   tail_state_string, head_state_string, text,
+                                   dx, dy, color)
+        (x1,y1) = self.get_coords(layer_no, tail_state_string)
+        (x2,y2) = self.get_coords(layer_no+1, head_state_string)
+        xm = int((x1+x2)/2); ym = int((y1+y2)/2)
+        label = self.diagram.create_text(xm+dx, ym+dy, text=text, fill=color)
+        return label # Returned in case an application needs a handle to
+           # delete or modify this canvas object later.
+
+    def highlight_node(self, layer_no, state_string, highlight=True, color=None):
+        '''Thicken the outline of the node, except if highlight is False,
+         undo any highlighting.  color, if given, also recolors the outline.'''
+        if not self.layer_ready(layer_no, reach=True) or layer_no in self.pending:
+            return self.when_ready(layer_no, self.highlight_node, layer_no,
+                                   state_string, highlight, color)
+        node = self.node_items[(layer_no, state_string)]
+        if color is not None:
+            self.diagram.itemconfig(node, outline=color)
+        if highlight:
+            self.diagram.itemconfig(node, width=6)
+        else:
+            self.diagram.itemconfig(node, width=1)
+        return node # Returned just in case an application wants to do anything
+        # else with the canvas object, such as recolor it, etc.
+
+    def highlight_edge(self, layer_no, state_string1, state_string2, highlight=True, color=None):
+        '''Thicken the edge, except if highlight is False, undo any highlighting.
+        The edge is specified by its starting level number, the state it starts
+        at (state_string1, and the state it ends at (state_string2).
+        An edge left out by the edge filter is drawn now.  color, if given,
+        also recolors the edge.'''
+        if not self.layer_ready(layer_no, reach=True) or layer_no in self.pending:
+            return self.when_ready(layer_no, self.highlight_edge, layer_no,
+                                   state_string1, state_string2, highlight, color)
+        if (layer_no, state_string1, state_string2) not in self.edge_items:
+            (x1,y1) = self.get_coords(layer_no, state_string1)
+            (x2,y2) = self.get_coords(layer_no+1, state_string2)
+            self.show_edge(x1, y1, x2, y2, layer_no, state_string1, state_string2)
+        edge = self.edge_items[(layer_no, state_string1, state_string2)]
+        if color is not None:
+            self.diagram.itemconfig(edge, fill=color)
+        if highlight:
+            self.diagram.itemconfig(edge, width=4)
+        else:
+            self.diagram.itemconfig(edge, width=1)
+        return edge # Returned just in case an application wants to do anything
+        # else with the canvas object, such as recolor it, etc.
+
+    def save(self, filename):
+        '''Write a diagram drawn with backend='svg' to an .svg (or .png) file,
+        drawing first whatever is still waiting to be reached or scrolled into view.'''
+        self.reached = len(self.x_values)
+        self.viewport = None
+        self.flush_pending()
+        self.diagram.save(filename)
+
+
+_TK_ROOT = None # The one Tk instance, hidden; each Trellis has a Toplevel window.
+_WINDOWS = set() # The Trellis objects whose windows are open.
+_CURRENT = None # The Trellis that the module functions below act on.
+
+def tk_root():
+    '''Return the hidden Tk root window, creating it on first use.'''
+    global _TK_ROOT
+    if tk is None:
+        raise ImportError("tkinter is not available; use backend='svg'.")
+    if _TK_ROOT is None:
+        _TK_ROOT = tk.Tk()
+        _TK_ROOT.withdraw()
+    return _TK_ROOT
+
+def current():
+    '''Return the Trellis that the module functions act on.'''
+    return _CURRENT
+
+# The functions below keep the original interface of this module: each one
+# acts on the Trellis made by the last start_HMM_display (or
+# show_entire_trellis) call.
+
+def start_HMM_display(S, expected_N, width=5000, height=5000,
+                      has_initial_state=True, edge_filter=None, lazy=False,
+                      column_width=None, backend='tk'):
+    '''Start a new Trellis (see Trellis.start) and make it current.'''
+    global _CURRENT
+    _CURRENT = Trellis()
+    return _CURRENT.start(S, expected_N, width, height, has_initial_state,
+                          edge_filter, lazy, column_width, backend)
+
+def show_entire_trellis(S, observation_sequence, width=1800, height=1000, has_initial_state=False,
+                        edge_filter=None, lazy=False, column_width=None, backend='tk'):
+    '''Render a new Trellis (see Trellis.render), make it current and return it.'''
+    global _CURRENT
+    _CURRENT = Trellis()
+    return _CURRENT.render(S, observation_sequence, width, height,
+                           edge_filter=edge_filter, lazy=lazy,
+                           column_width=column_width, backend=backend)
+
+def show_next_time_step(S, first=False, last=False, has_end_state=False):
+    return _CURRENT.show_next_time_step(S, first, last, has_end_state)
 
 def show_observation(layer_no, text):
-    # Add a textual label above a column of states.
-    x = X_VALUES[layer_no]
-    y = Y_OBSERVATIONS
-    label = DIAGRAM.create_text(x, y, text=text)
-    return label # Returned in case an application needs a handle to
-       # delete or modify this canvas object later.
-
-def show_entire_trellis(S, observation_sequence, width=1800, height=1000, has_initial_state=False):
-    # Display all basic elements of a trellis diagram for a given HMM.
-    # This includes nodes, edges, node labels (with state names), and an observation sequence.
-    # The number of time steps shown depends on the observation sequence length.
-    n_expected = len(observation_sequence)
-    start_HMM_display(S, n_expected, width=width, height=height, has_initial_state=True)
-    for level in range(n_expected-1):
-        show_next_time_step(S, has_end_state=True)
-    show_next_time_step(S, last=True, has_end_state=True)
-    for i in range(1, n_expected+1):
-        show_observation(i, observation_sequence[i-1])
+    return _CURRENT.show_observation(layer_no, text)
 
 def show_label_at_node(layer_no, state_string, text, dx=0, dy=0, color='black'):
-    # Add a textual label at or near a node.
-    (x,y) = get_coords(layer_no, state_string)
-    label = DIAGRAM.create_text(x+dx, y+dy, text=text, fill=color)
-    return label # Returned in case an application needs a handle to
-       # delete or modify this canvas object later.
+    return _CURRENT.show_label_at_node(layer_no, state_string, text, dx, dy, color)
 
 def show_label_at_edge(layer_no, tail_state_string, head_state_string, text, dx=0, dy=0, color='black'):
-    # Add a textual label at or near the midpoint of an edge.
-    (x1,y1) = get_coords(layer_no, tail_state_string)
-    (x2,y2) = get_coords(layer_no+1, head_state_string)
-    xm = int((x1+x2)/2); ym = int((y1+y2)/2)
-    label = DIAGRAM.create_text(xm+dx, ym+dy, text=text, fill=color)
-    return label # Returned in case an application needs a handle to
-       # delete or modify this canvas object later.
+    return _CURRENT.show_label_at_edge(layer_no, tail_state_string, head_state_string,
+                                       text, dx, dy, color)
 
 def highlight_node(layer_no, state_string, highlight=True):
-    '''Thicken the outline of the node, except if highlight is False,
-     undo any highlighting.'''
-    node = NODE_ITEMS[(layer_no, state_string)]
-    if highlight:
-        DIAGRAM.itemconfig(node, width=6)
-    else:
-        DIAGRAM.itemconfig(node, width=1)
-    return node # Returned just in case an application wants to do anything
-    # else with the canvas object, such as recolor it, etc.
+    return _CURRENT.highlight_node(layer_no, state_string, highlight)
 
 def highlight_edge(layer_no, state_string1, state_string2, highlight=True):
-    '''Thicken the edge, except if highlight is False, undo any highlighting.
-    The edge is specified by its starting level number, the state it starts
-    at (state_string1, and the state it ends at (state_string2).'''
-    edge = EDGE_ITEMS[(layer_no, state_string1, state_string2)]
-    if highlight:
-        DIAGRAM.itemconfig(edge, width=4)
-    else:
-        DIAGRAM.itemconfig(edge, width=1)
-    return edge # Returned just in case an application wants to do anything
-    # else with the canvas object, such as recolor it, etc.
+    return _CURRENT.highlight_edge(layer_no, state_string1, state_string2, highlight)
+
+def save(filename):
+    _CURRENT.save(filename)
 
 def hold():
-    '''Block so the Tkinter display remains active'''
-    tk.mainloop()
+    '''Block so the Tkinter windows remain active, until they are all closed.'''
+    if _WINDOWS:
+        tk_root().mainloop()
 
 S = ['<S>','N','M','V','<E>'] # Toy example, for "unit" test here.
 if __name__=='__main__':
@@ -279,7 +624,11 @@ if __name__=='__main__':
     # example HMM at https://www.youtube.com/watch?v=mHEKZ8jv2SY
     # Some of the numbers here are meaningless, just showing the graphical
     # functionality and calling patterns.
-    start_HMM_display(S, 4, has_initial_state=True)
+    # With a file name argument, the diagram is written to that SVG file
+    # instead of being shown in a window.
+    import sys
+    backend = 'svg' if len(sys.argv) > 1 else 'tk'
+    start_HMM_display(S, 4, has_initial_state=True, backend=backend)
     show_next_time_step(S, has_end_state=True)
     show_label_at_edge(0, '<S>', 'N', '3/4', dx=-RAD/2, dy=-RAD, color='purple')
     show_observation(1,'Jane')
@@ -295,6 +644,8 @@ if __name__=='__main__':
     highlight_node(4, 'N')
     highlight_node(2, 'M', False)
     highlight_edge(0, '<S>', 'V')
+    if backend == 'svg':
+        save(sys.argv[1])
     hold()
     # Another possibility is to call this method:
     # show_entire_trellis(S, ['Jane','will','spot','Will'],800,500,True)
@@ -0,0 +1,300 @@
+"""model_registry.py
+
+Versioned, immutable model snapshots for long-running taggers.
+
+HMM.load_parameters replaces S, O, P_trans and P_emission one after the
+other on a live object, so a decoder running in another thread while a
+model is reloaded can see a mix of the old and the new parameters.  A
+ModelRegistry never does that.  Each model file is loaded into a new HMM,
+compiled, and its arrays made read-only; the result is a Snapshot, named
+by its version, the hash of its parameters (HMM.model_version).  Making a
+snapshot the active one is a single assignment, so a tagger that reads
+registry.active once per request or batch always decodes with one
+complete model, and requests already running finish with the model they
+started with.  The registry keeps up to keep snapshots loaded (besides the
+active and shadow ones), so rolling back is instant as well.
+
+Only the compiled arrays are read-only: the HMM of a snapshot is still an
+ordinary HMM object, whose dicts, load_parameters and set_oov_model would
+change it in place.  Code that gets a model from the registry must only
+decode with it.
+
+A loaded snapshot can first run in shadow: shadow_batch decodes a random
+sample of the traffic with it as well, and counts how many tokens and
+whole tweets get the same tags as with the active model, and how long
+each took.  promote_shadow makes it active if the agreement is high
+enough.
+
+tagging_server.py uses a registry with --watch to reload a model file
+when it changes, without dropping requests.
+
+Usage:
+    python model_registry.py active.json candidate.json [data.json]
+                             [--sample F] [--min-agreement F]
+"""
+
+import collections
+import os
+import random
+import threading
+import time
+
+import hmm
+
+DEFAULT_KEEP = 3
+DEFAULT_SAMPLE = 0.1
+
+Snapshot = collections.namedtuple(
+    'Snapshot', ('version', 'model', 'filename', 'loaded'))
+Snapshot.__doc__ = """ an HMM that the registry never modifies after it is
+    loaded, with its version, the file it came from and the time it was
+    loaded.  The HMM object is not frozen; callers must not modify it. """
+
+
+class ShadowStats:
+    """ agreement between a shadow model and the active one """
+
+    def __init__(self, active, shadow):
+        self.active = active
+        self.shadow = shadow
+        self.tweets = 0
+        self.same_tweets = 0
+        self.tokens = 0
+        self.same_tokens = 0
+        self.active_seconds = 0.0
+        self.shadow_seconds = 0.0
+
+    def add(self, active_tags, shadow_tags, active_seconds, shadow_seconds):
+        """ count one batch of sampled tweets """
+        for a, b in zip(active_tags, shadow_tags):
+            same = sum(x == y for x, y in zip(a, b))
+            self.tweets += 1
+            self.same_tweets += same == len(a)
+            self.tokens += len(a)
+            self.same_tokens += same
+        self.active_seconds += active_seconds
+        self.shadow_seconds += shadow_seconds
+
+    def agreement(self):
+        """ the fraction of sampled tokens tagged the same, or None """
+        return self.same_tokens / self.tokens if self.tokens else None
+
+    def as_dict(self):
+        return {'active': self.active, 'shadow': self.shadow,
+                'tweets': self.tweets, 'same_tweets': self.same_tweets,
+                'tokens': self.tokens, 'same_tokens': self.same_tokens,
+                'agreement': self.agreement(),
+                'active_seconds': self.active_seconds,
+                'shadow_seconds': self.shadow_seconds}
+
+
+class ModelRegistry:
+    """ loaded model snapshots, one of them active and one in shadow """
+
+    def __init__(self, keep=DEFAULT_KEEP, backend='numpy', oov_model=None,
+                 seed=None):
+        """ keep is the number of inactive snapshots kept loaded.  Every
+            snapshot uses the given backend and oov_model.OOVModel. """
+        self.keep = keep
+        self.backend = backend
+        self.oov_model = oov_model
+        self.snapshots = collections.OrderedDict()
+        self.active = None
+        self.previous = None
+        self.shadow = None
+        self.shadow_sample = 0.0
+        self.shadow_stats = None
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def load(self, filename):
+        """ load a model file into a new snapshot, or return the loaded one
+            with the same parameters; the active model is not changed """
+        model = hmm.HMM(filename, backend=self.backend)
+        if self.oov_model is not None:
+            model.set_oov_model(self.oov_model)
+        compiled = model.compile()
+        for array in compiled.arrays():
+            array.flags.writeable = False
+        version = model.model_version()[:12]
+        with self.lock:
+            if version in self.snapshots:
+                return self.snapshots[version]
+            snapshot = Snapshot(version, model, filename, time.time())
+            self.snapshots[version] = snapshot
+            self._evict()
+        return snapshot
+
+    def _evict(self):
+        """ drop the oldest snapshots beyond keep, except the active and
+            shadow ones """
+        pinned = {s.version for s in (self.active, self.shadow)
+                  if s is not None}
+        inactive = [v for v in self.snapshots if v not in pinned]
+        for version in inactive[:max(len(inactive) - self.keep, 0)]:
+            del self.snapshots[version]
+            if self.previous is not None and \
+                    self.previous.version == version:
+                self.previous = None
+
+    def get(self, version=None):
+        """ the snapshot of a version, or the active one """
+        if version is None:
+            return self.active
+        return self.snapshots[version]
+
+    def promote(self, version):
+        """ make a loaded version the active one; return its snapshot """
+        with self.lock:
+            snapshot = self.snapshots[version]
+            if self.active is not None and self.active is not snapshot:
+                self.previous = self.active
+            self.active = snapshot
+            if self.shadow is snapshot:
+                self.shadow = None
+            self._evict()
+        for listener in self.listeners:
+            listener(snapshot)
+        return snapshot
+
+    def rollback(self):
+        """ make the previously active version active again """
+        if self.previous is None:
+            raise KeyError('no previous version is loaded')
+        return self.promote(self.previous.version)
+
+    def start_shadow(self, version, sample=DEFAULT_SAMPLE):
+        """ decode a fraction sample of the traffic with version as well,
+            and count its agreement with the active model """
+        with self.lock:
+            self.shadow = self.snapshots[version]
+            self.shadow_sample = sample
+            self.shadow_stats = ShadowStats(
+                self.active.version if self.active else None, version)
+
+    def stop_shadow(self):
+        """ stop shadow decoding; return the final ShadowStats """
+        with self.lock:
+            stats = self.shadow_stats
+            self.shadow = None
+            self.shadow_stats = None
+            self._evict()
+        return stats
+
+    def promote_shadow(self, min_agreement=0.0, min_tokens=1):
+        """ make the shadow version active if at least min_tokens tokens
+            were compared and at least a fraction min_agreement of them
+            agreed; return whether it was promoted.  A shadow that has not
+            been compared on any token is never promoted. """
+        stats = self.shadow_stats
+        if self.shadow is None or stats is None or \
+                stats.tokens < min_tokens:
+            return False
+        agreement = stats.agreement()
+        if agreement is None or agreement < min_agreement:
+            return False
+        self.promote(self.shadow.version)
+        self.shadow_stats = None
+        return True
+
+    def viterbi_batch(self, obs_sequences):
+        """ tag sequences with the active model, shadowing a sample """
+        snapshot = self.active
+        start = time.perf_counter()
+        tags = snapshot.model.viterbi_batch(obs_sequences)
+        self.shadow_batch(obs_sequences, tags,
+                          time.perf_counter() - start, snapshot)
+        return tags
+
+    def shadow_batch(self, obs_sequences, tags, seconds, snapshot):
+        """ decode a sample of sequences, which snapshot tagged as tags in
+            seconds, with the shadow model too, and count the agreement """
+        shadow = self.shadow
+        stats = self.shadow_stats
+        if shadow is None or stats is None or snapshot is shadow:
+            return
+        sample = [i for i in range(len(obs_sequences))
+                  if self.random.random() < self.shadow_sample]
+        if not sample:
+            return
+        start = time.perf_counter()
+        shadow_tags = shadow.model.viterbi_batch(
+            [obs_sequences[i] for i in sample])
+        shadow_seconds = time.perf_counter() - start
+        with self.lock:
+            stats.add([tags[i] for i in sample], shadow_tags,
+                      seconds * len(sample) / len(obs_sequences),
+                      shadow_seconds)
+
+    def stats(self):
+        """ the active, previous and loaded versions, and the shadow
+            statistics """
+        return {'active': self.active.version if self.active else None,
+                'previous': self.previous.version if self.previous else None,
+                'loaded': [{'version': s.version, 'filename': s.filename,
+                            'loaded': s.loaded}
+                           for s in self.snapshots.values()],
+                'shadow': self.shadow_stats.as_dict()
+                if self.shadow_stats else None}
+
+
+class FileWatcher:
+    """ notices when a model file has been replaced or rewritten """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.signature = self._signature()
+
+    def _signature(self):
+        try:
+            status = os.stat(self.filename)
+        except OSError:
+            return None
+        return status.st_mtime_ns, status.st_size, status.st_ino
+
+    def changed(self):
+        """ whether the file changed since the last call (or creation) """
+        signature = self._signature()
+        if signature is None or signature == self.signature:
+            return False
+        self.signature = signature
+        return True
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(
+        description='Shadow-decode a tweet file with a candidate model and '
+                    'report its agreement with the active one.')
+    parser.add_argument('active')
+    parser.add_argument('candidate')
+    parser.add_argument('data', nargs='?', default='twt.test.json')
+    parser.add_argument('--sample', type=float, default=DEFAULT_SAMPLE,
+                        help='fraction of tweets decoded by the candidate')
+    parser.add_argument('--min-agreement', type=float, default=0.95,
+                        help='token agreement needed to promote')
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+    registry = ModelRegistry(seed=0)
+    registry.promote(registry.load(args.active).version)
+    candidate = registry.load(args.candidate)
+    registry.start_shadow(candidate.version, args.sample)
+    with open(args.data, 'r') as f:
+        seqs = [[item[0] for item in json.loads(line)] for line in f]
+    for i in range(0, len(seqs), args.batch_size):
+        registry.viterbi_batch(seqs[i:i + args.batch_size])
+    stats = registry.shadow_stats
+    print("active %s, candidate %s" % (stats.active, stats.shadow))
+    print("sampled %d tweets, %d tokens" % (stats.tweets, stats.tokens))
+    print("token agreement: %.2f%%, identical tweets: %.2f%%"
+          % (100 * (stats.agreement() or 0),
+             100 * stats.same_tweets / max(stats.tweets, 1)))
+    print("time on the sample: active %.3f s, candidate %.3f s"
+          % (stats.active_seconds, stats.shadow_seconds))
+    if registry.promote_shadow(args.min_agreement):
+        print("candidate promoted")
+    else:
+        print("candidate not promoted (needs %.2f%% agreement)"
+              % (100 * args.min_agreement))
@@ -0,0 +1,152 @@
+"""online_viterbi.py
+
+Incremental (streaming) decoding with an HMM, for tagging tokens as they
+arrive instead of waiting for the end of a tweet.
+
+An OnlineViterbi decoder takes one token at a time.  Each push updates the
+forward belief vector and the Viterbi scores with one O(|S|^2) step on the
+array form of the model (see hmm_numpy), and returns the tags that have
+become certain.  A tag is committed as soon as the back-pointer paths of
+every state at the newest position pass through the same state there: the
+best complete path has to be one of those paths, so later tokens cannot
+change it.  Only the back pointers of the uncommitted positions are kept.
+
+The optional lag bounds how many positions may stay uncommitted.  When it
+is exceeded, the oldest positions are committed along the currently best
+path.  Without a lag the tags returned by push and finish, taken together,
+are exactly those of HMM.log_viterbi_algorithm; with a lag they can differ
+where a forced decision turned out to be wrong.
+
+Scores are sums of log probabilities by default, since a stream can be
+much longer than a tweet.  With log_space unset they are products of
+probabilities, as in HMM.viterbi_algorithm, whose tags they then match;
+those underflow after a few hundred tokens, so that mode is only usable
+for tweet-length inputs.
+"""
+
+import collections
+
+import numpy as np
+
+import hmm_numpy
+
+
+class OnlineViterbi:
+    """ incremental Viterbi decoder and Forward filter for one HMM """
+
+    def __init__(self, model, lag=None, log_space=True):
+        """ model is an HMM.  lag is the largest number of positions that
+            may stay uncommitted, or None for no limit.  log_space selects
+            sums of log probabilities; unset, products are used, which
+            underflow on inputs much longer than a tweet. """
+        if lag is not None and lag < 1:
+            raise ValueError("lag must be at least 1, got %r" % (lag,))
+        self.model = model.compile()
+        self.lag = lag
+        self.log_space = log_space
+        self.reset()
+
+    def reset(self):
+        """ forget the current sequence and start a new one """
+        self.scores = None
+        self.belief = None
+        self.log_likelihood = 0.0
+        self.n_seen = 0
+        self.n_committed = 0
+        self._back_ptrs = collections.deque()
+
+    def push(self, obs):
+        """ process the next token; return the list of newly committed
+            tags, for the positions following those committed before """
+        model = self.model
+        e = model.emissions([obs])[0]
+        self._update_belief(e)
+        if self.log_space:
+            log_start, log_trans = model.log_params()
+            log_e = hmm_numpy.safe_log(e)
+            if self.scores is None:
+                self.scores = log_start + log_e
+            else:
+                self._step(self.scores[:, None] + log_trans + log_e)
+        else:
+            if self.scores is None:
+                self.scores = model.start * e
+            else:
+                self._step(self.scores[:, None] * model.trans * e)
+        self.n_seen += 1
+        committed = self._commit_converged()
+        if self.lag is not None and self.n_seen - self.n_committed > self.lag:
+            committed += self._commit_best(self.n_seen - self.lag)
+        return committed
+
+    def finish(self):
+        """ end the sequence: return the tags of every position not yet
+            committed, and reset the decoder for the next sequence """
+        tags = []
+        if self.n_seen > 0:
+            tags = self._commit_best(self.n_seen)
+        self.reset()
+        return tags
+
+    def decode(self, obs_sequence):
+        """ push every token of a sequence and finish it; return all tags """
+        tags = []
+        for obs in obs_sequence:
+            tags += self.push(obs)
+        return tags + self.finish()
+
+    def _update_belief(self, e):
+        if self.belief is None:
+            dist = self.model.start * e
+        else:
+            dist = np.einsum('k,ks->s', self.belief, self.model.trans) * e
+        total = dist.sum()
+        if total > 0:
+            dist /= total
+        self.log_likelihood += hmm_numpy.safe_log(total)
+        self.belief = dist
+
+    def _step(self, scores):
+        best = scores.argmax(axis=0)
+        self._back_ptrs.append(best)
+        self.scores = scores[best, np.arange(len(best))]
+
+    def _commit_converged(self):
+        """ commit the positions through the newest one at which the paths
+            from all current states agree """
+        current = np.arange(len(self.model.states))
+        position = self.n_seen - 1
+        for back_ptrs in reversed(self._back_ptrs):
+            if (current == current[0]).all():
+                break
+            current = back_ptrs[current]
+            position -= 1
+        if not (current == current[0]).all():
+            return []
+        return self._commit(position, int(current[0]))
+
+    def _commit_best(self, end):
+        """ commit positions before end along the currently best path """
+        state = int(self.scores.argmax())
+        position = self.n_seen - 1
+        back_ptrs = self._back_ptrs
+        while position >= end:
+            state = int(back_ptrs[position - self.n_committed - 1][state])
+            position -= 1
+        return self._commit(position, state)
+
+    def _commit(self, position, state):
+        """ commit every position up to and including position, where the
+            path is in the given state, and drop their back pointers """
+        path = [state]
+        back_ptrs = self._back_ptrs
+        for t in range(position, self.n_committed, -1):
+            state = int(back_ptrs[t - self.n_committed - 1][state])
+            path.append(state)
+        path.reverse()
+        for t in range(position + 1 - self.n_committed):
+            if back_ptrs:
+                back_ptrs.popleft()
+        self.n_committed = position + 1
+        states = self.model.states
+        return [states[i] for i in path]
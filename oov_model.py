@@ -0,0 +1,213 @@
+"""oov_model.py
+
+Emission probabilities for words that are not in the vocabulary of an HMM.
+
+Without this, every state emits an unknown word with probability 0, so a
+single new URL, @handle, hashtag or emoji in a tweet makes every path
+impossible.  An OOVModel instead scores an unknown word from a few
+features of its spelling:
+
+class -- a regular-expression class: 'url', 'mention' (@handle), 'hashtag',
+   'number', 'emoticon', 'emoji', 'punct', or 'word' for anything else.
+shape -- the word with upper-case letters mapped to X, lower-case ones to
+   x and digits to d, and runs of the same symbol collapsed: 'iPhone4'
+   becomes 'xXxd'.
+prefix, suffix -- the first and last PREFIX_LENGTH / SUFFIX_LENGTH
+   characters, lower-cased.
+
+It is trained on the rare words (hapax legomena by default) of a tagged
+corpus, which behave most like words never seen at all.  For a state s,
+
+    P(w | s) = P(unknown | s) * P(class | s) * P(shape | s)
+                              * P(prefix | s) * P(suffix | s)
+
+where P(unknown | s) is the fraction of the tokens of s that were rare
+words and each feature distribution is estimated from the rare words of s
+with add-alpha smoothing.  The features are treated as independent given
+the state, as in naive Bayes.
+
+The emission vector of every unknown word is kept in an LRU cache, so a
+token that is seen again, like a URL repeated through a stream, is scored
+only once.  HMM.set_oov_model attaches a model to an HMM; both backends
+then use it for every word outside O.
+
+Usage:
+    python oov_model.py oov.json corpus.json ... [--max-count N]
+                        [--alpha A]
+"""
+
+import functools
+import hashlib
+import json
+import re
+import unicodedata
+
+import hmm_trainer
+
+FEATURES = ('class', 'shape', 'prefix', 'suffix')
+PREFIX_LENGTH = 2
+SUFFIX_LENGTH = 3
+DEFAULT_ALPHA = 0.5
+DEFAULT_CACHE_SIZE = 4096
+
+WORD_CLASSES = (
+    ('url', re.compile(r'^(https?://|www\.)\S+$', re.IGNORECASE)),
+    ('mention', re.compile(r'^@\w+$')),
+    ('hashtag', re.compile(r'^#\w+$')),
+    ('number', re.compile(r'^[+\-$]?\d[\d.,:/\-]*(%|k|st|nd|rd|th|s|am|pm)?$',
+                          re.IGNORECASE)),
+    ('emoticon', re.compile(r'^([:;=8xX][\-o\'^]?[()\[\]dDpPoO/\\|*3$@]+'
+                            r'|[()\[\]dD/\\|][\-o\'^]?[:;=8]|<3+|\^_*\^)$')),
+)
+PUNCTUATION = re.compile(r'^[^\w\s]+$')
+
+
+def word_class(word):
+    """ the regular-expression class of a word """
+    for name, pattern in WORD_CLASSES:
+        if pattern.match(word):
+            return name
+    if word and all(unicodedata.category(ch) in ('So', 'Sk', 'Mn', 'Cf')
+                    for ch in word):
+        return 'emoji'
+    if PUNCTUATION.match(word):
+        return 'punct'
+    return 'word'
+
+
+def word_shape(word):
+    """ the shape of a word: X for upper case, x for lower case, d for
+        digits, other characters kept, runs collapsed to one symbol """
+    shape = []
+    for ch in word:
+        if ch.isupper():
+            symbol = 'X'
+        elif ch.islower():
+            symbol = 'x'
+        elif ch.isdigit():
+            symbol = 'd'
+        else:
+            symbol = ch
+        if not shape or shape[-1] != symbol:
+            shape.append(symbol)
+    return ''.join(shape)
+
+
+def features(word):
+    """ the (class, shape, prefix, suffix) features of a word """
+    lower = word.lower()
+    return (word_class(word), word_shape(word), lower[:PREFIX_LENGTH],
+            lower[-SUFFIX_LENGTH:])
+
+
+class OOVModel:
+    """ emission probabilities of unknown words, from spelling features """
+
+    def __init__(self, states, alpha=DEFAULT_ALPHA,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        """ states lists the real states, without <S> and <E>.  alpha is
+            the add-alpha constant of the feature distributions, and
+            cache_size the number of words whose emission vectors are
+            kept. """
+        self.states = list(states)
+        self.alpha = alpha
+        self.tokens = {s: 0 for s in self.states}
+        self.rare = {s: 0 for s in self.states}
+        self.counts = {f: {s: {} for s in self.states} for f in FEATURES}
+        self.values = {f: set() for f in FEATURES}
+        self.emission_vector = functools.lru_cache(maxsize=cache_size)(
+            self._emission_vector)
+
+    def add(self, word, s, count=1):
+        """ count count occurrences of the rare word word with state s """
+        for f, value in zip(FEATURES, features(word)):
+            table = self.counts[f][s]
+            table[value] = table.get(value, 0) + count
+            self.values[f].add(value)
+        self.rare[s] += count
+        self.emission_vector.cache_clear()
+
+    def fit(self, trainer, max_count=1):
+        """ count the words of an hmm_trainer.HMMTrainer seen at most
+            max_count times in all, as rare words """
+        frequency = {}
+        for s in self.states:
+            for word, c in trainer.emissions[s].items():
+                frequency[word] = frequency.get(word, 0) + c
+        for s in self.states:
+            for word, c in trainer.emissions[s].items():
+                self.tokens[s] += c
+                if 0 < frequency[word] <= max_count:
+                    self.add(word, s, c)
+        return self
+
+    def _emission_vector(self, word):
+        alpha = self.alpha
+        values = features(word)
+        vector = []
+        for s in self.states:
+            rare = self.rare[s]
+            p = (rare + alpha) / (self.tokens[s] + alpha)
+            for f, value in zip(FEATURES, values):
+                p *= (self.counts[f][s].get(value, 0) + alpha) / \
+                     (rare + alpha * (len(self.values[f]) + 1))
+            vector.append(p)
+        return tuple(vector)
+
+    def emission_probs(self, word):
+        """ return {s: P(word | s)} for an unknown word """
+        return dict(zip(self.states, self.emission_vector(word)))
+
+    def cache_info(self):
+        """ hits, misses, maxsize and currsize of the emission cache """
+        return self.emission_vector.cache_info()
+
+    def parameters(self):
+        """ the states, alpha and counts, as a dict that can be written
+            as JSON """
+        return {'states': self.states, 'alpha': self.alpha,
+                'tokens': self.tokens, 'rare': self.rare,
+                'counts': self.counts}
+
+    def digest(self):
+        """ a hash of the parameters """
+        return hashlib.sha1(json.dumps(
+            self.parameters(), sort_keys=True).encode('utf-8')).hexdigest()
+
+    def save(self, filename):
+        """ write the counts to a JSON file """
+        with open(filename, 'w') as f:
+            json.dump(self.parameters(), f)
+
+    @classmethod
+    def load(cls, filename, cache_size=DEFAULT_CACHE_SIZE):
+        """ read a model written by save """
+        with open(filename, 'r') as f:
+            saved = json.load(f)
+        model = cls(saved['states'], saved['alpha'], cache_size)
+        model.tokens = saved['tokens']
+        model.rare = saved['rare']
+        model.counts = saved['counts']
+        for f in FEATURES:
+            for table in model.counts[f].values():
+                model.values[f].update(table)
+        return model
+
+
+def train(filenames, max_count=1, alpha=DEFAULT_ALPHA, S=hmm_trainer.TWITTER_S):
+    """ fit an OOVModel on JSONL files of tagged tweets """
+    trainer = hmm_trainer.train(filenames, S=S)
+    return OOVModel(trainer.states(), alpha).fit(trainer, max_count)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Fit an unknown-word emission model on tagged tweets.')
+    parser.add_argument('output', help='JSON file to write')
+    parser.add_argument('corpus', nargs='+', help='JSONL training files')
+    parser.add_argument('--max-count', type=int, default=1,
+                        help='words seen at most this often count as rare')
+    parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA)
+    args = parser.parse_args()
+    train(args.corpus, args.max_count, args.alpha).save(args.output)
@@ -0,0 +1,236 @@
+"""parallel_tagger.py
+
+Tags a JSONL corpus of tweets, such as twt.test.json, with a pool of worker
+processes.
+
+The model is loaded and compiled once, in the parent process, and its
+arrays (see hmm_numpy) are copied into a single block of shared memory.
+Workers attach to that block instead of each loading or unpickling the
+model.  The parent also keeps the vocabulary: it turns every tweet into an
+array of word ids, so that the workers only ever see small integer arrays,
+and they send back state indices.  If the model has an OOV model (see
+oov_model.py), the parent also scores the out-of-vocabulary words of each
+tweet with it and sends their emission columns along with the ids.
+Chunks of tweets are decoded with the batched Viterbi algorithm, and the
+results are yielded in input order, so the tags and accuracy counts are
+the same as those of a serial run.
+
+Usage:
+    python parallel_tagger.py [model.json] [corpus.json] [--workers N]
+                              [--chunk-size N] [--output tagged.json]
+                              [--oov oov.json]
+"""
+
+import argparse
+import collections
+import json
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import hmm
+import hmm_numpy
+
+ARRAYS = ('start', 'trans', 'end', 'emission')
+DEFAULT_CHUNK_SIZE = 256
+
+_worker_model = None
+_worker_shm = None
+
+
+class SharedModel:
+    """ the arrays of a CompiledHMM, copied once into shared memory """
+
+    def __init__(self, compiled):
+        size = sum(getattr(compiled, name).nbytes for name in ARRAYS)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.layout = []
+        offset = 0
+        for name in ARRAYS:
+            array = getattr(compiled, name)
+            view = np.ndarray(array.shape, dtype=array.dtype,
+                              buffer=self.shm.buf, offset=offset)
+            view[...] = array
+            self.layout.append((name, array.shape, array.dtype.str, offset))
+            offset += array.nbytes
+        self.states = compiled.states
+
+    def update(self, compiled):
+        """ copy the arrays of another CompiledHMM, of the same shapes,
+            over those in shared memory; workers attached to it see the
+            new values """
+        for name, shape, dtype, offset in self.layout:
+            array = getattr(compiled, name)
+            if array.shape != shape:
+                raise ValueError("Cannot update a shared %s of shape %s "
+                                 "with one of shape %s"
+                                 % (name, shape, array.shape))
+            view = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf,
+                              offset=offset)
+            view[...] = array
+        self.states = compiled.states
+
+    def handle(self):
+        """ the picklable description that workers pass to attach """
+        return self.shm.name, self.layout, self.states
+
+    def close(self):
+        """ release the shared memory block """
+        self.shm.close()
+        self.shm.unlink()
+
+
+def attach(handle):
+    """ map a SharedModel into this process; return (shm, CompiledHMM).
+        The model has no vocabulary: it decodes word ids, not words. """
+    name, layout, states = handle
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {}
+    for array_name, shape, dtype, offset in layout:
+        arrays[array_name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                                        offset=offset)
+    model = hmm_numpy.CompiledHMM(states, [], arrays['start'],
+                                  arrays['trans'], arrays['end'],
+                                  arrays['emission'], word_ids={})
+    return shm, model
+
+
+def _init_worker(handle):
+    global _worker_model, _worker_shm
+    _worker_shm, _worker_model = attach(handle)
+
+
+def _tag_chunk(id_sequences, oov_columns=None):
+    """ worker task: decode a chunk of word-id arrays.  oov_columns, if
+        any, has for each sequence None or the positions of its unknown
+        words and their (n, |S|) emission columns. """
+    model = _worker_model
+    lengths = np.array([len(ids) for ids in id_sequences], dtype=np.intp)
+    padded = np.full((len(id_sequences), lengths.max(initial=0)),
+                     model.oov_id, dtype=np.intp)
+    for b, ids in enumerate(id_sequences):
+        padded[b, :len(ids)] = ids
+    emissions = model.emission_columns(padded)
+    for b, item in enumerate(oov_columns or ()):
+        if item is not None:
+            positions, columns = item
+            emissions[b, positions] = columns
+    return hmm_numpy.viterbi_batch(model, emissions, lengths)
+
+
+def oov_columns(compiled, words, ids):
+    """ the positions of the unknown words of a sequence and their emission
+        columns under the OOV model of compiled, or None if there are none
+        or it has no OOV model """
+    if compiled.oov_model is None:
+        return None
+    positions = np.flatnonzero(ids == compiled.oov_id)
+    if not len(positions):
+        return None
+    return positions, np.array([compiled.oov_model.emission_vector(words[i])
+                                for i in positions])
+
+
+def read_chunks(filename, chunk_size):
+    """ yield lists of up to chunk_size tweets from a JSONL file """
+    chunk = []
+    with open(filename, 'r') as f:
+        for line in f:
+            chunk.append(json.loads(line))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def tokens_of(tweet):
+    """ the words of a tweet given as [word, tag] pairs or as plain words """
+    return [item[0] if isinstance(item, list) else item for item in tweet]
+
+
+def tag_corpus(model, filename, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ yield (tweet, tags) for every tweet in a JSONL file, in input order.
+        model is an HMM.  At most two chunks per worker are in flight at a
+        time, so memory use does not grow with the size of the corpus. """
+    compiled = model.compile()
+    shared = SharedModel(compiled)
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(shared.handle(),))
+    max_pending = 2 * (workers or multiprocessing.cpu_count())
+    pending = collections.deque()
+    states = compiled.states
+    try:
+        for chunk in read_chunks(filename, chunk_size):
+            words = [tokens_of(tweet) for tweet in chunk]
+            ids = [compiled.encode(tokens) for tokens in words]
+            oov = [oov_columns(compiled, tokens, i)
+                   for tokens, i in zip(words, ids)]
+            if not any(item is not None for item in oov):
+                oov = None
+            pending.append((chunk, pool.apply_async(_tag_chunk,
+                                                    (ids, oov))))
+            if len(pending) >= max_pending:
+                yield from _finish(pending.popleft(), states)
+        while pending:
+            yield from _finish(pending.popleft(), states)
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+        shared.close()
+
+
+def _finish(item, states):
+    chunk, result = item
+    for tweet, path in zip(chunk, result.get()):
+        yield tweet, [states[i] for i in path]
+
+
+def evaluate(model, filename, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+             output=None):
+    """ tag a corpus of tagged tweets; return (correct, total).  If output
+        is a file object, each tweet's [word, tag] list is written to it. """
+    correct = 0
+    total = 0
+    for tweet, tags in tag_corpus(model, filename, workers, chunk_size):
+        total += len(tweet)
+        for item, tag in zip(tweet, tags):
+            if isinstance(item, list) and item[1] == tag:
+                correct += 1
+        if output is not None:
+            output.write(json.dumps([[word, tag] for word, tag
+                                     in zip(tokens_of(tweet), tags)]) + '\n')
+    return correct, total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('model', nargs='?',
+                        default='twitter_pos_hmm_laplace.json')
+    parser.add_argument('corpus', nargs='?', default='twt.test.json')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help='tweets per task sent to a worker')
+    parser.add_argument('--output', default=None,
+                        help='write the tagged tweets to this JSONL file')
+    parser.add_argument('--oov', default=None,
+                        help='oov_model.py file for unknown words')
+    args = parser.parse_args()
+    model = hmm.HMM(args.model)
+    if args.oov is not None:
+        import oov_model
+        model.set_oov_model(oov_model.OOVModel.load(args.oov))
+    if args.output is not None:
+        with open(args.output, 'w') as out:
+            correct, total = evaluate(model, args.corpus, args.workers,
+                                      args.chunk_size, out)
+    else:
+        correct, total = evaluate(model, args.corpus, args.workers,
+                                  args.chunk_size)
+    print("Total count of correctly-tagged words in the test set: "
+          + str(correct))
+    print("Total count of words in the test set: " + str(total))
+    print("Test set accuracy: " + str(correct / total * 100))
@@ -0,0 +1,137 @@
+"""render_mistagged.py
+
+Draws a diagnostic trellis for every mis-tagged tweet of a JSONL file of
+tagged tweets, such as twt.dev.json, as one SVG file per tweet.
+
+The parent process tags all the tweets with the batched Viterbi algorithm
+and keeps those with at least one wrong tag.  They are drawn by a pool of
+worker processes, each of which loads the model once and draws every tweet
+on its own hmm_vis.Trellis with the SVG backend, so no display is needed.
+Each trellis shows only the top_k most probable edges out of each state,
+the Viterbi path in red, with the Forward belief of each of its states, and
+at every wrong position the correct tag in green.  An index.json file in
+the output directory lists the files with their tweets and error counts.
+
+Usage:
+    python render_mistagged.py [model.json] [corpus.json] [--output-dir DIR]
+                               [--limit N] [--workers N] [--top-k K]
+                               [--oov oov.json]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+
+import hmm
+import hmm_vis
+
+DEFAULT_TOP_K = 3
+COLUMN_WIDTH = 90
+
+_worker_model = None
+_worker_edges = None
+
+
+def _init_worker(model_file, top_k, oov_file):
+    global _worker_model, _worker_edges
+    _worker_model = load_model(model_file, oov_file)
+    _worker_edges = hmm_vis.select_edges(_worker_model.P_trans, top_k)
+
+
+def load_model(model_file, oov_file=None):
+    """ the numpy-backed HMM of a model file, with an OOV model if given """
+    model = hmm.HMM(model_file, backend='numpy')
+    if oov_file is not None:
+        import oov_model
+        model.set_oov_model(oov_model.OOVModel.load(oov_file))
+    return model
+
+
+def render(model, edge_filter, tokens, gold, predicted, filename):
+    """ draw one tweet's trellis to filename """
+    trellis = hmm_vis.Trellis().render(model.S, tokens, height=1000,
+                                       edge_filter=edge_filter,
+                                       column_width=COLUMN_WIDTH,
+                                       backend='svg')
+    states = model.compile().states
+    beliefs = model.forward_algorithm(tokens)
+    previous = '<S>'
+    for t, (tag, correct) in enumerate(zip(predicted, gold)):
+        trellis.highlight_node(t + 1, tag, color='red')
+        trellis.highlight_edge(t, previous, tag, color='red')
+        trellis.show_label_at_node(t + 1, tag, '%.2f'
+                                   % beliefs[t][states.index(tag)], dy=20)
+        if tag != correct and correct in states:
+            trellis.highlight_node(t + 1, correct, color='green')
+        previous = tag
+    trellis.highlight_edge(len(tokens), previous, '<E>', color='red')
+    trellis.save(filename)
+    trellis.dispose()
+
+
+def _render_task(task):
+    """ worker task: draw one tweet; return its index entry """
+    index, tokens, gold, predicted, filename = task
+    render(_worker_model, _worker_edges, tokens, gold, predicted, filename)
+    return {'tweet': index, 'file': os.path.basename(filename),
+            'tokens': len(tokens),
+            'errors': sum(a != b for a, b in zip(predicted, gold))}
+
+
+def mistagged(model, filename, limit=None):
+    """ the (index, tokens, gold tags, predicted tags) of the first limit
+        mis-tagged tweets of a JSONL file """
+    tweets = []
+    with open(filename, 'r') as f:
+        for line in f:
+            twt = json.loads(line)
+            tweets.append(([item[0] for item in twt], [item[1] for item in twt]))
+    predicted = model.viterbi_batch([tokens for tokens, gold in tweets])
+    found = []
+    for index, ((tokens, gold), tags) in enumerate(zip(tweets, predicted)):
+        if tags != gold:
+            found.append((index, tokens, gold, tags))
+            if limit is not None and len(found) >= limit:
+                break
+    return found
+
+
+def render_all(model_file, corpus, output_dir, limit=None, workers=None,
+               top_k=DEFAULT_TOP_K, oov_file=None):
+    """ draw the mis-tagged tweets of corpus into output_dir; return the
+        index entries """
+    os.makedirs(output_dir, exist_ok=True)
+    model = load_model(model_file, oov_file)
+    tasks = [(index, tokens, gold, tags,
+              os.path.join(output_dir, 'tweet_%05d.svg' % index))
+             for index, tokens, gold, tags in mistagged(model, corpus, limit)]
+    with multiprocessing.Pool(workers, initializer=_init_worker,
+                              initargs=(model_file, top_k, oov_file)) as pool:
+        entries = pool.map(_render_task, tasks, chunksize=4)
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+    return entries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('model', nargs='?',
+                        default='twitter_pos_hmm_laplace.json')
+    parser.add_argument('corpus', nargs='?', default='twt.dev.json')
+    parser.add_argument('--output-dir', default='mistagged')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='draw at most this many tweets')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: all cores)')
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K,
+                        help='edges drawn out of each state')
+    parser.add_argument('--oov', default=None,
+                        help='oov_model.py file for unknown words')
+    args = parser.parse_args()
+    entries = render_all(args.model, args.corpus, args.output_dir,
+                         args.limit, args.workers, args.top_k, args.oov)
+    print("Drew %d mis-tagged tweets (%d wrong tags) into %s"
+          % (len(entries), sum(e['errors'] for e in entries),
+             args.output_dir))
@@ -1,12 +1,11 @@
 import hmm
 import json
-import hmm_vis as hv
 
-def get_model(smoothing=False):
+def get_model(smoothing=False, backend='dict'):
     if smoothing:
-        return hmm.HMM('twitter_pos_hmm_laplace.json')
+        return hmm.HMM('twitter_pos_hmm_laplace.json', backend=backend)
     else:
-        return hmm.HMM('twitter_pos_hmm.json')
+        return hmm.HMM('twitter_pos_hmm.json', backend=backend)
 
 def form_seq(twt):
     seq = []
@@ -21,7 +20,7 @@ def get_ans(twt):
     return ans
 
 if __name__ == '__main__':
-    model = get_model(smoothing=True)
+    model = get_model(smoothing=True, backend='numpy')
     total = 0
     correct = 0
     with open('twt.test.json', 'r') as f:
@@ -29,7 +28,6 @@ if __name__ == '__main__':
             twt = json.loads(line)
             seq = form_seq(twt)
             ans = get_ans(twt)
-            beliefs = model.forward_algorithm(seq)
             state_seq = model.viterbi_algorithm(seq)
             total += len(seq)
             for i in range(len(state_seq)):
@@ -0,0 +1,101 @@
+"""tag_tweets.py
+
+Tags tweets from the command line, for scripts and short-lived batch jobs.
+
+Reads one tweet per line from the given files, or from standard input, and
+writes one tagged tweet per line.  A line is split into tokens on
+whitespace, or with --json it is a JSON list of tokens, or of [token, tag]
+pairs as in twt.test.json (the tags are ignored).  Each output line is
+token/TAG pairs separated by spaces, or with --json a JSON list of
+[token, tag] pairs.  Lines are tagged in batches with the batched Viterbi
+algorithm of the numpy backend.
+
+The process is meant to start fast: it never imports hmm_vis, and a JSON
+model is loaded from its binary form in the model cache (see
+hmm_binary.cached), which is only written on the first run.  benchmark.py
+--cli-cold-start measures how long a run on one tweet takes.
+
+Usage:
+    python tag_tweets.py [model.json] [input.txt ...] [--json]
+                         [--oov oov.json] [--batch-size N]
+                         [--cache-dir DIR | --no-cache]
+"""
+
+import argparse
+import json
+import sys
+
+import hmm
+
+DEFAULT_BATCH_SIZE = 256
+
+
+def read_tokens(line, is_json=False):
+    """ the tokens of one input line """
+    if not is_json or not line.strip():
+        return line.split()
+    return [item[0] if isinstance(item, list) else item
+            for item in json.loads(line)]
+
+
+def format_tags(tokens, tags, is_json=False):
+    """ one output line, without its newline """
+    if is_json:
+        return json.dumps([[token, tag] for token, tag in zip(tokens, tags)],
+                          ensure_ascii=False)
+    return ' '.join('%s/%s' % pair for pair in zip(tokens, tags))
+
+
+def tag_lines(model, lines, is_json=False, batch_size=DEFAULT_BATCH_SIZE):
+    """ yield the output line of every input line, in order """
+    batch = []
+    for line in lines:
+        batch.append(read_tokens(line, is_json))
+        if len(batch) >= batch_size:
+            yield from _tag_batch(model, batch, is_json)
+            batch = []
+    yield from _tag_batch(model, batch, is_json)
+
+
+def _tag_batch(model, batch, is_json):
+    nonempty = [tokens for tokens in batch if tokens]
+    tags = iter(model.viterbi_batch(nonempty) if nonempty else [])
+    for tokens in batch:
+        yield format_tags(tokens, next(tags) if tokens else [], is_json)
+
+
+def _input_lines(filenames):
+    if not filenames:
+        yield from sys.stdin
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8') as f:
+            yield from f
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('model', nargs='?',
+                        default='twitter_pos_hmm_laplace.json')
+    parser.add_argument('inputs', nargs='*',
+                        help='files of tweets (default: standard input)')
+    parser.add_argument('--json', action='store_true',
+                        help='read and write JSON lists instead of text')
+    parser.add_argument('--oov', default=None,
+                        help='oov_model.py file for unknown words')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--cache-dir', default=None,
+                        help='model cache directory (default: '
+                             '$HMM_CACHE_DIR or ~/.cache/twitterhmm)')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='load a JSON model without the model cache')
+    args = parser.parse_args()
+    model = hmm.HMM(args.model, backend='numpy',
+                    model_cache=(args.cache_dir or True) if args.cache
+                    else None)
+    if args.oov is not None:
+        import oov_model
+        model.set_oov_model(oov_model.OOVModel.load(args.oov))
+    out = sys.stdout
+    for line in tag_lines(model, _input_lines(args.inputs), args.json,
+                          args.batch_size):
+        out.write(line + '\n')
@@ -0,0 +1,178 @@
+"""tagging_load.py
+
+Replays a JSONL file of tagged tweets, such as twt.test.json, against a
+running tagging_server.py, and reports what a client sees: requests per
+second, tokens per second, latency percentiles, refused (503) requests and
+tagging accuracy, followed by the server's own /stats.
+
+Each of --concurrency clients keeps one connection open and sends its next
+tweet as soon as the previous one is answered.  A refused request is sent
+again after --retry-delay ms.  With --rate, tweets are instead started at
+that many per second in total, whether or not earlier ones are answered.
+
+Usage:
+    python tagging_load.py [data.json] [--host H] [--port P] [--unix PATH]
+                           [--concurrency N] [--rate R] [--limit N]
+                           [--repeat N] [--beliefs] [--retry-delay MS]
+"""
+
+import asyncio
+import json
+import time
+
+import benchmark
+import hmm_metrics
+import tagging_server
+
+
+class Client:
+    """ one keep-alive connection to a tagging server """
+
+    def __init__(self, host='127.0.0.1', port=tagging_server.DEFAULT_PORT,
+                 unix=None):
+        self.host = host
+        self.port = port
+        self.unix = unix
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        if self.unix is not None:
+            self.reader, self.writer = \
+                await asyncio.open_unix_connection(self.unix)
+        else:
+            self.reader, self.writer = \
+                await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, payload=None):
+        """ send one request; return (status, JSON result) """
+        if self.writer is None:
+            await self.connect()
+        body = b'' if payload is None else json.dumps(payload).encode('utf-8')
+        tagging_server.write_message(self.writer, '%s %s HTTP/1.1'
+                                     % (method, path), body)
+        await self.writer.drain()
+        message = await tagging_server.read_message(self.reader)
+        if message is None:
+            raise ConnectionError('server closed the connection')
+        start_line, headers, body = message
+        return int(start_line.split()[1]), json.loads(body)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+
+
+async def replay(tweets, concurrency=32, rate=None, beliefs=False,
+                 retry_delay=0.01, **address):
+    """ send every (tokens, tags) tweet to the server; return a dict of
+        results and the server's stats """
+    latencies = []
+    counts = {'requests': 0, 'rejected': 0, 'tokens': 0, 'correct': 0}
+    queue = asyncio.Queue()
+    for tweet in tweets:
+        queue.put_nowait(tweet)
+
+    async def send(client, tokens, tags):
+        start = time.perf_counter()
+        while True:
+            status, result = await client.request(
+                'POST', '/tag', {'tokens': tokens, 'beliefs': beliefs})
+            if status != 503:
+                break
+            counts['rejected'] += 1
+            await asyncio.sleep(retry_delay)
+        if status != 200:
+            raise RuntimeError('server answered %d: %s' % (status, result))
+        latencies.append(time.perf_counter() - start)
+        counts['requests'] += 1
+        counts['tokens'] += len(tokens)
+        counts['correct'] += sum(a == b for a, b in zip(result['tags'], tags))
+
+    async def worker():
+        client = Client(**address)
+        try:
+            while not queue.empty():
+                await send(client, *queue.get_nowait())
+        finally:
+            await client.close()
+
+    async def paced():
+        # One connection per tweet in flight, opened as they are needed.
+        idle = []
+        tasks = []
+
+        async def one(tokens, tags):
+            client = idle.pop() if idle else Client(**address)
+            await send(client, tokens, tags)
+            idle.append(client)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for i, tweet in enumerate(tweets):
+            delay = start + i / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(*tweet)))
+        await asyncio.gather(*tasks)
+        for client in idle:
+            await client.close()
+
+    start = time.perf_counter()
+    if rate is None:
+        await asyncio.gather(*[worker() for i in range(concurrency)])
+    else:
+        await paced()
+    elapsed = time.perf_counter() - start
+    client = Client(**address)
+    server_stats = (await client.request('GET', '/stats'))[1]
+    await client.close()
+    results = dict(counts)
+    results['seconds'] = elapsed
+    results['requests_per_second'] = counts['requests'] / elapsed
+    results['tokens_per_second'] = counts['tokens'] / elapsed
+    results['accuracy'] = counts['correct'] / max(counts['tokens'], 1)
+    for q in hmm_metrics.PERCENTILES:
+        results['p%d_ms' % q] = 1000 * hmm_metrics.percentile(latencies, q)
+    return results, server_stats
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Replay tagged tweets against tagging_server.py.')
+    parser.add_argument('data', nargs='?', default='twt.test.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int,
+                        default=tagging_server.DEFAULT_PORT)
+    parser.add_argument('--unix', default=None)
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='number of clients sending back to back')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='start this many tweets per second instead')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='only replay the first N tweets')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='replay the file this many times')
+    parser.add_argument('--beliefs', action='store_true',
+                        help='ask for the belief vectors too')
+    parser.add_argument('--retry-delay', type=float, default=10,
+                        help='ms to wait before resending a refused request')
+    args = parser.parse_args()
+    tweets = benchmark.load_tagged(args.data, args.limit) * args.repeat
+    results, server_stats = asyncio.run(replay(
+        tweets, args.concurrency, args.rate, args.beliefs,
+        args.retry_delay / 1000, host=args.host, port=args.port,
+        unix=args.unix))
+    print("%d requests, %d tokens in %.2f s: %.0f requests/s, "
+          "%.0f tokens/s" % (results['requests'], results['tokens'],
+                             results['seconds'],
+                             results['requests_per_second'],
+                             results['tokens_per_second']))
+    print("client latency: " + ", ".join(
+        "p%d %.1f ms" % (q, results['p%d_ms' % q])
+        for q in hmm_metrics.PERCENTILES))
+    print("refused (503) and resent: %d" % results['rejected'])
+    print("accuracy: %.2f%%" % (100 * results['accuracy']))
+    print("server: " + json.dumps(server_stats, sort_keys=True))
@@ -0,0 +1,427 @@
+"""tagging_server.py
+
+An asyncio HTTP server that tags tweets with an HMM loaded once at start.
+
+Requests are JSON over HTTP/1.1, with keep-alive, on a TCP port or a Unix
+socket:
+
+    POST /tag    {"tokens": ["word", ...], "beliefs": false}
+                 (or just the list of tokens)
+             ->  {"tags": [...]}, plus "beliefs" (the belief vectors of the
+                 Forward algorithm) and "states" (their order) if asked for
+    GET /stats   counters, batch sizes and latency percentiles
+
+Requests that arrive together are decoded together: a MicroBatcher
+collects them until it has max_batch of them or max_wait seconds have
+passed since the first, then runs HMM.viterbi_batch (and
+HMM.forward_batch for those that asked for beliefs) once for the whole
+batch, in a worker thread so that the event loop keeps reading requests.
+When max_pending requests are already waiting or being decoded, new ones
+are refused at once with 503 Service Unavailable, so a client that sends
+faster than the model can tag sees errors rather than ever longer delays.
+The latency of each request is measured from the moment it was read to
+the moment its result was ready.
+
+The model is held in a model_registry.ModelRegistry.  With --watch, the
+model file is checked for changes and reloaded into a new snapshot, which
+replaces the old one between two batches, either at once or, with
+--shadow-sample, after it has been shadowed on that fraction of requests
+and agreed with the old one on at least --min-agreement of the tokens.
+/stats then also shows the loaded versions and the shadow agreement.
+
+tagging_load.py replays a tweet file against a running server.
+
+Usage:
+    python tagging_server.py [model.json] [--host H] [--port P]
+                             [--unix PATH] [--backend dict|numpy]
+                             [--oov oov.json] [--max-batch N]
+                             [--max-wait MS] [--max-pending N]
+                             [--watch SECONDS] [--keep N]
+                             [--shadow-sample F] [--min-agreement F]
+                             [--shadow-tokens N]
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import time
+
+import hmm
+import hmm_metrics
+import model_registry
+
+DEFAULT_PORT = 8473
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT = 0.005
+DEFAULT_MAX_PENDING = 1024
+DEFAULT_LATENCY_WINDOW = 10000
+MAX_BODY = 1 << 20
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class Overloaded(Exception):
+    """ raised by MicroBatcher.submit when max_pending requests are
+        already in flight """
+
+
+class PayloadTooLarge(Exception):
+    """ raised by read_message when a body is longer than MAX_BODY """
+
+
+class MicroBatcher:
+    """ coalesces concurrent tagging requests into batches """
+
+    def __init__(self, model, max_batch=DEFAULT_MAX_BATCH,
+                 max_wait=DEFAULT_MAX_WAIT, max_pending=DEFAULT_MAX_PENDING,
+                 latency_window=DEFAULT_LATENCY_WINDOW, registry=None):
+        """ model is an HMM.  A batch is decoded once it has max_batch
+            requests or max_wait seconds after its first request arrived.
+            Latency percentiles are over the last latency_window requests.
+            With a model_registry.ModelRegistry, each batch is decoded with
+            its active snapshot instead of model, and shadowed by it. """
+        self.model = model
+        self.registry = registry
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.queue = asyncio.Queue()
+        self.pending = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.started = time.monotonic()
+        self.counters = {'requests': 0, 'rejected': 0, 'errors': 0,
+                         'batches': 0, 'tokens': 0}
+        self.task = None
+
+    def start(self):
+        """ start decoding batches in the running event loop """
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """ stop decoding; requests still queued are not answered """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown()
+
+    async def submit(self, tokens, beliefs=False):
+        """ tag one token sequence; return (tags, belief vectors or None,
+            the states in the order of the belief vectors) """
+        if self.pending >= self.max_pending:
+            self.counters['rejected'] += 1
+            raise Overloaded()
+        self.pending += 1
+        try:
+            future = asyncio.get_running_loop().create_future()
+            self.queue.put_nowait((tokens, beliefs, time.perf_counter(),
+                                   future))
+            return await future
+        finally:
+            self.pending -= 1
+
+    async def run(self):
+        """ decode batches until cancelled """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            # The model is read once per batch, so a swap in the registry
+            # takes effect between batches.
+            snapshot = self.registry.active if self.registry else None
+            model = self.model if snapshot is None else snapshot.model
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self._decode, model,
+                    [item[0] for item in batch], [item[1] for item in batch],
+                    snapshot)
+            except Exception as e:
+                self.counters['errors'] += len(batch)
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(e)
+                continue
+            now = time.perf_counter()
+            self.counters['batches'] += 1
+            for (tokens, beliefs, arrived, future), result \
+                    in zip(batch, results):
+                self.counters['requests'] += 1
+                self.counters['tokens'] += len(tokens)
+                self.latencies.append(now - arrived)
+                if not future.done():
+                    future.set_result(result)
+
+    def _decode(self, model, sequences, with_beliefs, snapshot=None):
+        """ tag a batch; return a (tags, beliefs or None, states) triple per
+            sequence, states being the order of the belief vectors """
+        start = time.perf_counter()
+        tags = model.viterbi_batch(sequences)
+        if snapshot is not None:
+            self.registry.shadow_batch(sequences, tags,
+                                       time.perf_counter() - start, snapshot)
+        wanted = [i for i, flag in enumerate(with_beliefs) if flag]
+        beliefs = [None] * len(sequences)
+        if wanted:
+            for i, b in zip(wanted, model.forward_batch(
+                    [sequences[i] for i in wanted])):
+                beliefs[i] = b
+        states = model.compile().states
+        return [(t, b, states) for t, b in zip(tags, beliefs)]
+
+    def stats(self):
+        """ the counters, the mean batch size, the number of requests in
+            flight, and latency percentiles in ms """
+        stats = dict(self.counters)
+        stats['pending'] = self.pending
+        stats['uptime'] = time.monotonic() - self.started
+        stats['mean_batch'] = (self.counters['requests']
+                               / self.counters['batches']
+                               if self.counters['batches'] else 0.0)
+        latencies = list(self.latencies)
+        for q in hmm_metrics.PERCENTILES:
+            stats['p%d_ms' % q] = 1000 * hmm_metrics.percentile(latencies, q)
+        if self.registry is not None:
+            stats['registry'] = self.registry.stats()
+        return stats
+
+
+async def read_message(reader):
+    """ read one HTTP/1.1 request or response; return (start line, headers
+        with lower-case names, body), or None at the end of the stream.
+        Raises ValueError on a malformed Content-Length and PayloadTooLarge
+        on one above MAX_BODY. """
+    line = await reader.readline()
+    if not line:
+        return None
+    start_line = line.decode('latin-1').rstrip('\r\n')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length < 0:
+        raise ValueError('negative Content-Length %d' % length)
+    if length > MAX_BODY:
+        raise PayloadTooLarge('body of %d bytes is too large' % length)
+    body = await reader.readexactly(length) if length else b''
+    return start_line, headers, body
+
+
+def write_message(writer, start_line, body, keep_alive=True):
+    """ write an HTTP/1.1 message with a JSON body (bytes) """
+    writer.write(('%s\r\nContent-Type: application/json\r\n'
+                  'Content-Length: %d\r\nConnection: %s\r\n\r\n'
+                  % (start_line, len(body),
+                     'keep-alive' if keep_alive else 'close')
+                  ).encode('latin-1') + body)
+
+
+class TaggingServer:
+    """ HTTP front end of a MicroBatcher """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def handle(self, reader, writer):
+        """ serve the requests of one connection, one at a time """
+        try:
+            while True:
+                try:
+                    message = await read_message(reader)
+                except (ValueError, PayloadTooLarge) as e:
+                    status = 413 if isinstance(e, PayloadTooLarge) else 400
+                    write_message(writer, 'HTTP/1.1 %d %s'
+                                  % (status, REASONS[status]),
+                                  json.dumps({'error': str(e)}).encode(
+                                      'utf-8'), keep_alive=False)
+                    break
+                if message is None:
+                    break
+                start_line, headers, body = message
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                status, result = await self.respond(start_line, body)
+                write_message(writer, 'HTTP/1.1 %d %s'
+                              % (status, REASONS[status]),
+                              json.dumps(result).encode('utf-8'), keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, start_line, body):
+        """ the (status, JSON result) of one request; an error while
+            answering it is a 500 """
+        try:
+            return await self._respond(start_line, body)
+        except Exception as e:
+            return 500, {'error': '%s: %s' % (type(e).__name__, e)}
+
+    async def _respond(self, start_line, body):
+        parts = start_line.split()
+        if len(parts) < 2:
+            return 400, {'error': 'malformed request line'}
+        method, path = parts[0], parts[1]
+        if path == '/stats':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            return 200, self.batcher.stats()
+        if path != '/tag':
+            return 404, {'error': 'unknown path %s' % path}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        try:
+            request = json.loads(body)
+            if isinstance(request, list):
+                request = {'tokens': request}
+            tokens = request['tokens']
+            with_beliefs = bool(request.get('beliefs', False))
+            if not isinstance(tokens, list) or \
+                    not all(isinstance(obs, str) for obs in tokens):
+                raise TypeError('tokens must be a list of strings')
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return 400, {'error': 'expected {"tokens": [...]}: %s' % e}
+        try:
+            tags, beliefs, states = await self.batcher.submit(tokens,
+                                                              with_beliefs)
+        except Overloaded:
+            return 503, {'error': 'overloaded'}
+        result = {'tags': tags}
+        if with_beliefs:
+            result['beliefs'] = beliefs
+            result['states'] = states
+        return 200, result
+
+
+async def watch(registry, watcher, interval, shadow_sample=0.0,
+                min_agreement=0.0, min_tokens=1):
+    """ every interval seconds, load the watched model file into registry
+        if it changed, and make it active: at once, or, with shadow_sample
+        above 0, once it agrees with the active model on a fraction
+        min_agreement of at least min_tokens shadowed tokens """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        if watcher.changed():
+            try:
+                snapshot = await loop.run_in_executor(
+                    None, registry.load, watcher.filename)
+            except (OSError, ValueError, KeyError) as e:
+                print("Could not load %s: %s" % (watcher.filename, e))
+                continue
+            if snapshot is registry.active:
+                continue
+            if shadow_sample > 0:
+                registry.start_shadow(snapshot.version, shadow_sample)
+                print("Shadowing version %s" % snapshot.version)
+            else:
+                registry.promote(snapshot.version)
+                print("Promoted version %s" % snapshot.version)
+        if registry.shadow is not None:
+            version = registry.shadow.version
+            if registry.promote_shadow(min_agreement, min_tokens):
+                print("Promoted version %s" % version)
+
+
+async def serve(model, host='127.0.0.1', port=DEFAULT_PORT, unix=None,
+                max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT,
+                max_pending=DEFAULT_MAX_PENDING, registry=None, watcher=None):
+    """ serve model, or the active model of registry, until cancelled.
+        watcher, if any, is a coroutine run alongside, such as watch. """
+    batcher = MicroBatcher(model, max_batch, max_wait, max_pending,
+                           registry=registry)
+    batcher.start()
+    watching = None
+    if watcher is not None:
+        watching = asyncio.get_running_loop().create_task(watcher)
+    server = TaggingServer(batcher)
+    if unix is not None:
+        listener = await asyncio.start_unix_server(server.handle, unix)
+        print("Serving on %s" % unix)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        print("Serving on http://%s:%d" % (host, port))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if watching is not None:
+            watching.cancel()
+        await batcher.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Serve HMM POS tagging over HTTP with micro-batching.')
+    parser.add_argument('model', nargs='?',
+                        default='twitter_pos_hmm_laplace.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', default=None,
+                        help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--backend', default='numpy', choices=hmm.BACKENDS)
+    parser.add_argument('--oov', default=None,
+                        help='oov_model.py file for unknown words')
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument('--max-wait', type=float,
+                        default=DEFAULT_MAX_WAIT * 1000,
+                        help='longest wait, in ms, for a batch to fill')
+    parser.add_argument('--max-pending', type=int,
+                        default=DEFAULT_MAX_PENDING,
+                        help='requests in flight before new ones get 503')
+    parser.add_argument('--watch', type=float, default=None,
+                        metavar='SECONDS',
+                        help='check the model file this often and reload '
+                             'it when it changes')
+    parser.add_argument('--keep', type=int,
+                        default=model_registry.DEFAULT_KEEP,
+                        help='inactive model versions kept loaded')
+    parser.add_argument('--shadow-sample', type=float, default=0.0,
+                        help='shadow a reloaded model on this fraction of '
+                             'requests before promoting it')
+    parser.add_argument('--min-agreement', type=float, default=0.95,
+                        help='token agreement a shadowed model needs')
+    parser.add_argument('--shadow-tokens', type=int, default=1000,
+                        help='tokens to shadow before deciding')
+    args = parser.parse_args()
+    oov = None
+    if args.oov is not None:
+        import oov_model
+        oov = oov_model.OOVModel.load(args.oov)
+    registry = model_registry.ModelRegistry(args.keep, args.backend, oov)
+    model = registry.promote(registry.load(args.model).version).model
+    watcher = None
+    if args.watch is not None:
+        watcher = watch(registry, model_registry.FileWatcher(args.model),
+                        args.watch, args.shadow_sample, args.min_agreement,
+                        args.shadow_tokens)
+    try:
+        asyncio.run(serve(model, args.host, args.port, args.unix,
+                          args.max_batch, args.max_wait / 1000,
+                          args.max_pending, registry, watcher))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,77 @@
+""" tests of the E-step and the training loop of baum_welch """
+
+import itertools
+import math
+import os
+
+import numpy as np
+import pytest
+
+import baum_welch
+import hmm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOY = os.path.join(ROOT, 'toy_pos_tagger.json')
+SEQUENCES = [['Mary', 'Will', 'See', 'Spot'], ['Jane', 'Can', 'See', 'Will'],
+             ['Will', 'Jane', 'Spot', 'Mary'], ['Jane'], ['Spot', 'Will']]
+
+
+def brute_force(model, ids):
+    """ P(e_1, ..., e_T, <E>) and the expected end counts, summed over every
+        state sequence """
+    n_states = len(model.states)
+    total = 0.0
+    end = np.zeros(n_states)
+    for path in itertools.product(range(n_states), repeat=len(ids)):
+        p = model.start[path[0]] * model.emission[ids[0], path[0]]
+        for t in range(1, len(ids)):
+            p *= model.trans[path[t - 1], path[t]] * \
+                model.emission[ids[t], path[t]]
+        p *= model.end[path[-1]]
+        total += p
+        end[path[-1]] += p
+    return total, end / total
+
+
+@pytest.fixture
+def toy():
+    return hmm.HMM(TOY, backend='numpy').compile()
+
+
+def test_e_step_includes_the_end_transition(toy):
+    id_sequences = [toy.encode(seq) for seq in SEQUENCES]
+    start, trans, end, word_ids, emission, log_likelihood, n_tokens, \
+        n_skipped = baum_welch.e_step(toy, id_sequences)
+    expected = [brute_force(toy, ids) for ids in id_sequences]
+    assert n_skipped == 0
+    assert log_likelihood == pytest.approx(
+        sum(math.log(total) for total, _ in expected))
+    assert end == pytest.approx(sum(e for _, e in expected))
+    assert trans.sum() + end.sum() == pytest.approx(n_tokens)
+
+
+def test_log_likelihood_never_decreases():
+    trace = []
+    baum_welch.train(hmm.HMM(TOY, backend='numpy'), SEQUENCES * 3,
+                     iterations=8, tolerance=-math.inf, prior_weight=0,
+                     log=lambda line: trace.append(
+                         float(line.split('log-likelihood ')[1].split()[0])))
+    assert len(trace) == 8
+    for before, after in zip(trace, trace[1:]):
+        assert after >= before - 1e-9
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_prior_keeps_words_missing_from_the_corpus(toy, workers):
+    initial = hmm.HMM(TOY, backend='numpy')
+    unseen = [o for o in initial.O
+              if all(o not in seq for seq in SEQUENCES)]
+    assert unseen
+    trained = {weight: baum_welch.train(initial, SEQUENCES, iterations=3,
+                                        workers=workers, log=lambda line: 0,
+                                        prior_weight=weight).compile()
+               for weight in (0, 0.5)}
+    rows = [toy.word_ids[o] for o in unseen]
+    assert not trained[0].emission[rows].any()
+    assert np.allclose(trained[0.5].emission[rows], 0.5 * toy.emission[rows])
+    assert np.allclose(trained[0.5].emission.sum(axis=0), 1)
@@ -0,0 +1,90 @@
+""" tests of the bounded emission cache of the dict backend """
+
+import json
+import os
+
+import emission_cache
+import hmm
+import hmm_trainer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+WORDS = ['a', 'b', 'c', 'd']
+
+
+def counting_cache(max_bytes):
+    """ a cache of fake columns and the list of words it computed """
+    computed = []
+
+    def compute(obs):
+        computed.append(obs)
+        return {'N': 0.5, 'V': 0.25}
+    return emission_cache.EmissionCache(compute, max_bytes), computed
+
+
+def entry_size():
+    return emission_cache.EmissionCache.size('a', {'N': 0.5, 'V': 0.25})
+
+
+def test_a_tiny_cache_evicts_least_recently_used():
+    cache, computed = counting_cache(2 * entry_size())
+    for obs in WORDS:
+        cache.get(obs)
+    assert cache.stats()['size'] == 2
+    assert cache.evictions == 2
+    assert cache.bytes <= cache.max_bytes
+    cache.get('d')
+    cache.get('c')
+    cache.get('a')
+    assert computed == WORDS + ['a']
+    assert list(cache.entries) == ['c', 'a']
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 5, 3)
+
+
+def test_hit_rate_on_a_repeated_sequence():
+    cache, computed = counting_cache(len(WORDS) * entry_size())
+    for i in range(10):
+        for obs in WORDS:
+            cache.get(obs)
+    assert computed == WORDS
+    assert cache.evictions == 0
+    assert cache.stats()['hit_rate'] == 36 / 40
+    # Cycling through one more word than fit misses on every lookup.
+    cache, computed = counting_cache((len(WORDS) - 1) * entry_size())
+    for i in range(10):
+        for obs in WORDS:
+            cache.get(obs)
+    assert cache.stats()['hit_rate'] == 0.0
+    assert len(computed) == 40
+
+
+def test_size_zero_caches_nothing():
+    cache, computed = counting_cache(0)
+    for obs in WORDS * 2:
+        assert cache.get(obs) == {'N': 0.5, 'V': 0.25}
+    assert computed == WORDS * 2
+    assert cache.stats()['size'] == 0
+    assert cache.bytes == 0 and cache.evictions == 0
+
+
+def test_cache_size_does_not_change_decoding():
+    trainer = hmm_trainer.train([DEV], hmm_trainer.AddAlpha())
+    trainer.register_pairs(TEST)
+    model = hmm.HMM(backend='dict')
+    model.set_parameters(trainer.parameters())
+    with open(TEST, 'r') as f:
+        tweets = [[item[0] for item in json.loads(line)]
+                  for line, i in zip(f, range(200))]
+    model.set_emission_cache()
+    expected = [model.viterbi_algorithm(seq) for seq in tweets]
+    beliefs = [model.forward_algorithm(seq) for seq in tweets[:20]]
+    large = model.emission_cache.stats()
+    assert large['evictions'] == 0 and large['hit_rate'] > 0.5
+    for max_bytes in (0, 4096):
+        cache = model.set_emission_cache(max_bytes)
+        assert [model.viterbi_algorithm(seq) for seq in tweets] == expected
+        assert [model.forward_algorithm(seq)
+                for seq in tweets[:20]] == beliefs
+        assert cache.bytes <= max_bytes
+        assert (cache.evictions > 0) == (max_bytes > 0)
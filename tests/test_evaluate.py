@@ -0,0 +1,80 @@
+""" tests that evaluate.py counts as the loop of run_pos_test.py does """
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import evaluate
+import hmm
+import hmm_trainer
+import run_pos_test
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+CHUNK_SIZE = 97
+
+
+@pytest.fixture(scope='module')
+def model():
+    trained = hmm.HMM(backend='numpy')
+    trained.set_parameters(
+        hmm_trainer.train([DEV], hmm_trainer.AddAlpha()).parameters())
+    return trained
+
+
+@pytest.fixture(scope='module')
+def tweets():
+    with open(TEST, 'r') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_viterbi_pass_matches_run_pos_test(model, tweets):
+    # The loop of run_pos_test.py, on a model trained here.
+    total = 0
+    correct = 0
+    gold_counts = {}
+    n_oov = 0
+    for twt in tweets:
+        seq = run_pos_test.form_seq(twt)
+        ans = run_pos_test.get_ans(twt)
+        state_seq = model.viterbi_algorithm(seq)
+        total += len(seq)
+        correct += sum(a == s for a, s in zip(ans, state_seq))
+        for tag in ans:
+            gold_counts[tag] = gold_counts.get(tag, 0) + 1
+        n_oov += sum(obs not in model.word_ids for obs in seq)
+    assert 0 < n_oov < total
+
+    stats = evaluate.evaluate(model, TEST, chunk_size=CHUNK_SIZE).stats
+    results = stats['viterbi'].results()
+    assert (results['correct'], results['tokens']) == (correct, total)
+    assert results['tweets'] == len(tweets)
+    confusion = np.array(results['confusion']['matrix'])
+    assert confusion.sum() == total
+    assert np.trace(confusion) == correct
+    rows = dict(zip(results['confusion']['tags'],
+                    confusion.sum(axis=1).tolist()))
+    assert {tag: n for tag, n in rows.items() if n} == gold_counts
+    assert results['oov']['tokens'] == n_oov
+    assert results['in_vocabulary']['tokens'] + n_oov == total
+    assert results['in_vocabulary']['correct'] + \
+        results['oov']['correct'] == correct
+    assert sum(stats['viterbi'].tweet_tokens) == total
+    assert sum(stats['viterbi'].tweet_errors) == total - correct
+
+
+def test_limit_and_chunk_size_do_not_change_counts(model, tweets):
+    limit = 250
+    counts = []
+    for chunk_size in (1, CHUNK_SIZE, limit + 1):
+        evaluation = evaluate.evaluate(model, TEST, ('viterbi', 'posterior'),
+                                       chunk_size=chunk_size, limit=limit)
+        results = evaluation.results()
+        assert results['viterbi']['tweets'] == limit
+        counts.append([(r['correct'], r['tokens'], r['confusion'])
+                       for r in results.values()])
+    assert counts[0] == counts[1] == counts[2]
+    assert counts[0][0][1] == sum(len(twt) for twt in tweets[:limit])
@@ -0,0 +1,301 @@
+""" tests of the decoding algorithms of hmm.HMM, on toy_pos_tagger.json and
+    on a model trained from twt.dev.json """
+
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+import hmm
+import hmm_trainer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOY = os.path.join(ROOT, 'toy_pos_tagger.json')
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+LONG_LENGTH = 5000
+
+
+def states_of(model):
+    return [s for s in model.S if s != '<S>' and s != '<E>']
+
+
+def path_log_prob(model, obs_sequence, path):
+    """ log P(path, obs) without the transition into <E>, the quantity
+        Viterbi maximizes """
+    total = 0.0
+    prev = '<S>'
+    for obs, s in zip(obs_sequence, path):
+        total += hmm.log_prob(model.P_trans[prev][s])
+        total += hmm.log_prob(model.P_emission[s].get(obs, 0))
+        prev = s
+    return total
+
+
+def brute_force_prob(model, obs_sequence):
+    """ P(e_1, ..., e_T), summed over every state sequence """
+    return sum(math.exp(path_log_prob(model, obs_sequence, path))
+               for path in itertools.product(states_of(model),
+                                             repeat=len(obs_sequence)))
+
+
+def sample(model, length, seed=0):
+    """ a sequence of length words generated by the model, restarting from
+        <S> whenever it would end """
+    rng = random.Random(seed)
+    obs_sequence = []
+    s = '<S>'
+    while len(obs_sequence) < length:
+        row = {k: p for k, p in model.P_trans[s].items() if k != '<E>' and p}
+        s = rng.choices(list(row), list(row.values()))[0]
+        emissions = {o: p for o, p in model.P_emission[s].items() if p}
+        obs_sequence.append(rng.choices(list(emissions),
+                                        list(emissions.values()))[0])
+    return obs_sequence
+
+
+def load_tweets(filename, limit):
+    with open(filename, 'r') as f:
+        return [[item[0] for item in json.loads(line)]
+                for line, i in zip(f, range(limit))]
+
+
+def toy_sequences(max_length=3):
+    words = hmm.HMM(TOY).O
+    for length in range(1, max_length + 1):
+        yield from (list(seq) for seq in itertools.product(words,
+                                                           repeat=length))
+
+
+@pytest.fixture(scope='module', params=hmm.BACKENDS)
+def toy(request):
+    return hmm.HMM(TOY, backend=request.param)
+
+
+@pytest.fixture(scope='module')
+def trained():
+    trainer = hmm_trainer.train([DEV], hmm_trainer.AddAlpha())
+    model = hmm.HMM()
+    model.set_parameters(trainer.parameters())
+    return model
+
+
+@pytest.fixture(scope='module')
+def unsmoothed():
+    trainer = hmm_trainer.train([DEV])
+    model = hmm.HMM()
+    model.set_parameters(trainer.parameters())
+    return model
+
+
+def backend_copy(model, backend, prune=True):
+    """ a new HMM with the parameters of model """
+    copy = hmm.HMM(backend=backend, prune=prune)
+    copy.set_parameters({'S': model.S, 'O': model.O,
+                         'P_trans': model.P_trans,
+                         'P_emission': model.P_emission})
+    return copy
+
+
+def test_log_viterbi_matches_viterbi_on_toy(toy):
+    for obs_sequence in toy_sequences():
+        if brute_force_prob(toy, obs_sequence) == 0:
+            continue
+        assert toy.log_viterbi_algorithm(obs_sequence) == \
+            toy.viterbi_algorithm(obs_sequence)
+
+
+def test_scaled_forward_matches_brute_force_on_toy(toy):
+    for obs_sequence in toy_sequences():
+        expected = brute_force_prob(toy, obs_sequence)
+        beliefs, log_norms, log_likelihood = \
+            toy.scaled_forward_algorithm(obs_sequence)
+        assert len(beliefs) == len(log_norms) == len(obs_sequence)
+        if expected == 0:
+            assert log_likelihood == -math.inf
+        else:
+            assert log_likelihood == pytest.approx(math.log(expected),
+                                                   rel=1e-12, abs=1e-12)
+
+
+def test_log_viterbi_matches_viterbi_before_underflow(toy):
+    obs_sequence = sample(toy, LONG_LENGTH)
+    checked = 0
+    for length in (10, 50, 100, 200, 400, 800):
+        prefix = obs_sequence[:length]
+        path = toy.viterbi_algorithm(prefix)
+        if math.exp(path_log_prob(toy, prefix, path)) > 0:
+            assert toy.log_viterbi_algorithm(prefix) == path
+            checked += 1
+    assert checked >= 3
+
+
+def test_long_sequence_stays_finite(toy):
+    obs_sequence = sample(toy, LONG_LENGTH)
+    path = toy.log_viterbi_algorithm(obs_sequence)
+    assert len(path) == LONG_LENGTH
+    score = path_log_prob(toy, obs_sequence, path)
+    assert math.isfinite(score)
+    # The plain products underflow to 0 long before the end.
+    assert math.exp(score) == 0
+    beliefs, log_norms, log_likelihood = \
+        toy.scaled_forward_algorithm(obs_sequence)
+    assert math.isfinite(log_likelihood)
+    assert score <= log_likelihood < 0
+    assert all(sum(b) == pytest.approx(1) for b in beliefs)
+
+
+def test_log_viterbi_backends_agree_on_long_sequence():
+    obs_sequence = sample(hmm.HMM(TOY), LONG_LENGTH, seed=1)
+    paths = [hmm.HMM(TOY, backend=backend).log_viterbi_algorithm(
+        obs_sequence) for backend in hmm.BACKENDS]
+    assert paths[0] == paths[1]
+
+
+def test_log_viterbi_matches_viterbi_on_tweets(trained):
+    for obs_sequence in load_tweets(TEST, 300):
+        assert trained.log_viterbi_algorithm(obs_sequence) == \
+            trained.viterbi_algorithm(obs_sequence)
+
+
+@pytest.mark.parametrize('name', ['trained', 'unsmoothed'])
+def test_numpy_backend_matches_dict(name, request):
+    model = request.getfixturevalue(name)
+    fast = backend_copy(model, 'numpy')
+    for obs_sequence in load_tweets(TEST, 300):
+        assert fast.viterbi_algorithm(obs_sequence) == \
+            model.viterbi_algorithm(obs_sequence)
+        for b, expected in zip(fast.forward_algorithm(obs_sequence),
+                               model.forward_algorithm(obs_sequence)):
+            assert b == pytest.approx(expected, abs=1e-12)
+
+
+@pytest.mark.parametrize('backend', hmm.BACKENDS)
+def test_batches_match_single_calls(trained, backend):
+    model = backend_copy(trained, backend)
+    tweets = load_tweets(TEST, 300)
+    tweets.insert(5, [])
+    tweets.append(['a'] * 60)
+    assert model.viterbi_batch(tweets) == \
+        [model.viterbi_algorithm(seq) if seq else [] for seq in tweets]
+    for beliefs, seq in zip(model.forward_batch(tweets), tweets):
+        expected = model.forward_algorithm(seq) if seq else []
+        assert len(beliefs) == len(expected)
+        for b, e in zip(beliefs, expected):
+            assert b == pytest.approx(e, abs=1e-12)
+
+
+@pytest.mark.parametrize('name', ['trained', 'unsmoothed'])
+def test_pruning_gives_identical_results(name, request):
+    model = request.getfixturevalue(name)
+    pruned = backend_copy(model, 'dict', prune=True)
+    exhaustive = backend_copy(model, 'dict', prune=False)
+    for obs_sequence in load_tweets(TEST, 200) + [['Will', 'not-a-word']]:
+        assert pruned.viterbi_algorithm(obs_sequence) == \
+            exhaustive.viterbi_algorithm(obs_sequence)
+        assert pruned.scaled_forward_algorithm(obs_sequence) == \
+            exhaustive.scaled_forward_algorithm(obs_sequence)
+
+
+@pytest.mark.parametrize('backend', hmm.BACKENDS)
+@pytest.mark.parametrize('prefix_depth', [0, 4])
+def test_cached_results_match_uncached(trained, backend, prefix_depth):
+    model = backend_copy(trained, backend)
+    tweets = load_tweets(TEST, 200)
+    expected = [(model.viterbi_algorithm(seq), model.forward_algorithm(seq))
+                for seq in tweets]
+    cache = model.enable_cache(prefix_depth=prefix_depth)
+    for repeat in range(2):
+        for seq, (path, beliefs) in zip(tweets, expected):
+            assert model.viterbi_algorithm(seq) == path
+            for b, e in zip(model.forward_algorithm(seq), beliefs):
+                assert b == pytest.approx(e, abs=1e-12)
+    assert cache.stats()['hits'] >= 2 * len(tweets)
+    if prefix_depth:
+        assert model.prefix_cache.stats()['reused'] > 0
+
+
+def test_oov_model_changes_the_version(trained):
+    import oov_model
+    model = backend_copy(trained, 'numpy')
+    other = backend_copy(trained, 'numpy')
+    plain = model.model_version()
+    other.set_oov_model(oov_model.train([DEV]))
+    assert other.model_version() != plain
+    cache = model.enable_cache()
+    other.enable_cache(cache)
+    tweet = ['RT', '@somebody', ':', 'zzqx', 'lol']
+    before = model.viterbi_algorithm(tweet)
+    assert other.viterbi_algorithm(tweet) != before
+    other.set_oov_model(None)
+    assert other.model_version() == plain
+
+
+@pytest.mark.parametrize('mode, options', [('beam', {'beam': 0}),
+                                           ('beam', {'beam': -2}),
+                                           ('kbest', {'k': 0})])
+def test_decode_rejects_empty_beams(toy, mode, options):
+    with pytest.raises(ValueError, match='at least 1'):
+        toy.decode(['Jane', 'Will', 'Spot'], mode, **options)
+
+
+def test_decode_with_beam_of_one(toy):
+    assert len(toy.decode(['Jane', 'Will', 'Spot'], 'beam', beam=1)) == 3
+    assert len(toy.decode(['Jane', 'Will', 'Spot'], 'kbest', k=1)) == 1
+
+
+def brute_force_posteriors(model, obs_sequence):
+    """ P(S_t = s | e_1, ..., e_T) for every position, by enumerating every
+        state sequence """
+    states = states_of(model)
+    marginals = [dict.fromkeys(states, 0.0) for obs in obs_sequence]
+    for path in itertools.product(states, repeat=len(obs_sequence)):
+        p = math.exp(path_log_prob(model, obs_sequence, path))
+        for t, s in enumerate(path):
+            marginals[t][s] += p
+    total = brute_force_prob(model, obs_sequence)
+    return [{s: p / total for s, p in column.items()} for column in marginals]
+
+
+@pytest.mark.parametrize('obs_sequence', [['Jane', 'Will', 'Spot', 'Will'],
+                                          ['Will', 'See', 'Mary']])
+def test_posteriors_match_brute_force_on_toy(toy, obs_sequence):
+    posteriors, log_likelihood = toy.forward_backward(obs_sequence)
+    expected = brute_force_posteriors(toy, obs_sequence)
+    states = toy.compile().states
+    for column, marginals in zip(posteriors, expected):
+        assert column == pytest.approx([marginals[s] for s in states])
+    assert log_likelihood == pytest.approx(
+        math.log(brute_force_prob(toy, obs_sequence)))
+    tags, confidences = toy.posterior_decode(obs_sequence)
+    assert tags == [max(m, key=m.get) for m in expected]
+    assert confidences == pytest.approx([max(m.values()) for m in expected])
+
+
+def test_posterior_decode_batch_matches_single_calls(trained):
+    seqs = load_tweets(TEST, 200)
+    seqs[7:7] = [[]]
+    batch = trained.posterior_decode_batch(seqs)
+    assert batch[7] == ([], [])
+    for seq, (tags, confidences) in zip(seqs, batch):
+        single_tags, single_confidences = trained.posterior_decode(seq)
+        assert tags == single_tags
+        assert confidences == pytest.approx(single_confidences)
+
+
+def test_decoding_does_not_import_the_visualizer():
+    script = ("import sys, hmm\n"
+              "for backend in ('dict', 'numpy'):\n"
+              "    model = hmm.HMM(%r, backend=backend)\n"
+              "    model.viterbi_algorithm(['Jane', 'Will', 'Spot', 'Will'])\n"
+              "    model.forward_algorithm(['Jane', 'Will'])\n"
+              "print(sorted({'hmm_vis', 'tkinter'} & set(sys.modules)))\n"
+              % TOY)
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
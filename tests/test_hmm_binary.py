@@ -0,0 +1,80 @@
+""" tests of the binary model format of hmm_binary """
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import hmm
+import hmm_binary
+import hmm_trainer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOY = os.path.join(ROOT, 'toy_pos_tagger.json')
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+
+
+@pytest.fixture(scope='module')
+def models(tmp_path_factory):
+    """ the same trained model loaded from JSON and from a binary file """
+    directory = tmp_path_factory.mktemp('models')
+    json_file = str(directory / 'model.json')
+    hmm_trainer.train([DEV], hmm_trainer.AddAlpha()).write_model(json_file)
+    binary_file = str(directory / 'model.hmmb')
+    hmm_binary.convert(json_file, binary_file)
+    return (hmm.HMM(json_file, backend='numpy'),
+            hmm.HMM(binary_file, backend='numpy'))
+
+
+def test_binary_model_stays_sparse(models):
+    from_json, from_binary = models
+    with open(TEST, 'r') as f:
+        tweets = [[item[0] for item in json.loads(line)] for line in f][:300]
+    assert from_binary.viterbi_batch(tweets) == from_json.viterbi_batch(tweets)
+    ids, lengths = from_binary.compile().pack(tweets)
+    assert np.array_equal(from_binary.compile().emission_columns(ids),
+                          from_json.compile().emission_columns(ids))
+    assert from_binary.model_version() == from_json.model_version()
+    assert from_binary.compile()._emission is None
+    assert np.array_equal(from_binary.compile().emission,
+                          from_json.compile().emission)
+
+
+def test_parameters_round_trip(tmp_path):
+    binary_file = str(tmp_path / 'toy.hmmb')
+    hmm_binary.convert(TOY, binary_file)
+    with open(TOY, 'r') as f:
+        original = json.load(f)
+    parameters = hmm_binary.load(binary_file).parameters()
+    assert parameters['S'] == original['S']
+    assert list(parameters['O']) == original['O']
+    assert parameters['P_trans'] == original['P_trans']
+    for s, row in original['P_emission'].items():
+        assert dict(parameters['P_emission'][s]) == \
+            {o: p for o, p in row.items() if p}
+
+
+def test_cache_dir_is_read_when_used(tmp_path, monkeypatch):
+    monkeypatch.setenv('HMM_CACHE_DIR', str(tmp_path))
+    path = hmm_binary.cached(TOY)
+    assert os.path.dirname(path) == str(tmp_path)
+    assert hmm_binary.cached(TOY) == path
+    model = hmm.HMM(TOY, backend='numpy', model_cache=True)
+    assert model.viterbi_algorithm(['Jane', 'Will', 'Spot', 'Will']) == \
+        hmm.HMM(TOY).viterbi_algorithm(['Jane', 'Will', 'Spot', 'Will'])
+
+
+def test_model_cache_loads_the_file_written_before(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    first = hmm.HMM(TOY, backend='numpy', model_cache=cache_dir)
+    [name] = os.listdir(cache_dir)
+    path = os.path.join(cache_dir, name)
+    os.utime(path, ns=(0, 0))
+    inode = os.stat(path).st_ino
+    second = hmm.HMM(TOY, backend='numpy', model_cache=cache_dir)
+    assert os.listdir(cache_dir) == [name]
+    assert os.stat(path).st_mtime_ns == 0
+    assert os.stat(path).st_ino == inode
+    assert second.model_version() == first.model_version()
@@ -0,0 +1,66 @@
+""" tests of the instrumentation of hmm_metrics """
+
+import json
+import os
+
+import hmm
+import hmm_metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOY = os.path.join(ROOT, 'toy_pos_tagger.json')
+SEQUENCE = ['Jane', 'Will', 'Spot', 'Will']
+
+
+def test_nothing_is_recorded_when_disabled():
+    model = hmm.HMM(TOY)
+    instrumentation = model.enable_instrumentation()
+    model.disable_instrumentation()
+    events = []
+    instrumentation.add_sink(events.append)
+    model.posterior_decode(SEQUENCE)
+    model.viterbi_batch([SEQUENCE])
+    assert events == []
+    assert instrumentation.counters['calls'] == 0
+    assert instrumentation.timers == {}
+
+
+def test_nested_calls_are_counted_once():
+    model = hmm.HMM(TOY)
+    instrumentation = model.enable_instrumentation()
+    model.decode(SEQUENCE, mode='posterior')
+    model.decode(SEQUENCE, mode='kbest', k=2)
+    assert instrumentation.depth == 0
+    assert instrumentation.counters['calls'] == 2
+    assert instrumentation.counters['tokens'] == 2 * len(SEQUENCE)
+    assert set(instrumentation.timers) == {'decode'}
+    assert instrumentation.timers['decode']['calls'] == 2
+
+
+def test_collapses_are_found_only_when_asked():
+    model = hmm.HMM(TOY)
+    instrumentation = model.enable_instrumentation()
+    model.posterior_decode(['Jane', 'unknown'])
+    assert instrumentation.counters['zero_collapses'] == 0
+    instrumentation = model.enable_instrumentation(
+        hmm_metrics.Instrumentation(check_collapse=True))
+    model.posterior_decode(['Jane', 'unknown'])
+    assert instrumentation.counters['zero_collapses'] == 1
+    assert instrumentation.collapses == [
+        ('posterior_decode', ['Jane', 'unknown'], 1)]
+
+
+def test_json_lines_sink_writes_one_record_per_event(tmp_path):
+    filename = str(tmp_path / 'events.jsonl')
+    sink = hmm_metrics.JSONLinesSink(filename)
+    model = hmm.HMM(TOY)
+    model.enable_instrumentation(hmm_metrics.Instrumentation([sink]))
+    model.posterior_decode(SEQUENCE)
+    model.viterbi_batch([SEQUENCE, SEQUENCE[:2]])
+    model.decode(SEQUENCE, mode='posterior')
+    sink.close()
+    with open(filename, 'r') as f:
+        records = [json.loads(line) for line in f]
+    assert [r['method'] for r in records] == \
+        ['posterior_decode', 'viterbi_batch', 'decode']
+    assert [r['tokens'] for r in records] == [4, 6, 4]
+    assert all('sequence' not in r for r in records)
@@ -0,0 +1,91 @@
+""" tests of the emission smoothing methods of hmm_trainer """
+
+import os
+
+import pytest
+
+import hmm_trainer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+
+
+def trainer_with(smoothing):
+    trainer = hmm_trainer.train([DEV], smoothing)
+    trainer.register_pairs(TEST)
+    return trainer
+
+
+@pytest.mark.parametrize('smoothing', [hmm_trainer.WittenBell(),
+                                       hmm_trainer.KneserNey(),
+                                       hmm_trainer.KneserNey(1.5)])
+def test_smoothed_rows_cover_the_vocabulary(smoothing):
+    trainer = trainer_with(smoothing)
+    P_emission = trainer.parameters()['P_emission']
+    unseen = [o for o in trainer.vocabulary
+              if not trainer.continuation_counts()[o]]
+    assert unseen
+    for s, row in P_emission.items():
+        assert set(row) == set(trainer.vocabulary)
+        assert all(p > 0 for p in row.values())
+        assert sum(row.values()) == pytest.approx(1)
+
+
+def test_transition_and_unsmoothed_rows_sum_to_one():
+    trainer = trainer_with(hmm_trainer.MaximumLikelihood())
+    parameters = trainer.parameters()
+    for prev, row in parameters['P_trans'].items():
+        if trainer.transitions[prev]:
+            assert sum(row.values()) == pytest.approx(1)
+    for s, row in parameters['P_emission'].items():
+        if sum(trainer.emissions[s].values()):
+            assert sum(row.values()) == pytest.approx(1)
+
+
+def write_shards(directory, lines, n_shards, name='part-%04d.json'):
+    """ split lines into n_shards JSONL files in directory """
+    directory.mkdir(parents=True, exist_ok=True)
+    size = -(-len(lines) // n_shards)
+    shards = []
+    for i in range(n_shards):
+        shard = directory / (name % i)
+        shard.write_text(''.join(lines[i * size:(i + 1) * size]))
+        shards.append(str(shard))
+    return shards
+
+
+@pytest.fixture(scope='module')
+def dev_lines():
+    with open(DEV, 'r') as f:
+        return f.readlines()[:1200]
+
+
+def test_count_shards_matches_serial_training(tmp_path, dev_lines):
+    shards = write_shards(tmp_path, dev_lines, 3)
+    serial = hmm_trainer.train(shards, hmm_trainer.AddAlpha())
+    parallel = hmm_trainer.count_shards(shards, 2, hmm_trainer.AddAlpha())
+    assert parallel.parameters() == serial.parameters()
+    assert parallel.sources == serial.sources
+
+
+def test_folding_in_a_shard_matches_counting_everything(tmp_path,
+                                                        dev_lines):
+    directory = tmp_path / 'shards'
+    shards = write_shards(directory, dev_lines, 3)
+    counts = str(tmp_path / 'counts.json')
+    hmm_trainer.train(shards[:2]).save_counts(counts)
+    trainer = hmm_trainer.HMMTrainer.load_counts(counts)
+    assert hmm_trainer.count_new_shards(trainer, [str(directory)]) == \
+        shards[2:]
+    assert trainer.parameters() == hmm_trainer.train(shards).parameters()
+    assert hmm_trainer.count_new_shards(trainer, [str(directory)]) == []
+
+
+def test_shards_with_the_same_name_are_both_counted(tmp_path, dev_lines):
+    first = write_shards(tmp_path / 'a', dev_lines[:600], 1)
+    second = write_shards(tmp_path / 'b', dev_lines[600:], 1)
+    trainer = hmm_trainer.train(first)
+    assert hmm_trainer.count_new_shards(trainer, second) == second
+    assert trainer.parameters() == \
+        hmm_trainer.train(first + second).parameters()
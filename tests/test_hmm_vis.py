@@ -0,0 +1,73 @@
+""" headless tests of the SVG backend of hmm_vis and of render_mistagged """
+
+import json
+import os
+
+import hmm
+import hmm_trainer
+import hmm_vis
+import render_mistagged
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOY = os.path.join(ROOT, 'toy_pos_tagger.json')
+DEV = os.path.join(ROOT, 'twt.dev.json')
+FIRST = ['Jane', 'Will', 'Spot', 'Will']
+SECOND = ['Mary', 'See']
+
+
+def highlight(trellis, path):
+    """ highlight the nodes and edges of path on trellis """
+    previous = '<S>'
+    for t, tag in enumerate(path):
+        trellis.highlight_node(t + 1, tag, color='red')
+        trellis.highlight_edge(t, previous, tag, color='red')
+        previous = tag
+    return trellis
+
+
+def draw(S, tokens, path, **options):
+    """ a new trellis of tokens with path highlighted """
+    trellis = hmm_vis.Trellis().render(S, tokens, backend='svg', **options)
+    return highlight(trellis, path)
+
+
+def test_trellises_do_not_share_state():
+    model = hmm.HMM(TOY)
+    first_path = model.viterbi_algorithm(FIRST)
+    second_path = model.viterbi_algorithm(SECOND)
+    alone = [draw(model.S, FIRST, first_path).diagram.to_svg(),
+             draw(model.S, SECOND, second_path).diagram.to_svg()]
+    first = hmm_vis.Trellis().render(model.S, FIRST, backend='svg')
+    second = draw(model.S, SECOND, second_path)
+    highlight(first, first_path)
+    assert first.diagram is not second.diagram
+    assert len(first.x_values) != len(second.x_values)
+    assert [first.diagram.to_svg(), second.diagram.to_svg()] == alone
+
+
+def test_select_edges_drops_edges():
+    model = hmm.HMM(TOY)
+    counts = {}
+    for top_k in (None, 1):
+        trellis = hmm_vis.Trellis().render(
+            model.S, FIRST, backend='svg',
+            edge_filter=hmm_vis.select_edges(model.P_trans, top_k))
+        counts[top_k] = len(trellis.edge_items)
+    unfiltered = hmm_vis.Trellis().render(model.S, FIRST, backend='svg')
+    assert counts[1] < counts[None] < len(unfiltered.edge_items)
+
+
+def test_render_mistagged_writes_svg_files(tmp_path):
+    model_file = str(tmp_path / 'model.json')
+    hmm_trainer.train([DEV], hmm_trainer.AddAlpha()).write_model(model_file)
+    output_dir = str(tmp_path / 'out')
+    entries = render_mistagged.render_all(model_file, DEV, output_dir,
+                                          limit=3, workers=2)
+    assert len(entries) == 3
+    for entry in entries:
+        with open(os.path.join(output_dir, entry['file']), 'r') as f:
+            svg = f.read()
+        assert svg.startswith('<svg') and 'red' in svg
+        assert entry['errors'] > 0
+    with open(os.path.join(output_dir, 'index.json'), 'r') as f:
+        assert [json.loads(line) for line in f] == entries
@@ -0,0 +1,77 @@
+""" tests of the model swaps, shadowing and rollback of model_registry """
+
+import json
+import os
+
+import pytest
+
+import hmm
+import model_registry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOY = os.path.join(ROOT, 'toy_pos_tagger.json')
+SEQUENCES = [['Jane', 'Will', 'Spot', 'Will'], ['Mary', 'Can', 'See', 'Pat'],
+             ['Will', 'Spot']]
+
+
+@pytest.fixture
+def files(tmp_path):
+    """ toy_pos_tagger.json and a copy in which 'Will' is always a verb """
+    with open(TOY, 'r') as f:
+        parameters = json.load(f)
+    for s, row in parameters['P_emission'].items():
+        if 'Will' in row:
+            row['Will'] = 1.0 if s == 'V' else 0.0
+    changed = str(tmp_path / 'changed.json')
+    with open(changed, 'w') as f:
+        json.dump(parameters, f)
+    return TOY, changed
+
+
+def test_a_snapshot_read_before_a_swap_keeps_its_model(files):
+    old_file, new_file = files
+    registry = model_registry.ModelRegistry(seed=0)
+    old = registry.promote(registry.load(old_file).version)
+    snapshot = registry.active
+    new = registry.promote(registry.load(new_file).version)
+    assert new.version != old.version
+    assert registry.active is new
+    assert snapshot is old
+    expected_old = hmm.HMM(old_file).viterbi_batch(SEQUENCES)
+    expected_new = hmm.HMM(new_file).viterbi_batch(SEQUENCES)
+    assert expected_old != expected_new
+    assert snapshot.model.viterbi_batch(SEQUENCES) == expected_old
+    assert registry.viterbi_batch(SEQUENCES) == expected_new
+
+
+def test_promote_shadow_needs_min_tokens(files):
+    old_file, new_file = files
+    registry = model_registry.ModelRegistry(seed=0)
+    registry.promote(registry.load(old_file).version)
+    candidate = registry.load(new_file)
+    registry.start_shadow(candidate.version, sample=1.0)
+    assert not registry.promote_shadow(min_agreement=0.0, min_tokens=0)
+    registry.viterbi_batch(SEQUENCES)
+    n_tokens = sum(len(seq) for seq in SEQUENCES)
+    assert registry.shadow_stats.tokens == n_tokens
+    assert not registry.promote_shadow(0.0, min_tokens=n_tokens + 1)
+    assert not registry.promote_shadow(1.0, min_tokens=n_tokens)
+    assert registry.shadow is candidate
+    assert registry.promote_shadow(0.0, min_tokens=n_tokens)
+    assert registry.active is candidate
+    assert registry.shadow is None
+
+
+def test_rollback_restores_the_previous_version(files):
+    old_file, new_file = files
+    registry = model_registry.ModelRegistry(seed=0)
+    with pytest.raises(KeyError):
+        registry.rollback()
+    old = registry.promote(registry.load(old_file).version)
+    new = registry.promote(registry.load(new_file).version)
+    assert registry.previous is old
+    assert registry.rollback() is old
+    assert registry.active is old
+    assert registry.previous is new
+    assert registry.viterbi_batch(SEQUENCES) == \
+        hmm.HMM(old_file).viterbi_batch(SEQUENCES)
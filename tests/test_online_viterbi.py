@@ -0,0 +1,73 @@
+""" tests of the streaming decoder of online_viterbi """
+
+import json
+import os
+
+import pytest
+
+import hmm
+import hmm_trainer
+import online_viterbi
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+
+
+@pytest.fixture(scope='module')
+def model():
+    """ a model that gives every test tweet a probability above 0 """
+    trainer = hmm_trainer.train([DEV], hmm_trainer.AddAlpha())
+    trainer.register_pairs(TEST)
+    trained = hmm.HMM(backend='numpy')
+    trained.set_parameters(trainer.parameters())
+    return trained
+
+
+@pytest.fixture(scope='module')
+def tweets():
+    with open(TEST, 'r') as f:
+        return [[item[0] for item in json.loads(line)] for line in f][:300]
+
+
+def stream(decoder, obs_sequence):
+    """ push every token and finish; return all tags """
+    tags = []
+    for obs in obs_sequence:
+        tags += decoder.push(obs)
+    return tags + decoder.finish()
+
+
+@pytest.mark.parametrize('log_space', [False, True])
+def test_push_and_finish_match_batch_viterbi(model, tweets, log_space):
+    decoder = online_viterbi.OnlineViterbi(model, log_space=log_space)
+    batch = model.log_viterbi_algorithm if log_space else \
+        model.viterbi_algorithm
+    for seq in tweets:
+        assert stream(decoder, seq) == batch(seq)
+
+
+def test_default_matches_log_viterbi_on_a_long_stream(model, tweets):
+    long_stream = [obs for seq in tweets for obs in seq]
+    assert len(long_stream) > 3000
+    expected = model.log_viterbi_algorithm(long_stream)
+    assert len(set(expected)) > 10
+    decoder = online_viterbi.OnlineViterbi(model)
+    assert stream(decoder, long_stream) == expected
+
+
+@pytest.mark.parametrize('lag', [1, 2, 5])
+def test_lag_bounds_the_uncommitted_positions(model, tweets, lag):
+    decoder = online_viterbi.OnlineViterbi(model, lag=lag)
+    for seq in tweets[:50]:
+        n_tags = 0
+        for obs in seq:
+            n_tags += len(decoder.push(obs))
+            assert decoder.n_seen - decoder.n_committed <= lag
+            assert n_tags == decoder.n_committed
+        assert n_tags + len(decoder.finish()) == len(seq)
+
+
+def test_lag_below_one_is_rejected(model):
+    with pytest.raises(ValueError):
+        online_viterbi.OnlineViterbi(model, lag=0)
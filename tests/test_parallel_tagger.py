@@ -0,0 +1,60 @@
+""" tests that parallel_tagger tags a corpus as a serial run does """
+
+import json
+import os
+
+import pytest
+
+import hmm
+import hmm_binary
+import hmm_trainer
+import oov_model
+import parallel_tagger
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+CHUNK_SIZE = 97
+
+
+@pytest.fixture(scope='module')
+def model_files(tmp_path_factory):
+    """ a JSON model trained on twt.dev.json and its binary form """
+    directory = tmp_path_factory.mktemp('models')
+    json_file = str(directory / 'model.json')
+    hmm_trainer.train([DEV], hmm_trainer.MaximumLikelihood()).write_model(
+        json_file)
+    binary_file = str(directory / 'model.hmmb')
+    hmm_binary.convert(json_file, binary_file)
+    return json_file, binary_file
+
+
+@pytest.fixture(scope='module')
+def tweets():
+    with open(TEST, 'r') as f:
+        return [json.loads(line) for line in f]
+
+
+def model_for(model_files, kind):
+    json_file, binary_file = model_files
+    model = hmm.HMM(binary_file if kind == 'binary' else json_file,
+                    backend='numpy')
+    if kind == 'oov':
+        model.set_oov_model(oov_model.train([DEV]))
+    return model
+
+
+@pytest.mark.parametrize('kind', ['json', 'binary', 'oov'])
+def test_tag_corpus_matches_viterbi_batch(model_files, tweets, kind):
+    model = model_for(model_files, kind)
+    serial = model.viterbi_batch([parallel_tagger.tokens_of(tweet)
+                                  for tweet in tweets])
+    tagged = list(parallel_tagger.tag_corpus(model, TEST, workers=2,
+                                             chunk_size=CHUNK_SIZE))
+    assert [tweet for tweet, tags in tagged] == tweets
+    assert [tags for tweet, tags in tagged] == serial
+    correct = sum(tag == item[1] for tweet, tags in zip(tweets, serial)
+                  for item, tag in zip(tweet, tags))
+    total = sum(len(tweet) for tweet in tweets)
+    assert parallel_tagger.evaluate(model, TEST, workers=2,
+                                    chunk_size=CHUNK_SIZE) == (correct, total)
@@ -0,0 +1,92 @@
+""" tests of the HTTP tagging server, driven through tagging_load.Client """
+
+import asyncio
+import os
+
+import hmm
+import tagging_load
+import tagging_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOY = os.path.join(ROOT, 'toy_pos_tagger.json')
+SEQUENCE = ['Jane', 'Will', 'Spot', 'Will']
+
+
+def serve(test, **options):
+    """ run the coroutine function test(port, batcher) against a server
+        on a free port, with MicroBatcher options """
+    async def main():
+        model = hmm.HMM(TOY, backend='numpy')
+        batcher = tagging_server.MicroBatcher(model, **options)
+        batcher.start()
+        server = tagging_server.TaggingServer(batcher)
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            return await test(port, batcher)
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            await batcher.stop()
+    return asyncio.run(main())
+
+
+async def request(port, method, path, payload=None):
+    client = tagging_load.Client(port=port)
+    try:
+        return await client.request(method, path, payload)
+    finally:
+        await client.close()
+
+
+def test_status_codes(monkeypatch):
+    monkeypatch.setattr(tagging_server, 'MAX_BODY', 1000)
+
+    async def test(port, batcher):
+        model = hmm.HMM(TOY)
+        status, result = await request(port, 'POST', '/tag',
+                                       {'tokens': SEQUENCE, 'beliefs': True})
+        assert status == 200
+        assert result['tags'] == model.viterbi_algorithm(SEQUENCE)
+        assert len(result['beliefs']) == len(SEQUENCE)
+        assert result['states'] == ['N', 'M', 'V']
+        assert (await request(port, 'POST', '/tag', SEQUENCE))[0] == 200
+        assert (await request(port, 'GET', '/stats'))[0] == 200
+        for payload in ({'tokens': 'Jane'}, {'tokens': [1, 2]},
+                        {'words': SEQUENCE}, 'Jane'):
+            status, result = await request(port, 'POST', '/tag', payload)
+            assert status == 400 and 'error' in result
+        assert (await request(port, 'GET', '/nowhere'))[0] == 404
+        assert (await request(port, 'GET', '/tag'))[0] == 405
+        assert (await request(port, 'POST', '/stats'))[0] == 405
+        status, result = await request(port, 'POST', '/tag',
+                                       {'tokens': ['Jane'] * 500})
+        assert status == 413
+    serve(test)
+
+
+def test_overload_is_refused_with_503():
+    async def test(port, batcher):
+        results = await asyncio.gather(*[
+            request(port, 'POST', '/tag', SEQUENCE) for i in range(6)])
+        statuses = sorted(status for status, result in results)
+        assert statuses[0] == 200
+        assert statuses.count(503) >= 4
+        assert batcher.counters['rejected'] == statuses.count(503)
+    serve(test, max_pending=1, max_wait=0.2)
+
+
+def test_concurrent_requests_are_coalesced():
+    async def test(port, batcher):
+        results = await asyncio.gather(*[
+            request(port, 'POST', '/tag', SEQUENCE[:i % 4 + 1])
+            for i in range(20)])
+        model = hmm.HMM(TOY)
+        for i, (status, result) in enumerate(results):
+            assert status == 200
+            assert result['tags'] == \
+                model.viterbi_algorithm(SEQUENCE[:i % 4 + 1])
+        stats = (await request(port, 'GET', '/stats'))[1]
+        assert stats['requests'] == 20
+        assert stats['mean_batch'] > 1
+    serve(test, max_wait=0.05)
@@ -0,0 +1,58 @@
+""" tests of the trigram trainer and decoder of trigram_hmm """
+
+import json
+import os
+
+import pytest
+
+import hmm_trainer
+import trigram_hmm
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEV = os.path.join(ROOT, 'twt.dev.json')
+TEST = os.path.join(ROOT, 'twt.test.json')
+
+
+def load_sequences(filename, limit):
+    with open(filename, 'r') as f:
+        return [[item[0] for item in json.loads(line)]
+                for line, _ in zip(f, range(limit))]
+
+
+@pytest.fixture(scope='module')
+def unsmoothed():
+    """ an unsmoothed trigram model from twt.dev.json, under which most
+        test tweets have probability 0 """
+    return trigram_hmm.train([DEV]).parameters()
+
+
+def decoder(parameters, **options):
+    model = trigram_hmm.TrigramHMM(**options)
+    model.set_parameters(parameters)
+    return model
+
+
+@pytest.mark.parametrize('beam', [None, 1e300])
+def test_pruned_decoder_matches_exhaustive(unsmoothed, beam):
+    exhaustive = decoder(unsmoothed, prune=False)
+    pruned = decoder(unsmoothed, beam=beam)
+    seqs = load_sequences(TEST, 200)
+    for seq in seqs:
+        assert pruned.viterbi_algorithm(seq) == \
+            exhaustive.viterbi_algorithm(seq)
+
+
+def test_count_shards_makes_trigram_trainers(tmp_path):
+    with open(DEV, 'r') as f:
+        lines = f.readlines()[:400]
+    shards = []
+    for i in range(2):
+        shard = tmp_path / ('shard%d.json' % i)
+        shard.write_text(''.join(lines[i * 200:(i + 1) * 200]))
+        shards.append(str(shard))
+    serial = trigram_hmm.train(shards)
+    parallel = hmm_trainer.count_shards(
+        shards, 2, trainer=trigram_hmm.TrigramTrainer())
+    assert parallel.get_counts() == serial.get_counts()
+    assert trigram_hmm.train(shards, workers=2).get_counts() == \
+        serial.get_counts()
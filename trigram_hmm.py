@@ -0,0 +1,297 @@
+"""trigram_hmm.py
+
+A second-order (trigram) HMM tagger: the probability of a tag depends on
+the two tags before it, P(t_i | t_i-2, t_i-1), instead of only on the
+previous one.
+
+TrigramTrainer extends hmm_trainer.HMMTrainer with counts of tag trigrams,
+the first two tags of a tweet being preceded by <S> <S>.  The trigram,
+bigram and unigram estimates are combined by deleted interpolation, as in
+the TnT tagger (Brants, 2000):
+
+    P(t3 | t1, t2) = l3 * P(t3 | t1, t2) + l2 * P(t3 | t2) + l1 * P(t3)
+
+where the weights are found from the training counts themselves: each
+trigram votes, with its count, for the estimate that predicts it best once
+that one occurrence is taken out.  A trigram model file holds everything a
+first-order model file holds (S, O, P_trans, P_emission), which hmm.HMM can
+still load, plus 'lambdas', 'P_uni' and 'P_tri'.
+
+TrigramHMM decodes with the Viterbi algorithm over pairs of tags, in log
+space.  Done naively that is |S|^3 steps per token.  Instead, at each
+position only the tags that can emit the word are expanded (as with
+HMM.allowed_states), so only pairs of such tags are scored.  Since most
+words allow one to three tags, this brings the cost close to that of the
+first-order decoder.  The tags left out have probability 0 there, so the
+result is that of the exhaustive decoder (prune=False): the same best
+path, with ties broken the same way.  When every path has probability 0,
+the exhaustive decoder's choice among them depends on the tags left out,
+so such a sequence is decoded again without pruning.  Optionally, pairs
+whose score is more than beam times worse than the best pair are also
+dropped, and tags left without any pair are not extended; that is not
+exact.  As in hmm.py, the transition into <E> is not part of the score.
+
+Usage:
+    python trigram_hmm.py model.json corpus.json ...
+        [--smoothing none|add-alpha|witten-bell|kneser-ney] [--alpha A]
+        [--register pairs.json] [--workers N]
+"""
+
+import json
+import math
+from collections import Counter
+
+import numpy as np
+
+import hmm
+import hmm_trainer
+
+
+class TrigramTrainer(hmm_trainer.HMMTrainer):
+    """ accumulates tag trigram counts on top of those of HMMTrainer """
+
+    def __init__(self, S=hmm_trainer.TWITTER_S, smoothing=None):
+        super().__init__(S, smoothing)
+        self.trigrams = {}
+
+    def count_tweet(self, twt):
+        """ add the counts of one tweet, a list of [word, tag] pairs """
+        super().count_tweet(twt)
+        tags = ['<S>', '<S>'] + [s for o, s in twt] + ['<E>']
+        trigrams = self.trigrams
+        for t1, t2, t3 in zip(tags, tags[1:], tags[2:]):
+            trigrams.setdefault(t1, {}).setdefault(t2, Counter())[t3] += 1
+
+    def merge(self, other):
+        """ add the counts of another trainer, as HMMTrainer.merge """
+        super().merge(other)
+        for t1, rows in other.trigrams.items():
+            for t2, counts in rows.items():
+                self.trigrams.setdefault(t1, {}).setdefault(
+                    t2, Counter()).update(counts)
+        return self
+
+    def get_counts(self):
+        """ the raw counts, trigrams included, as a dict for JSON """
+        saved = super().get_counts()
+        saved['trigrams'] = self.trigrams
+        return saved
+
+    def set_counts(self, saved):
+        """ replace the counts with those of a dict from get_counts """
+        super().set_counts(saved)
+        self.trigrams = {t1: {t2: Counter(counts)
+                              for t2, counts in rows.items()}
+                         for t1, rows in saved['trigrams'].items()}
+
+    def unigram_counts(self):
+        """ the number of times each tag, or <E>, follows another tag """
+        unigrams = Counter()
+        for counts in self.transitions.values():
+            unigrams.update(counts)
+        return unigrams
+
+    def lambdas(self):
+        """ the deleted-interpolation weights [l1, l2, l3] of the unigram,
+            bigram and trigram estimates """
+        unigrams = self.unigram_counts()
+        n = sum(unigrams.values())
+        weights = [0, 0, 0]
+        for t1, rows in self.trigrams.items():
+            for t2, counts in rows.items():
+                context2 = sum(counts.values())
+                context1 = sum(self.transitions[t2].values())
+                for t3, c in counts.items():
+                    scores = [
+                        (unigrams[t3] - 1) / (n - 1) if n > 1 else 0,
+                        (self.transitions[t2][t3] - 1) / (context1 - 1)
+                        if context1 > 1 else 0,
+                        (c - 1) / (context2 - 1) if context2 > 1 else 0]
+                    weights[scores.index(max(scores))] += c
+        total = sum(weights)
+        return [w / total for w in weights] if total else [0, 0, 1]
+
+    def parameters(self):
+        """ the first-order parameters of HMMTrainer plus 'lambdas', 'P_uni'
+            and 'P_tri', the maximum-likelihood trigram probabilities """
+        parameters = super().parameters()
+        unigrams = self.unigram_counts()
+        n = sum(unigrams.values())
+        parameters['lambdas'] = self.lambdas()
+        parameters['P_uni'] = {t: c / n for t, c in unigrams.items()}
+        parameters['P_tri'] = {
+            t1: {t2: {t3: c / sum(counts.values())
+                      for t3, c in counts.items()}
+                 for t2, counts in rows.items()}
+            for t1, rows in self.trigrams.items()}
+        return parameters
+
+
+class TrigramHMM:
+    """ second-order HMM with a pruned Viterbi decoder over tag pairs """
+
+    def __init__(self, filename=None, beam=None, prune=True):
+        """ beam is the largest ratio between the best pair score and a
+            pair that is kept, or None (the default) to keep every pair.
+            With prune unset, every tag is expanded at every position. """
+        self.beam = beam
+        self.prune = prune
+        self.first_order = None
+        self.states = None
+        self.log_trans = None
+        if filename is not None:
+            self.load_parameters(filename)
+
+    def load_parameters(self, filename):
+        """ load the parameters from a JSON model file """
+        with open(filename, 'r') as f:
+            self.set_parameters(json.load(f))
+
+    def set_parameters(self, parameters):
+        """ use a dict such as TrigramTrainer.parameters returns.  The
+            emissions, and the vocabulary, are those of the first-order
+            HMM made from the same parameters. """
+        self.first_order = hmm.HMM(backend='numpy')
+        self.first_order.set_parameters(parameters)
+        compiled = self.first_order.compile()
+        self.states = compiled.states
+        # Contexts are the real states followed by <S>.
+        contexts = list(self.states) + ['<S>']
+        l1, l2, l3 = parameters['lambdas']
+        P_uni = parameters['P_uni']
+        P_bi = parameters['P_trans']
+        P_tri = parameters['P_tri']
+        unigram = np.array([P_uni.get(s, 0) for s in self.states])
+        bigram = np.array([[P_bi.get(t2, {}).get(s, 0) for s in self.states]
+                           for t2 in contexts])
+        trans = np.empty((len(contexts), len(contexts), len(self.states)))
+        trans[...] = l1 * unigram + l2 * bigram
+        for i, t1 in enumerate(contexts):
+            for j, t2 in enumerate(contexts):
+                row = P_tri.get(t1, {}).get(t2)
+                if row:
+                    trans[i, j] += l3 * np.array(
+                        [row.get(s, 0) for s in self.states])
+        with np.errstate(divide='ignore'):
+            self.log_trans = np.log(trans)
+
+    def set_oov_model(self, oov_model):
+        """ score unknown words with an oov_model.OOVModel, as in hmm.HMM """
+        self.first_order.set_oov_model(oov_model)
+
+    def viterbi_algorithm(self, obs_sequence):
+        """ return the most probable state sequence, as a list of states """
+        n_steps = len(obs_sequence)
+        if n_steps == 0:
+            return []
+        compiled = self.first_order.compile()
+        with np.errstate(divide='ignore'):
+            log_e = np.log(compiled.emissions(obs_sequence))
+        all_states = np.arange(len(self.states))
+        if not self.prune:
+            return self._viterbi(log_e, [all_states] * n_steps)[1]
+        # Expand the tags that can emit each word, or every tag if none
+        # can.
+        allowed = log_e > -math.inf
+        allowed[~allowed.any(axis=1)] = True
+        score, path = self._viterbi(log_e, [all_states[row]
+                                            for row in allowed], self.beam)
+        if score == -math.inf:
+            # Every path has probability 0: break the tie as the
+            # exhaustive decoder does.
+            path = self._viterbi(log_e, [all_states] * n_steps)[1]
+        return path
+
+    def _viterbi(self, log_e, candidates, beam=None):
+        """ the best log score and path, as a list of states, given the
+            log emissions of each position and the tags expanded there """
+        n_steps = len(log_e)
+        log_trans = self.log_trans
+        start = len(self.states)
+        # delta[a, b] scores the best path whose last two tags are
+        # labels[t - 1][a] and labels[t][b]; the tag before the first is
+        # <S>.  back_ptrs[t][a, b] is the index in labels[t - 2] of the tag
+        # before those two.
+        labels = [np.array([start]), candidates[0]]
+        delta = log_trans[start, start, labels[1]][None, :] + \
+            log_e[0, labels[1]]
+        delta = self._beam(delta, labels, None, beam)[0]
+        back_ptrs = [None, None]
+        for t in range(1, n_steps):
+            current = candidates[t]
+            scores = delta[:, :, None] + \
+                log_trans[labels[-2][:, None, None], labels[-1][:, None],
+                          current] + log_e[t, current]
+            best = scores.argmax(axis=0)
+            delta = scores.max(axis=0)
+            labels.append(current)
+            delta, best = self._beam(delta, labels, best, beam)
+            back_ptrs.append(best)
+        a, b = np.unravel_index(delta.argmax(), delta.shape)
+        score = delta[a, b]
+        path = [int(labels[-1][b]), int(labels[-2][a])]
+        for t in range(n_steps, 1, -1):
+            a, b = back_ptrs[t][a, b], a
+            path.append(int(labels[t - 2][a]))
+        states = self.states
+        return score, [states[i] for i in reversed(path[:n_steps])]
+
+    def _beam(self, delta, labels, best, beam):
+        """ give the pairs that score more than beam times below the best
+            pair a score of -inf, and drop the newest tags left without any
+            pair from delta, labels[-1] and best """
+        if beam is None:
+            return delta, best
+        threshold = delta.max() - math.log(beam)
+        if threshold == -math.inf:
+            return delta, best
+        delta = np.where(delta >= threshold, delta, -math.inf)
+        keep = (delta > -math.inf).any(axis=0)
+        if keep.all():
+            return delta, best
+        labels[-1] = labels[-1][keep]
+        return delta[:, keep], None if best is None else best[:, keep]
+
+    def viterbi_batch(self, obs_sequences):
+        """ viterbi_algorithm for each sequence """
+        return [self.viterbi_algorithm(seq) for seq in obs_sequences]
+
+
+def train(filenames, smoothing=None, S=hmm_trainer.TWITTER_S, workers=1):
+    """ count every JSONL file in filenames and return the TrigramTrainer.
+        With more than one worker, the files are counted in parallel by
+        hmm_trainer.count_shards. """
+    trainer = TrigramTrainer(S, smoothing)
+    if workers > 1:
+        return hmm_trainer.count_shards(filenames, workers, trainer=trainer)
+    for filename in filenames:
+        trainer.count_file(filename)
+    return trainer
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Train a trigram HMM POS tagger from JSONL files of '
+                    'tagged tweets.')
+    parser.add_argument('output', help='JSON model file to write')
+    parser.add_argument('corpus', nargs='+', help='JSONL training files')
+    parser.add_argument('--smoothing', default='none',
+                        choices=sorted(hmm_trainer.SMOOTHING))
+    parser.add_argument('--alpha', type=float, default=1,
+                        help='alpha for add-alpha smoothing')
+    parser.add_argument('--register', default=None,
+                        help='JSONL file whose (tag, word) pairs get '
+                             'smoothed probability mass, as '
+                             'build_twitter_hmm_laplace.py does')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='count the corpus files in this many processes')
+    args = parser.parse_args()
+    if args.smoothing == 'add-alpha':
+        smoothing = hmm_trainer.AddAlpha(args.alpha)
+    else:
+        smoothing = hmm_trainer.SMOOTHING[args.smoothing]()
+    trainer = train(args.corpus, smoothing, workers=args.workers)
+    if args.register is not None:
+        trainer.register_pairs(args.register)
+    trainer.write_model(args.output)